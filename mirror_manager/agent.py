@@ -0,0 +1,592 @@
+# -*- coding: utf-8 -*-
+"""常驻后台代理 - 镜像目录、已检测的当前配置、测试缓存与 pip 缓存代理常驻后台进程，界面和脚本连接后立即可用
+
+每次启动单文件 exe 都要重新解压、导入 PyQt6、检测配置，并从零开始测试。常驻代理启动后：
+
+- 镜像目录与各生态的当前配置常驻内存，由配置变化监测（``configwatch``）保持最新
+- 测试在代理进程中执行，解析缓存、各主机的延迟分布、直连/代理比较与对冲统计都保持热状态
+- pip 本地缓存代理及其上游健康检查在代理进程中运行，关闭界面后仍然可用
+- 网络切换监测（``netwatch``）在代理进程中丢弃旧网络的测试结果
+
+IPC 使用 ``multiprocessing.connection``：Windows 为命名管道 ``\\\\.\\pipe\\MirrorManager-<用户名>``，
+其他系统为数据目录下的 Unix 套接字 ``agent.sock``；连接时用数据目录中的 ``agent.key``（仅本用户可读，
+每次启动代理时更换）做 HMAC 认证。协议为一问一答的 JSON：
+请求 ``{"op": 名称, "args": {...}}``，响应 ``{"ok": true, "result": ...}`` 或 ``{"ok": false, "error": 说明}``。
+"""
+import argparse
+import getpass
+import json
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import configwatch
+import ecosystems
+import netwatch
+import pip_proxy
+import resolver
+import routes
+from catalog import CatalogError, MirrorCatalog
+from catalog_sync import ENV_CATALOG_URL, CatalogSync
+from executor import StepResult, format_timings, run_steps
+from paths import base_dir, data_dir
+from probes import HEDGE_STATS, ProbeResult
+from sysenv import is_admin
+from tracing import span
+
+logger = logging.getLogger("mirror_manager.agent")
+
+ENV_AGENT = "MIRROR_MANAGER_AGENT"
+PROTOCOL_VERSION = 1
+KEY_NAME = "agent.key"
+SOCKET_NAME = "agent.sock"
+LOG_NAME = "agent.log"
+# 后台启动后等待可连接的秒数
+START_TIMEOUT = 15
+# 请求超时（秒）；应用配置可能包含补测与调优，单独放宽
+REQUEST_TIMEOUT = 60
+APPLY_TIMEOUT = 600
+
+
+class AgentError(Exception):
+    """代理未运行、连接失败或请求出错"""
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """注册常驻代理相关的命令行参数"""
+    group = parser.add_argument_group("常驻代理")
+    group.add_argument(
+        "--agent", choices=["auto", "start", "off"], default=None,
+        help="连接常驻代理：auto 连接已运行的（默认），start 未运行时先在后台启动，off 不使用"
+             f"（也可用环境变量 {ENV_AGENT}）"
+    )
+    group.add_argument("--agent-serve", action="store_true", help="作为常驻代理运行（不显示窗口）")
+
+
+def mode_from(args: argparse.Namespace, environ) -> str:
+    return args.agent or environ.get(ENV_AGENT) or "auto"
+
+
+def address() -> Tuple[str, str]:
+    """(IPC 地址, 地址族)"""
+    if sys.platform == "win32":
+        return rf"\\.\pipe\MirrorManager-{getpass.getuser()}", "AF_PIPE"
+    return os.path.join(data_dir(), SOCKET_NAME), "AF_UNIX"
+
+
+def _key_path() -> str:
+    return os.path.join(data_dir(), KEY_NAME)
+
+
+def _read_key() -> Optional[bytes]:
+    try:
+        with open(_key_path(), "rb") as f:
+            return f.read() or None
+    except FileNotFoundError:
+        return None
+
+
+def _new_key() -> bytes:
+    """生成认证密钥并写入只有本用户可读的文件"""
+    key = secrets.token_bytes(32)
+    path = _key_path()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    if sys.platform != "win32":
+        os.chmod(path, 0o600)
+    return key
+
+
+# ============ 共用操作 ============
+def measure(key: str, url: str) -> Tuple[ProbeResult, List[str]]:
+    """测试镜像，并汇总状态行提示用的路径信息
+
+    包括各地址族的最佳地址（pip 按解析顺序依次连接，优先地址族不通时会先等超时）、
+    直连/代理比较、对冲与解析缓存统计。
+    """
+    result = ecosystems.get(key).measure(url)
+    parts = urllib.parse.urlsplit(url)
+    lines = []
+    if parts.hostname:
+        port = parts.port or (80 if parts.scheme == "http" else 443)
+        lines.extend(resolver.compare_paths(parts.hostname, port).describe())
+    comparison = routes.ROUTES.get(url)
+    if comparison is not None and routes.system_proxy(url):
+        lines.append(comparison.describe())
+    lines.append(f"对冲请求：{HEDGE_STATS.summary()}")
+    lines.append(resolver.DNS_CACHE.summary())
+    return result, lines
+
+
+def system_warnings(ecos: Sequence) -> List[str]:
+    """存在系统级配置且没有管理员权限时的提示（环境变量仍优先生效，不阻止操作）"""
+    labels = [eco.label for eco in ecos if eco.system_override()]
+    if labels and not is_admin():
+        return [f"检测到系统级配置 ({', '.join(labels)})，环境变量将优先生效"]
+    return []
+
+
+def load_catalog() -> MirrorCatalog:
+    """远程目录的缓存副本优先，否则读取程序目录的 mirrors.json"""
+    config_path = os.path.join(base_dir(), "mirrors.json")
+    catalog_url = os.environ.get(ENV_CATALOG_URL)
+    if catalog_url:
+        catalog = CatalogSync(catalog_url, config_path).load_cached()
+        if catalog is not None:
+            return catalog
+    with open(config_path, "r", encoding="utf-8") as f:
+        return MirrorCatalog.from_config(json.load(f))
+
+
+# ============ 代理进程 ============
+class AgentState:
+    """代理进程中的镜像目录与各生态的当前配置"""
+
+    def __init__(self, catalog: MirrorCatalog):
+        self._lock = threading.Lock()
+        self._current: Dict[str, Dict] = {}
+        self.catalog = catalog
+        self.ecos = ecosystems.available(catalog.types())
+        self.set_catalog(catalog)
+
+    def set_catalog(self, catalog: MirrorCatalog):
+        """更新目录（生态集合不变，只更新各生态的候选镜像）"""
+        self.catalog = catalog
+        for eco in self.ecos:
+            eco.candidates = [e.url for e in catalog.entries(eco.key) if e.url]
+
+    def refresh(self, keys: Optional[Sequence[str]] = None):
+        """重新读取指定生态（默认全部）的当前配置"""
+        for eco in self.ecos:
+            if keys is not None and eco.key not in keys:
+                continue
+            current = {
+                "url": eco.read_current(),
+                "options": eco.read_options() if eco.OPTIONS else {},
+                "note": eco.status_note(),
+            }
+            with self._lock:
+                self._current[eco.key] = current
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return dict(self._current)
+
+
+class AgentServer:
+    """监听本地 IPC，每个连接一个线程，依次处理其中的请求"""
+
+    def __init__(self, state: AgentState):
+        self.state = state
+        self.started = time.time()
+        self._stop = threading.Event()
+        self._apply_lock = threading.Lock()
+        self._key: Optional[bytes] = None
+        self.handlers = {
+            "ping": self.ping,
+            "catalog": self.catalog,
+            "state": self.current_state,
+            "test": self.test,
+            "apply": self.apply,
+            "health": self.health,
+            "shutdown": self.shutdown,
+        }
+
+    # ---------- 请求处理 ----------
+    def ping(self) -> Dict:
+        return {"pid": os.getpid(), "version": PROTOCOL_VERSION,
+                "uptime_s": round(time.time() - self.started, 1)}
+
+    def catalog(self) -> Dict:
+        return self.state.catalog.to_config()
+
+    def current_state(self, refresh: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """各生态的当前配置；refresh 中的生态先重新读取"""
+        if refresh:
+            self.state.refresh(refresh)
+        return self.state.snapshot()
+
+    def test(self, key: str, url: str) -> Dict:
+        if ecosystems.get(key) is None:
+            raise ValueError(f"未知生态: {key}")
+        result, details = measure(key, url)
+        return {"result": result._asdict(), "details": details}
+
+    def apply(self, selection: Dict[str, Optional[str]],
+              options: Optional[Dict[str, Dict[str, bool]]] = None) -> Dict:
+        """执行应用计划（同一时间只执行一个），返回各步骤结果、提示与应用后的配置"""
+        with self._apply_lock:
+            results = run_steps(ecosystems.build_plan(selection, options))
+            logger.info("应用配置:\n%s", format_timings(results))
+            self.state.refresh(list(selection))
+        return {
+            "results": [r._asdict() for r in results],
+            "warnings": system_warnings(self.state.ecos),
+            "state": self.state.snapshot(),
+        }
+
+    def health(self) -> Dict:
+        proxy = pip_proxy.running()
+        return {
+            "pip_proxy": dict(proxy.stats_snapshot(), url=proxy.url) if proxy else None,
+            "hedge": HEDGE_STATS.summary(),
+            "dns": resolver.DNS_CACHE.summary(),
+        }
+
+    def shutdown(self) -> Dict:
+        self._stop.set()
+        # accept() 不会因关闭监听而返回，自己连一次唤醒它
+        threading.Thread(target=self._wake, daemon=True).start()
+        return {"pid": os.getpid()}
+
+    def _wake(self):
+        time.sleep(0.1)
+        try:
+            addr, family = address()
+            Client(addr, family, authkey=self._key).close()
+        except (OSError, EOFError, AuthenticationError):
+            pass
+
+    def handle(self, raw: bytes) -> Dict:
+        try:
+            request = json.loads(raw.decode("utf-8"))
+            op = request["op"]
+            args = request.get("args") or {}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return {"ok": False, "error": "请求格式错误"}
+        handler = self.handlers.get(op)
+        if handler is None:
+            return {"ok": False, "error": f"未知请求: {op}"}
+        with span("agent.handle", "ipc", op=op) as sp:
+            try:
+                return {"ok": True, "result": handler(**args)}
+            except Exception as e:
+                logger.exception("处理请求 %s 失败", op)
+                sp.set(outcome="error")
+                return {"ok": False, "error": str(e) or type(e).__name__}
+
+    # ---------- 监听 ----------
+    def _serve_connection(self, conn):
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    raw = conn.recv_bytes()
+                except (EOFError, OSError):
+                    return
+                conn.send_bytes(json.dumps(self.handle(raw), ensure_ascii=False).encode("utf-8"))
+
+    def serve(self):
+        addr, family = address()
+        if family == "AF_UNIX" and os.path.exists(addr):
+            # 上次异常退出留下的套接字文件（调用方已确认没有代理在运行）
+            os.remove(addr)
+        self._key = _new_key()
+        listener = Listener(addr, family, authkey=self._key)
+        logger.info("常驻代理已启动: %s（pid %d）", addr, os.getpid())
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn = listener.accept()
+                except AuthenticationError:
+                    logger.warning("拒绝未通过认证的连接")
+                    continue
+                except OSError as e:
+                    if self._stop.is_set():
+                        break
+                    logger.warning("接受连接失败: %s", e)
+                    continue
+                if self._stop.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self._serve_connection, args=(conn,),
+                                 name="agent-conn", daemon=True).start()
+        finally:
+            listener.close()
+            for eco in self.state.ecos:
+                eco.suspend()
+            logger.info("常驻代理已退出")
+
+
+def serve() -> int:
+    """在当前进程运行代理，直到收到 shutdown 请求"""
+    logging.basicConfig(
+        filename=os.path.join(data_dir(), LOG_NAME),
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        encoding="utf-8"
+    )
+    try:
+        running = AgentClient().ping()
+        print(f"常驻代理已在运行（pid {running['pid']}）")
+        return 1
+    except AgentError:
+        pass
+    try:
+        catalog = load_catalog()
+    except (OSError, ValueError, CatalogError) as e:
+        print(f"读取镜像目录失败: {e}")
+        return 1
+
+    state = AgentState(catalog)
+    for eco in state.ecos:
+        eco.resume()
+    state.refresh()
+
+    # 远程目录：后台重新验证，有更新时替换
+    catalog_url = os.environ.get(ENV_CATALOG_URL)
+    if catalog_url:
+        sync = CatalogSync(catalog_url, os.path.join(base_dir(), "mirrors.json"))
+
+        def revalidate():
+            result = sync.revalidate()
+            if result.status == "updated":
+                state.set_catalog(result.catalog)
+
+        threading.Thread(target=revalidate, name="agent-catalog", daemon=True).start()
+
+    configwatch.create_watcher(state.ecos, state.refresh,
+                               os.environ.get(configwatch.ENV_CONFIGWATCH) or "auto")
+    netwatch.create_watcher(lambda previous, new: netwatch.handle_change(state.ecos, previous, new),
+                            os.environ.get(netwatch.ENV_NETWATCH) or "auto")
+    AgentServer(state).serve()
+    return 0
+
+
+# ============ 客户端 ============
+class AgentClient:
+    """常驻代理的客户端；每个请求单独建立连接，可在多个线程中同时使用"""
+
+    def __init__(self, timeout: float = REQUEST_TIMEOUT):
+        self.timeout = timeout
+
+    def request(self, op: str, timeout: Optional[float] = None, **args):
+        key = _read_key()
+        if key is None:
+            raise AgentError("常驻代理未运行")
+        addr, family = address()
+        with span("agent.request", "ipc", op=op):
+            try:
+                with Client(addr, family, authkey=key) as conn:
+                    conn.send_bytes(json.dumps({"op": op, "args": args}, ensure_ascii=False).encode("utf-8"))
+                    if not conn.poll(timeout or self.timeout):
+                        raise AgentError(f"请求 {op} 超时")
+                    response = json.loads(conn.recv_bytes().decode("utf-8"))
+            except (OSError, EOFError, AuthenticationError, ValueError) as e:
+                raise AgentError(f"无法连接常驻代理: {e}") from e
+        if not response.get("ok"):
+            raise AgentError(response.get("error") or f"请求 {op} 失败")
+        return response.get("result")
+
+    def ping(self) -> Dict:
+        return self.request("ping", timeout=5)
+
+    def catalog(self) -> MirrorCatalog:
+        try:
+            return MirrorCatalog.from_config(self.request("catalog"))
+        except CatalogError as e:
+            raise AgentError(f"代理返回的镜像目录无效: {e}") from e
+
+    def state(self, refresh: Optional[Sequence[str]] = None) -> Dict[str, Dict]:
+        return self.request("state", refresh=list(refresh) if refresh else None)
+
+    def test(self, key: str, url: str) -> Tuple[ProbeResult, List[str]]:
+        data = self.request("test", key=key, url=url)
+        return ProbeResult(**data["result"]), data["details"]
+
+    def apply(self, selection: Dict[str, Optional[str]],
+              options: Optional[Dict[str, Dict[str, bool]]] = None
+              ) -> Tuple[List[StepResult], List[str], Dict[str, Dict]]:
+        data = self.request("apply", timeout=APPLY_TIMEOUT, selection=selection, options=options)
+        return [StepResult(**r) for r in data["results"]], data["warnings"], data["state"]
+
+    def health(self) -> Dict:
+        return self.request("health")
+
+    def shutdown(self) -> Dict:
+        return self.request("shutdown", timeout=5)
+
+
+def spawn_command() -> List[str]:
+    """启动代理进程的命令（打包后用同一个 exe）"""
+    if getattr(sys, "frozen", False):
+        return [sys.executable, "--agent-serve"]
+    return [sys.executable, os.path.abspath(__file__), "serve"]
+
+
+def _stop_outdated(client: AgentClient, info: Dict, timeout: float):
+    """停止协议版本不同的代理（升级后仍在运行的旧版本），等它退出"""
+    print(f"常驻代理版本不一致（运行中 {info.get('version')}，当前 {PROTOCOL_VERSION}），正在重启")
+    client.shutdown()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client.ping()
+        except AgentError:
+            return
+        time.sleep(0.1)
+    raise AgentError(f"旧版本代理（pid {info.get('pid')}）在 {timeout} 秒内没有退出")
+
+
+def start_background(timeout: float = START_TIMEOUT) -> Dict:
+    """在后台启动代理并等待可连接，返回 ping 结果；已在运行时直接返回（版本不同时先停止旧代理）"""
+    client = AgentClient()
+    try:
+        info = client.ping()
+    except AgentError:
+        info = None
+    if info is not None:
+        if info.get("version") == PROTOCOL_VERSION:
+            return info
+        _stop_outdated(client, info, timeout)
+    kwargs = {}
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    with span("agent.spawn", "ipc"):
+        process = subprocess.Popen(spawn_command(), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, close_fds=True, **kwargs)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise AgentError(f"代理进程已退出（{process.returncode}），详见 {LOG_NAME}")
+            try:
+                return client.ping()
+            except AgentError:
+                time.sleep(0.1)
+    raise AgentError(f"代理在 {timeout} 秒内没有就绪")
+
+
+def attach(mode: str) -> Optional[AgentClient]:
+    """按模式连接常驻代理：auto 只连接已运行的，start 未运行时先在后台启动，off 不使用
+
+    运行中的代理协议版本不同（如升级了程序）时重启为当前版本，不连接旧版本。
+    """
+    if mode == "off":
+        return None
+    client = AgentClient()
+    try:
+        if client.ping().get("version") == PROTOCOL_VERSION:
+            return client
+    except AgentError:
+        if mode != "start":
+            return None
+    try:
+        start_background()
+        return client
+    except AgentError as e:
+        print(f"启动常驻代理失败: {e}")
+        return None
+
+
+# ============ 命令行 ============
+def _mirror_url(catalog: MirrorCatalog, key: str, mirror: str) -> Optional[str]:
+    """镜像名称或地址 -> 地址（"原始"或空为 None）"""
+    if "://" in mirror:
+        return mirror
+    if catalog.by_name(key, mirror) is None:
+        raise AgentError(f"{key} 没有名为 {mirror} 的镜像")
+    return catalog.url_for(key, mirror) or None
+
+
+def _print_state(catalog: MirrorCatalog, states: Dict[str, Dict]):
+    for key, current in states.items():
+        url = current.get("url")
+        text = catalog.find_name(key, url) if url else "未配置"
+        enabled = [name for name, on in (current.get("options") or {}).items() if on]
+        extras = [current["note"]] if current.get("note") else []
+        if enabled:
+            extras.append("可选项: " + ", ".join(enabled))
+        print(f"{key:8} {text}" + (f"（{'；'.join(extras)}）" if extras else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="镜像管理器常驻代理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("serve", help="在前台运行代理")
+    sub.add_parser("start", help="在后台启动代理（已运行时直接返回）")
+    sub.add_parser("stop", help="停止代理")
+    sub.add_parser("status", help="代理状态与 pip 缓存代理的上游健康状况")
+    p = sub.add_parser("state", help="各生态的当前配置")
+    p.add_argument("--refresh", action="store_true", help="先重新读取配置")
+    p = sub.add_parser("test", help="由代理测试镜像（使用代理中的热缓存）")
+    p.add_argument("key", help="生态，如 pip")
+    p.add_argument("mirror", help="镜像名称或地址")
+    p = sub.add_parser("apply", help="由代理应用配置")
+    p.add_argument("selection", nargs="+", metavar="KEY=NAME", help="镜像名称或地址；名称为空或\"原始\"时清理")
+    p.add_argument("--option", action="append", default=[], metavar="KEY.OPTION",
+                   help="启用卡片上的可选项，如 pip.autotune（可重复）")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        return serve()
+    client = AgentClient()
+    try:
+        # 读取与修改配置只交给同一协议版本的代理
+        if args.command in ("state", "test", "apply"):
+            version = client.ping().get("version")
+            if version != PROTOCOL_VERSION:
+                raise AgentError(f"常驻代理版本不一致（运行中 {version}，当前 {PROTOCOL_VERSION}），"
+                                 f"请运行 start 重启")
+        if args.command == "start":
+            info = start_background()
+            print(f"常驻代理运行中（pid {info['pid']}，已运行 {info['uptime_s']:.0f} 秒）")
+        elif args.command == "stop":
+            print(f"已停止常驻代理（pid {client.shutdown()['pid']}）")
+        elif args.command == "status":
+            info = client.ping()
+            health = client.health()
+            print(f"常驻代理运行中（pid {info['pid']}，已运行 {info['uptime_s']:.0f} 秒）")
+            print(f"对冲请求：{health['hedge']}")
+            print(health["dns"])
+            proxy = health["pip_proxy"]
+            if proxy:
+                print(f"pip 缓存代理：{proxy['url']}")
+                for upstream in proxy.get("upstreams", []):
+                    print(f"  {'正常' if upstream.get('healthy') else '不可用'} {upstream.get('url')}")
+        elif args.command == "state":
+            catalog = client.catalog()
+            _print_state(catalog, client.state(refresh=catalog.types() if args.refresh else None))
+        elif args.command == "test":
+            url = _mirror_url(client.catalog(), args.key, args.mirror)
+            if not url:
+                print("原始（无镜像），无需测试")
+                return 0
+            result, details = client.test(args.key, url)
+            print(f"{'成功' if result.ok else '失败'} {result.ms}ms {result.detail}".rstrip())
+            for line in details:
+                print(f"  {line}")
+            return 0 if result.ok else 1
+        elif args.command == "apply":
+            catalog = client.catalog()
+            selection = {}
+            for item in args.selection:
+                key, _, mirror = item.partition("=")
+                selection[key] = _mirror_url(catalog, key, mirror) if mirror else None
+            options: Dict[str, Dict[str, bool]] = {}
+            for item in args.option:
+                key, _, option = item.partition(".")
+                options.setdefault(key, {})[option] = True
+            results, warnings, states = client.apply(selection, options)
+            print(format_timings(results))
+            for warning in warnings:
+                print(warning)
+            _print_state(catalog, {k: v for k, v in states.items() if k in selection})
+            return 1 if any(not r.ok for r in results) else 0
+    except AgentError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,28 +2,55 @@
 """Windows 镜像管理器 - 玻璃 UI 版本"""
 import os
 import sys
+
+# 启动分析需在其余导入之前配置，才能计入 PyQt6 的导入耗时
+import startup_profile
+from startup_profile import PROFILER
+PROFILER.configure(sys.argv)
+
+import argparse
+import functools
 import json
-import subprocess
+import logging
 import threading
-import time
-import urllib.request
-import urllib.error
-import winreg
-import ctypes
 import math
 import random
 from typing import Dict, List, Optional
 
+import agent
+import tracing
+from catalog import CatalogError, MirrorCatalog
+from catalog_sync import ENV_CATALOG_URL, CatalogSync
+import configwatch
+import ecosystems
+import integrity
+import netwatch
+import overrides
+from history import HISTORY
+from executor import format_timings, run_steps
+from paths import base_dir, data_dir
+from tracing import TRACER
+
+# 以常驻代理运行（单文件 exe 用同一个可执行文件启动代理）时不导入 PyQt6
+if "--agent-serve" in sys.argv[1:]:
+    sys.exit(agent.main(["serve"]))
+
+PROFILER.mark("stdlib_imported")
+
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QPushButton, QComboBox, QMessageBox,
-    QVBoxLayout, QHBoxLayout, QLabel, QFrame
+    QVBoxLayout, QHBoxLayout, QLabel, QFrame, QScrollArea, QMenu, QCheckBox
 )
-from PyQt6.QtCore import Qt, QRectF, QTimer, QPointF, pyqtSignal
+from PyQt6.QtCore import Qt, QRectF, QTimer, QPointF, pyqtSignal, QAbstractListModel, QModelIndex
 from PyQt6.QtGui import (
     QPainter, QColor, QLinearGradient, QPen, 
-    QPainterPath, QFont, QCursor, QPixmap, QPolygonF
+    QPainterPath, QFont, QCursor, QPixmap, QPolygonF, QShortcut, QKeySequence
 )
 
+PROFILER.mark("pyqt_imported")
+
+import watchdog
+
 
 # ============ 配色方案 ============
 GLASS_BG_TOP = QColor(42, 58, 68, 167)
@@ -367,6 +394,10 @@ class GlassButton(QPushButton):
         self._is_pressed = False
         super().mouseReleaseEvent(event)
     
+    @property
+    def is_busy(self) -> bool:
+        return self._is_busy
+    
     def set_busy(self, busy):
         self._is_busy = busy
         if not busy and not self._is_hover:
@@ -610,14 +641,83 @@ class GlassComboBox(QComboBox):
         super().paintEvent(event)
 
 
+# ============ MirrorListModel ============
+class MirrorListModel(QAbstractListModel):
+    """镜像列表模型 - 按需分批加载，支持按名称/地址过滤"""
+    
+    BATCH = 100
+    
+    def __init__(self, catalog: MirrorCatalog, mtype: str, parent=None):
+        super().__init__(parent)
+        self._entries = catalog.entries(mtype)
+        self._catalog = catalog
+        self._mtype = mtype
+        self._rows = list(range(len(self._entries)))
+        self._filtered = False
+        self._loaded = min(self.BATCH, len(self._rows))
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= self._loaded:
+            return None
+        entry = self._entries[self._rows[index.row()]]
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return entry.name
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return entry.url or "无镜像"
+        return None
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded < len(self._rows)
+    
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.BATCH, len(self._rows) - self._loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+    
+    def set_filter(self, text: str):
+        """按子串过滤（名称或规范化地址）"""
+        self.beginResetModel()
+        self._rows = self._catalog.search(self._mtype, text)
+        self._filtered = bool(text.strip())
+        self._loaded = min(self.BATCH, len(self._rows))
+        self.endResetModel()
+    
+    def row_of(self, name: str) -> int:
+        """名称所在行（必要时加载到该行），找不到返回 -1"""
+        pos = self._catalog.position(self._mtype, name)
+        if pos < 0:
+            return -1
+        if not self._filtered:
+            row = pos
+        elif pos in self._rows:
+            row = self._rows.index(pos)
+        else:
+            return -1
+        if row >= self._loaded:
+            self.beginInsertRows(QModelIndex(), self._loaded, row)
+            self._loaded = row + 1
+            self.endInsertRows()
+        return row
+
+
 # ============ MirrorCard ============
 class MirrorCard(QFrame):
     """镜像卡片"""
     
-    def __init__(self, title, mirror_options, parent=None):
+    # 镜像数超过该值时下拉框可输入过滤
+    FILTER_THRESHOLD = 30
+    
+    def __init__(self, title, catalog: MirrorCatalog, mtype: str, options=(), parent=None):
         super().__init__(parent)
         self.setFixedHeight(90)
-        self.mirror_options = mirror_options
+        self.catalog = catalog
+        self.mtype = mtype
         
         layout = QVBoxLayout(self)
         layout.setContentsMargins(18, 14, 18, 14)
@@ -631,9 +731,13 @@ class MirrorCard(QFrame):
         title_layout.addStretch()
         
         self.combo = GlassComboBox()
-        # 动态添加镜像选项
-        names = [o["name"] for o in mirror_options]
-        self.combo.addItems(names)
+        # 镜像选项（大目录按需加载）
+        self.model = MirrorListModel(catalog, mtype, self)
+        self.combo.setModel(self.model)
+        self._selected_name = self.combo.currentText()
+        self.combo.currentIndexChanged.connect(self._remember_selection)
+        if len(catalog.entries(mtype)) > self.FILTER_THRESHOLD:
+            self._enable_filter()
         self.combo.set_glow_callback(self.update)
         title_layout.addWidget(self.combo)
         
@@ -644,9 +748,83 @@ class MirrorCard(QFrame):
         
         layout.addLayout(title_layout)
         
+        status_layout = QHBoxLayout()
         self.status = QLabel("状态：未测试")
         self.status.setStyleSheet("color: rgba(255,255,255,140); font-size: 11px;")
-        layout.addWidget(self.status)
+        status_layout.addWidget(self.status, 1)
+        
+        # 生态的可选项（如 Pip 自动调优）
+        self.option_boxes: Dict[str, QCheckBox] = {}
+        for key, text in options:
+            box = QCheckBox(text)
+            box.setStyleSheet("color: rgba(255,255,255,180); font-size: 11px;")
+            status_layout.addWidget(box)
+            self.option_boxes[key] = box
+        layout.addLayout(status_layout)
+    
+    def _enable_filter(self):
+        """输入文字即过滤下拉列表"""
+        self.combo.setEditable(True)
+        self.combo.setInsertPolicy(QComboBox.InsertPolicy.NoInsert)
+        self.combo.setCompleter(None)
+        line_edit = self.combo.lineEdit()
+        line_edit.setStyleSheet("background: transparent; border: none; color: white;")
+        line_edit.textEdited.connect(self._on_filter_edited)
+        line_edit.editingFinished.connect(self._restore_selection)
+    
+    def _on_filter_edited(self, text):
+        self.model.set_filter(text)
+        if self.model.rowCount():
+            self.combo.showPopup()
+    
+    def _remember_selection(self, index):
+        name = self.combo.itemText(index)
+        if self.catalog.by_name(self.mtype, name):
+            self._selected_name = name
+    
+    def _restore_selection(self):
+        """输入结束后若文字不是有效镜像名，恢复上一次的选择"""
+        if self.catalog.by_name(self.mtype, self.combo.currentText()):
+            return
+        self.model.set_filter("")
+        self.select_name(self._selected_name)
+    
+    def set_catalog(self, catalog: MirrorCatalog):
+        """换用新的镜像目录，尽量保留当前选择"""
+        name = self.current_name()
+        self.catalog = catalog
+        self.model = MirrorListModel(catalog, self.mtype, self)
+        self.combo.setModel(self.model)
+        if len(catalog.entries(self.mtype)) > self.FILTER_THRESHOLD and not self.combo.isEditable():
+            self._enable_filter()
+        self.select_name(name)
+        if not catalog.by_name(self.mtype, name):
+            self._selected_name = self.combo.currentText()
+    
+    def options(self) -> Dict[str, bool]:
+        return {key: box.isChecked() for key, box in self.option_boxes.items()}
+    
+    def set_options(self, values: Dict[str, bool]):
+        for key, value in values.items():
+            if key in self.option_boxes:
+                self.option_boxes[key].setChecked(value)
+    
+    def current_name(self) -> str:
+        """当前选中的镜像名称（过滤输入中的文字不算）"""
+        name = self.combo.currentText()
+        if self.catalog.by_name(self.mtype, name):
+            return name
+        return self._selected_name
+    
+    def select_name(self, name: str):
+        """选中指定镜像（清除过滤）"""
+        row = self.model.row_of(name)
+        if row < 0:
+            self.model.set_filter("")
+            row = self.model.row_of(name)
+        if row >= 0:
+            self.combo.setCurrentIndex(row)
+            self._selected_name = name
     
     def paintEvent(self, event):
         painter = QPainter(self)
@@ -717,19 +895,43 @@ class MirrorManagerApp(QWidget):
     """玻璃窗口镜像管理器"""
     
     # 信号：用于跨线程通信（从工作线程发回主线程）
-    test_done_signal = pyqtSignal(object, object, str, bool)  # card, btn, text, success
-    apply_done_signal = pyqtSignal(str, str, str)  # git, pip, hf
+    test_done_signal = pyqtSignal(object, object, str, bool, str)  # card, btn, text, success, tooltip
+    rank_done_signal = pyqtSignal(str, object)  # mtype, [(name, ProbeResult)]
+    verify_done_signal = pyqtSignal(str, object, str)  # mtype, {url: [Check]}, error_msg
+    overrides_done_signal = pyqtSignal(str, object, str)  # mtype, [Override], summary
+    overrides_fixed_signal = pyqtSignal(str, int, object)  # mtype, fixed, [(Override, error)]
+    recommend_signal = pyqtSignal(str, str, object)  # mtype, url, HistoryStats
+    network_changed_signal = pyqtSignal(str, object)  # 新网络说明, [Suggestion]
+    config_changed_signal = pyqtSignal(object)  # {mtype: (url, options, 常驻代理的状态行说明或 None)}
+    apply_done_signal = pyqtSignal(object, object, object)  # {mtype: name}, [StepResult], {mtype: 说明}
+    agent_lost_signal = pyqtSignal(str)  # error_msg
     apply_failed_signal = pyqtSignal(str)  # error_msg
     status_update_signal = pyqtSignal(str)  # status text
+    catalog_synced_signal = pyqtSignal(object)  # SyncResult
     
     # 类常量
     MARGIN = 50
     CORNER_RADIUS = 24
-    
-    def __init__(self, mirrors: Dict):
+    # 超过该数量的卡片放入滚动区域
+    MAX_VISIBLE_CARDS = 4
+    CARD_PITCH = 104  # 卡片高度 + 间距
+    
+    def __init__(self, catalog: MirrorCatalog, stall_threshold_ms: Optional[float] = None,
+                 catalog_sync: Optional[CatalogSync] = None, netwatch_mode: str = "off",
+                 auto_switch: bool = False, configwatch_mode: str = "off",
+                 agent_client: Optional[agent.AgentClient] = None):
         super().__init__()
-        self.mirrors = mirrors
-        self.testing = {"git": False, "pip": False, "hf": False}
+        self.catalog = catalog
+        # 连接了常驻代理时，配置检测、测试与应用交给代理（其中的缓存与 pip 缓存代理常驻）
+        self.agent_client = agent_client
+        self._agent_notes: Dict[str, str] = {}
+        self.catalog_sync = catalog_sync
+        self.auto_switch = auto_switch
+        # 按 mirrors.json 的键生成卡片（只保留已注册的生态）
+        self.ecosystems = ecosystems.available(catalog.types())
+        self._update_candidates()
+        self.cards: Dict[str, MirrorCard] = {}
+        self.testing = {eco.key: False for eco in self.ecosystems}
         
         # 窗口设置
         self.setWindowFlags(
@@ -739,22 +941,57 @@ class MirrorManagerApp(QWidget):
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
         self.setAutoFillBackground(False)
         self.setStyleSheet("background: transparent;")
-        self.setGeometry(300, 100, 580, 610)
+        visible = min(max(len(self.ecosystems), 3), self.MAX_VISIBLE_CARDS)
+        self.setGeometry(300, 100, 580, 610 + (visible - 3) * self.CARD_PITCH)
         
         self._drag_pos = None
         self._content_visible = True
         
+        PROFILER.mark("init_ui_start")
         self._init_ui()
+        PROFILER.mark("ui_built")
+        
+        # UI 卡顿监测（可选）
+        self._stall_monitor = None
+        self._latency_overlay = None
+        if stall_threshold_ms is not None:
+            self._init_stall_monitor(stall_threshold_ms)
         
         # 连接信号 - 用于跨线程通信
         self.test_done_signal.connect(self._on_test_done)
+        self.rank_done_signal.connect(self._on_rank_done)
+        self.verify_done_signal.connect(self._on_verify_done)
+        self.overrides_done_signal.connect(self._on_overrides_done)
+        self.overrides_fixed_signal.connect(self._on_overrides_fixed)
+        self.recommend_signal.connect(self._on_recommend)
+        self.network_changed_signal.connect(self._on_network_changed)
+        self.config_changed_signal.connect(self._on_config_changed)
         self.apply_done_signal.connect(self._on_apply_done)
         self.apply_failed_signal.connect(self._on_apply_failed)
+        self.agent_lost_signal.connect(self._on_agent_lost)
         self.status_update_signal.connect(self._on_status_update)
+        self.catalog_synced_signal.connect(self._on_catalog_synced)
         
         # 延迟加载配置 - 确保在事件循环启动后执行
         # 否则 Qt UI 更新不会正确渲染
         QTimer.singleShot(0, self._load_current_config)
+        
+        # 远程目录：先用缓存启动，后台重新验证
+        if self.catalog_sync:
+            QTimer.singleShot(0, self._start_catalog_sync)
+        
+        # 网络切换监测（回调在监测线程中执行，结果通过信号回到主线程）
+        self._netwatcher = netwatch.create_watcher(self._on_network_change_thread, netwatch_mode)
+        
+        # 外部修改配置后只刷新受影响的卡片（同上，读取在监测线程中进行）
+        self._configwatcher = configwatch.create_watcher(
+            self.ecosystems, self._on_config_change_thread, configwatch_mode)
+    
+    def _update_candidates(self):
+        """把镜像目录中的地址告诉各生态（代理备选、排序等使用）"""
+        for eco in self.ecosystems:
+            eco.candidates = [e.url for e in self.catalog.entries(eco.key) if e.url]
+    
     def _get_glass_rect(self):
         return self.rect().adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
     
@@ -795,15 +1032,38 @@ class MirrorManagerApp(QWidget):
         line1.setStyleSheet("background: rgba(255,255,255,50);")
         layout.addWidget(line1)
         
-        # 镜像卡片 - 使用真实数据
-        self.git_card = MirrorCard("Git 镜像", self.mirrors.get("git", []))
-        layout.addWidget(self.git_card)
-        
-        self.pip_card = MirrorCard("Pip 镜像", self.mirrors.get("pip", []))
-        layout.addWidget(self.pip_card)
-        
-        self.hf_card = MirrorCard("HuggingFace", self.mirrors.get("hf", []))
-        layout.addWidget(self.hf_card)
+        # 镜像卡片 - 每个生态一张
+        cards_widget = QWidget()
+        cards_widget.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
+        cards_widget.setStyleSheet("background: transparent;")
+        cards_layout = QVBoxLayout(cards_widget)
+        cards_layout.setContentsMargins(0, 0, 0, 0)
+        cards_layout.setSpacing(14)
+        for eco in self.ecosystems:
+            card = MirrorCard(eco.title, self.catalog, eco.key, eco.OPTIONS)
+            card.test_btn.clicked.connect(functools.partial(self._test_mirror, eco.key))
+            card.test_btn.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+            card.test_btn.customContextMenuRequested.connect(
+                functools.partial(self._show_test_menu, eco.key))
+            cards_layout.addWidget(card)
+            self.cards[eco.key] = card
+        
+        if len(self.ecosystems) > self.MAX_VISIBLE_CARDS:
+            scroll = QScrollArea()
+            scroll.setWidget(cards_widget)
+            scroll.setWidgetResizable(True)
+            scroll.setFrameShape(QFrame.Shape.NoFrame)
+            scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+            scroll.setStyleSheet("""
+                QScrollArea { background: transparent; }
+                QScrollBar:vertical { background: transparent; width: 6px; }
+                QScrollBar::handle:vertical { background: rgba(255,255,255,60); border-radius: 3px; }
+                QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical { height: 0; }
+            """)
+            scroll.viewport().setAutoFillBackground(False)
+            layout.addWidget(scroll, 1)
+        else:
+            layout.addWidget(cards_widget)
         
         line2 = QFrame()
         line2.setFixedHeight(1)
@@ -820,163 +1080,230 @@ class MirrorManagerApp(QWidget):
         layout.addWidget(self.status_label)
         
         # 信号连接 - 真实业务逻辑
-        self.git_card.test_btn.clicked.connect(lambda: self._test_mirror("git"))
-        self.pip_card.test_btn.clicked.connect(lambda: self._test_mirror("pip"))
-        self.hf_card.test_btn.clicked.connect(lambda: self._test_mirror("hf"))
         self.apply_btn.clicked.connect(self._apply_config)
     
+    def _init_stall_monitor(self, threshold_ms: float):
+        """事件循环延迟监测 + 调试浮层（F12 切换）"""
+        self._stall_monitor = watchdog.EventLoopMonitor(threshold_ms, parent=self)
+        self._latency_overlay = watchdog.LatencyOverlay(self._stall_monitor, self)
+        glass = self._get_glass_rect()
+        self._latency_overlay.move(glass.x() + 20, glass.bottom() - self._latency_overlay.height() - 20)
+        QShortcut(QKeySequence("F12"), self, activated=self._latency_overlay.toggle)
+        self._stall_monitor.start()
+    
+    # ========== 远程目录同步 ==========
+    
+    def _start_catalog_sync(self):
+        thread = threading.Thread(target=self._catalog_sync_thread)
+        thread.daemon = True
+        thread.start()
+    
+    def _catalog_sync_thread(self):
+        self.catalog_synced_signal.emit(self.catalog_sync.revalidate())
+    
+    def _on_catalog_synced(self, result):
+        """远程目录同步完成（信号槽 - 在主线程执行）"""
+        if result.status == "updated":
+            self.catalog = result.catalog
+            self._update_candidates()
+            for card in self.cards.values():
+                card.set_catalog(result.catalog)
+            self._load_current_config()
+            self.status_label.setText("✓ 镜像列表已更新")
+            QTimer.singleShot(2000, lambda: self.status_label.setText(""))
+        elif result.status == "error":
+            print(f"同步远程镜像列表失败: {result.message}")
+    
+    # ========== 网络切换 ==========
+    
+    def _on_network_change_thread(self, previous, new):
+        """网络切换（监测线程）：增量重测当前镜像与少数候选"""
+        self.status_update_signal.emit(f"网络已切换（{new[1]}），正在重新测试候选镜像...")
+        suggestions = netwatch.handle_change(self.ecosystems, previous, new)
+        self.network_changed_signal.emit(new[1], suggestions)
+    
+    def _on_network_changed(self, label: str, suggestions):
+        """重测完成：提示或自动应用更快的镜像"""
+        if not suggestions:
+            self.status_label.setText(f"网络已切换（{label}），当前镜像仍是最佳选择")
+            QTimer.singleShot(3000, lambda: self.status_label.setText(""))
+            return
+        for s in suggestions:
+            card = self.cards[s.key]
+            name = self._find_mirror_name(s.key, s.better)
+            current = self._find_mirror_name(s.key, s.current)
+            before = (f"{s.current_stats.ewma_ms:.0f}ms" if s.current_stats and s.current_stats.ewma_ms
+                      is not None else "失败")
+            card.select_name(name)
+            card.status.setText(f"状态：当前网络下 {name} 更快（{current} {before} → "
+                                f"{s.better_stats.ewma_ms:.0f}ms）")
+            card.status.setToolTip(s.better_stats.describe())
+            card.status.setStyleSheet("color: #F0C060; font-size: 11px;")
+        if self.auto_switch and not self.apply_btn.is_busy:
+            self._apply_config()
+        else:
+            self.status_label.setText("网络已切换，已选中更快的镜像，点击应用配置生效")
+    
     # ========== 配置检测 ==========
     
     def _load_current_config(self):
         """加载当前配置状态"""
-        # Git
-        git_url = self._get_git_url()
-        if git_url:
-            name = self._find_mirror_name("git", git_url)
-            self.git_card.status.setText(f"Git: {name}")
-            self.git_card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
-            self._set_combo_value(self.git_card.combo, name)
-        
-        # Pip
-        pip_url = self._get_pip_url()
-        if pip_url:
-            name = self._find_mirror_name("pip", pip_url)
-            self.pip_card.status.setText(f"Pip: {name}")
-            self.pip_card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
-            self._set_combo_value(self.pip_card.combo, name)
-        
-        # HuggingFace
-        hf_url = self._get_hf_url()
-        if hf_url:
-            name = self._find_mirror_name("hf", hf_url)
-            self.hf_card.status.setText(f"HuggingFace: {name}")
-            self.hf_card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
-            self._set_combo_value(self.hf_card.combo, name)
-    
-    def _set_combo_value(self, combo, value):
-        """设置下拉框值"""
-        index = combo.findText(value)
-        if index >= 0:
-            combo.setCurrentIndex(index)
-    
-    def _get_git_url(self) -> Optional[str]:
-        """获取 Git 当前配置的镜像 URL"""
-        try:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            
-            result = subprocess.run(
-                ['git', 'config', '--global', '--get-regexp', r'url\..*\.insteadOf'],
-                capture_output=True,
-                text=True,
-                timeout=5,
-                startupinfo=startupinfo,
-                creationflags=subprocess.CREATE_NO_WINDOW
-            )
-            
-            if result.returncode == 0 and result.stdout.strip():
-                last_url = None
-                for line in result.stdout.strip().split('\n'):
-                    if line.startswith('url."'):
-                        start = line.find('url."') + 5
-                        if start >= 5:
-                            end = line.find('"', start)
-                            if end > start:
-                                url = line[start:end]
-                                last_url = url.rstrip('/')
-                
-                return last_url
-        except Exception:
-            pass
-        return None
-    
-    def _get_pip_url(self) -> Optional[str]:
-        """获取 Pip 当前配置的镜像 URL"""
-        # 优先从环境变量读取
-        url = os.environ.get('PIP_INDEX_URL')
-        if url:
-            return url.rstrip('/')
-        
-        # 从注册表读取（用户环境变量）
+        PROFILER.mark("config_detect_start")
+        unconfigured = []
+        states = self._agent_state()
+        if states is not None:
+            self._agent_notes.update({key: current.get("note", "") for key, current in states.items()})
+        for eco in self.ecosystems:
+            if states is not None:
+                current = states.get(eco.key) or {}
+                if eco.OPTIONS:
+                    self.cards[eco.key].set_options(current.get("options") or {})
+                url = current.get("url")
+            else:
+                if eco.OPTIONS:
+                    self.cards[eco.key].set_options(eco.read_options())
+                eco.resume()
+                url = eco.read_current()
+            if url:
+                self._show_configured(eco, url)
+            else:
+                unconfigured.append(eco.key)
+        
+        # 未配置的生态按当前网络下的测试历史预选镜像（识别网络需要子进程，放到后台）
+        if unconfigured:
+            thread = threading.Thread(target=self._recommend_thread, args=(unconfigured,))
+            thread.daemon = True
+            thread.start()
+        
+        PROFILER.mark("cards_populated")
+        self._finish_startup_profile()
+    
+    def _show_configured(self, eco, url: str):
+        """卡片显示并选中当前生效的镜像"""
+        card = self.cards[eco.key]
+        name = self._find_mirror_name(eco.key, url)
+        card.status.setText(self._status_text(eco, name))
+        card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
+        card.select_name(name)
+    
+    def _agent_state(self, refresh=None) -> Optional[Dict[str, Dict]]:
+        """从常驻代理取各生态的当前配置，未连接或失败返回 None（可在任意线程调用，不改界面状态）"""
+        client = self.agent_client
+        if client is None:
+            return None
         try:
-            key = winreg.OpenKey(
-                winreg.HKEY_CURRENT_USER,
-                'Environment',
-                0,
-                winreg.KEY_READ
-            )
-            try:
-                url, _ = winreg.QueryValueEx(key, 'PIP_INDEX_URL')
-                return url.rstrip('/')
-            except FileNotFoundError:
-                pass
-            finally:
-                winreg.CloseKey(key)
-        except Exception:
-            pass
-        
-        # 最后检查配置文件（向后兼容）
-        config_files = [
-            os.path.join(os.environ.get('APPDATA', ''), 'pip', 'pip.ini'),
-            os.path.expanduser('~/.pip/pip.conf'),
-        ]
-        
-        for config_file in config_files:
-            if os.path.exists(config_file):
-                try:
-                    with open(config_file, 'r', encoding='utf-8') as f:
-                        for line in f:
-                            line = line.strip()
-                            if line.startswith('index-url') or line.startswith('mirror'):
-                                if '=' in line:
-                                    url = line.split('=', 1)[1].strip()
-                                    return url.rstrip('/')
-                except Exception:
-                    pass
-        
-        return None
+            return client.state(refresh)
+        except agent.AgentError as e:
+            self.agent_lost_signal.emit(str(e))
+            return None
+    
+    def _on_agent_lost(self, error_msg):
+        """常驻代理不可用（信号槽 - 在主线程执行）：之后的操作改在本进程执行"""
+        if self.agent_client is None:
+            return
+        print(f"常驻代理不可用，改为本进程执行: {error_msg}")
+        self.agent_client = None
+        self._agent_notes.clear()
+    
+    def _on_config_change_thread(self, keys):
+        """配置被外部修改（监测线程）：只重新读取受影响的生态"""
+        agent_states = self._agent_state(sorted(keys))
+        if agent_states is not None:
+            self.config_changed_signal.emit({
+                key: (current.get("url"), current.get("options") if ecosystems.get(key).OPTIONS else None,
+                      current.get("note", ""))
+                for key, current in agent_states.items() if key in keys
+            })
+            return
+        states = {}
+        for eco in self.ecosystems:
+            if eco.key in keys:
+                options = eco.read_options() if eco.OPTIONS else None
+                states[eco.key] = (eco.read_current(), options, None)
+        self.config_changed_signal.emit(states)
+    
+    def _on_config_changed(self, states):
+        """刷新受影响的卡片；应用配置期间的变化由应用结果显示，测试中的卡片不打断"""
+        if self.apply_btn.is_busy:
+            return
+        refreshed = []
+        for eco in self.ecosystems:
+            if eco.key not in states or self.testing.get(eco.key):
+                continue
+            url, options, note = states[eco.key]
+            if note is not None and self.agent_client is not None:
+                self._agent_notes[eco.key] = note
+            card = self.cards[eco.key]
+            # 与卡片显示一致（如本程序刚应用的配置）时不重绘
+            if url:
+                name = self._find_mirror_name(eco.key, url)
+                same = (card.current_name() == name
+                        and card.status.text() == self._status_text(eco, name))
+            else:
+                same = self.catalog.url_for(eco.key, card.current_name()) is None
+            current_options = card.options()
+            if same and all(current_options.get(k, v) == v for k, v in (options or {}).items()):
+                continue
+            if options is not None:
+                card.set_options(options)
+            card.status.setToolTip("")
+            if url:
+                self._show_configured(eco, url)
+            else:
+                card.status.setText("状态：未配置")
+                card.status.setStyleSheet("color: rgba(255,255,255,140); font-size: 11px;")
+            refreshed.append(eco.label)
+        if refreshed:
+            self.status_label.setText(f"检测到外部修改，已刷新 {'、'.join(refreshed)}")
+            QTimer.singleShot(3000, lambda: self.status_label.setText(""))
+    
+    def _finish_startup_profile(self, retries=20):
+        """卡片加载完成后写出启动分析报告"""
+        if not PROFILER.enabled:
+            return
+        # 首帧可能晚于配置加载，等首帧时间点记录后再写出
+        if not PROFILER.has_mark("first_paint") and retries > 0:
+            QTimer.singleShot(50, lambda: self._finish_startup_profile(retries - 1))
+            return
+        path = PROFILER.finish()
+        if path:
+            print(f"启动分析报告已写入: {path}")
+        if PROFILER.exit_when_done:
+            QApplication.quit()
+    
+    def _recommend_thread(self, mtypes: List[str]):
+        """查询当前网络下各生态历史最好的镜像"""
+        for mtype in mtypes:
+            urls = [e.url for e in self.catalog.entries(mtype) if e.url]
+            best = HISTORY.best(mtype, integrity.DIVERGENCE.excluded(mtype, urls))
+            if best:
+                self.recommend_signal.emit(mtype, best, HISTORY.stats(mtype, best))
+    
+    def _on_recommend(self, mtype: str, url: str, stats):
+        """预选推荐的镜像（用户尚未选择、也未在测试时）"""
+        card = self.cards[mtype]
+        if self.testing.get(mtype) or card.status.text() != "状态：未测试":
+            return
+        name = self._find_mirror_name(mtype, url)
+        card.select_name(name)
+        card.status.setText(f"状态：未配置 · 当前网络下推荐 {name}")
+        card.status.setToolTip(stats.describe() if stats else "")
+        card.status.setStyleSheet("color: #80B0E0; font-size: 11px;")
     
-    def _get_hf_url(self) -> Optional[str]:
-        """获取 HuggingFace 当前配置的镜像 URL"""
-        
-        # 先从当前进程环境变量读取
-        url = os.environ.get('HF_ENDPOINT') or os.environ.get('HF_HUB_ENDPOINT')
-        if url:
-            return url
-        
-        # 如果进程环境变量没有，从注册表读取（用户环境变量）
-        try:
-            key = winreg.OpenKey(
-                winreg.HKEY_CURRENT_USER,
-                'Environment',
-                0,
-                winreg.KEY_READ
-            )
-            try:
-                url, _ = winreg.QueryValueEx(key, 'HF_ENDPOINT')
-                return url
-            except FileNotFoundError:
-                pass
-            try:
-                url, _ = winreg.QueryValueEx(key, 'HF_HUB_ENDPOINT')
-                return url
-            except FileNotFoundError:
-                pass
-            finally:
-                winreg.CloseKey(key)
-        except Exception:
-            pass
-        
-        return None
+    def _status_text(self, eco, name: str) -> str:
+        """卡片状态行：当前镜像、启用的调优方案与内容校验警告"""
+        if self.agent_client is not None and eco.key in self._agent_notes:
+            note = self._agent_notes[eco.key]
+        else:
+            note = eco.status_note()
+        url = self.catalog.url_for(eco.key, name)
+        if url and integrity.DIVERGENCE.reason(eco.key, url):
+            note = "⚠ 内容校验不一致" + (f" · {note}" if note else "")
+        return f"{eco.label}: {name}" + (f" · {note}" if note else "")
     
     def _find_mirror_name(self, mtype: str, url: str) -> str:
-        """从 JSON 配置中查找镜像名称"""
-        url = url.rstrip('/')
-        for opt in self.mirrors.get(mtype, []):
-            if opt.get("url", "").rstrip('/') == url:
-                return opt["name"]
-        # 找不到匹配，返回 URL 域名
-        return url.split('/')[-1] or url
+        """从镜像目录中查找镜像名称（找不到时返回 URL 最后一段）"""
+        return self.catalog.find_name(mtype, url)
     
     # ========== 测试镜像 ==========
     
@@ -986,12 +1313,11 @@ class MirrorManagerApp(QWidget):
             return
         self.testing[mtype] = True
         
-        card = getattr(self, f"{mtype}_card")
+        card = self.cards[mtype]
         btn = card.test_btn
-        options = self.mirrors.get(mtype, [])
         
-        name = card.combo.currentText()
-        url = next((o["url"] for o in options if o["name"] == name), "")
+        name = card.current_name()
+        url = self.catalog.url_for(mtype, name)
         
         # 原始或无 URL
         if not url or name == "原始":
@@ -1016,21 +1342,26 @@ class MirrorManagerApp(QWidget):
     
     def _test_thread(self, card, btn, url, name, mtype):
         """测试线程"""
-        start = time.time()
-        try:
-            req = urllib.request.Request(
-                url,
-                method="HEAD",
-                headers={"User-Agent": "MirrorManager/1.0"}
-            )
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                ms = int((time.time() - start) * 1000)
-                # 使用信号而非QTimer - 线程安全
-                self.test_done_signal.emit(card, btn, f"{name} - {ms}ms", True)
-        except Exception as e:
-            self.test_done_signal.emit(card, btn, f"连接失败 - {str(e)}", False)
+        result, lines = self._measure(mtype, url)
+        tooltip = "\n".join(lines)
+        # 使用信号而非QTimer - 线程安全
+        if result.ok:
+            detail = f" · {result.detail}" if result.detail else ""
+            self.test_done_signal.emit(card, btn, f"{name} - {result.ms}ms{detail}", True, tooltip)
+        else:
+            self.test_done_signal.emit(card, btn, f"连接失败 - {result.detail}", False, tooltip)
     
-    def _on_test_done(self, card, btn, text, success):
+    def _measure(self, mtype: str, url: str):
+        """测试镜像：连接了常驻代理时由代理测试（使用其热缓存）"""
+        client = self.agent_client
+        if client is not None:
+            try:
+                return client.test(mtype, url)
+            except agent.AgentError as e:
+                self.agent_lost_signal.emit(str(e))
+        return agent.measure(mtype, url)
+    
+    def _on_test_done(self, card, btn, text, success, tooltip):
         """测试完成（信号槽 - 在主线程执行）"""
         btn.set_busy(False)
         if success:
@@ -1039,308 +1370,249 @@ class MirrorManagerApp(QWidget):
         else:
             card.status.setText(f"状态：{text}")
             card.status.setStyleSheet("color: #E74C3C; font-size: 11px;")
+        card.status.setToolTip(tooltip)
+        
+        self.testing[card.mtype] = False
+    
+    def _show_test_menu(self, mtype: str, pos):
+        """测试按钮右键菜单"""
+        btn = self.cards[mtype].test_btn
+        menu = QMenu(self)
+        menu.addAction("测试全部镜像并排序", functools.partial(self._rank_mirrors, mtype))
+        if ecosystems.get(mtype).verifiable:
+            menu.addAction("校验全部镜像内容", functools.partial(self._verify_mirrors, mtype))
+        if mtype in overrides.SCANNED_KEYS:
+            menu.addAction("扫描本地覆盖配置", functools.partial(self._scan_overrides, mtype))
+        menu.exec(btn.mapToGlobal(pos))
+    
+    def _rank_mirrors(self, mtype: str):
+        """并发测试该生态的全部镜像，按耗时排序"""
+        if self.testing.get(mtype):
+            return
+        entries = [e for e in self.catalog.entries(mtype) if e.url]
+        if not entries:
+            return
+        self.testing[mtype] = True
+        card = self.cards[mtype]
+        card.test_btn.set_busy(True)
+        card.status.setText(f"状态：正在测试 {len(entries)} 个镜像...")
+        card.status.setStyleSheet("color: #80B0E0; font-size: 11px;")
+        
+        thread = threading.Thread(target=self._rank_thread, args=(mtype, entries))
+        thread.daemon = True
+        thread.start()
+    
+    def _rank_thread(self, mtype: str, entries):
+        """排序测试线程"""
+        names = {e.url: e.name for e in entries}
+        ranked = ecosystems.get(mtype).rank([e.url for e in entries])
+        self.rank_done_signal.emit(mtype, [(names[url], result) for url, result in ranked])
+    
+    def _on_rank_done(self, mtype: str, ranked):
+        """排序完成：状态行显示最快的镜像，提示中列出完整排名"""
+        card = self.cards[mtype]
+        card.test_btn.set_busy(False)
+        self.testing[mtype] = False
+        lines = []
+        for i, (name, result) in enumerate(ranked, 1):
+            if result.ok:
+                detail = f" · {result.detail}" if result.detail else ""
+                lines.append(f"{i}. {name} - {result.ms}ms{detail}")
+            else:
+                lines.append(f"{i}. {name} - 失败：{result.detail}")
+        card.status.setToolTip("\n".join(lines))
+        best_name, best = ranked[0]
+        if best.ok:
+            card.status.setText(f"状态：最快 {best_name} - {best.ms}ms（悬停查看排名）")
+            card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
+        else:
+            card.status.setText("状态：全部镜像连接失败（悬停查看详情）")
+            card.status.setStyleSheet("color: #E74C3C; font-size: 11px;")
+    
+    def _verify_mirrors(self, mtype: str):
+        """从该生态的全部镜像下载参考文件，与官方哈希比对"""
+        if self.testing.get(mtype):
+            return
+        urls = [e.url for e in self.catalog.entries(mtype) if e.url]
+        if not urls:
+            return
+        self.testing[mtype] = True
+        card = self.cards[mtype]
+        card.test_btn.set_busy(True)
+        card.status.setText(f"状态：正在校验 {len(urls)} 个镜像的内容...")
+        card.status.setStyleSheet("color: #80B0E0; font-size: 11px;")
+        
+        thread = threading.Thread(target=self._verify_thread, args=(mtype, urls))
+        thread.daemon = True
+        thread.start()
+    
+    def _verify_thread(self, mtype: str, urls):
+        """内容校验线程"""
+        try:
+            results = ecosystems.get(mtype).verify(urls)
+            self.verify_done_signal.emit(mtype, results, "")
+        except Exception as e:
+            self.verify_done_signal.emit(mtype, {}, str(e))
+    
+    def _on_verify_done(self, mtype: str, results, error: str):
+        """校验完成：状态行显示不一致的镜像，提示中列出每个镜像的结果"""
+        card = self.cards[mtype]
+        card.test_btn.set_busy(False)
+        self.testing[mtype] = False
+        if error:
+            card.status.setText(f"状态：校验失败 - {error}")
+            card.status.setStyleSheet("color: #E74C3C; font-size: 11px;")
+            return
+        names = {e.url: e.name for e in self.catalog.entries(mtype)}
+        card.status.setToolTip("\n".join(integrity.format_report(results, names)))
+        divergent = [names.get(url, url) for url, checks in results.items()
+                     if integrity.divergence_reason(checks)]
+        if divergent:
+            card.status.setText(f"状态：{'、'.join(divergent)} 内容不一致，已从排序与自动选择中排除")
+            card.status.setStyleSheet("color: #E74C3C; font-size: 11px;")
+        else:
+            card.status.setText(f"状态：{len(results)} 个镜像内容一致（悬停查看详情）")
+            card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
+    
+    def _scan_overrides(self, mtype: str):
+        """扫描仓库与虚拟环境中让该生态全局镜像失效的本地配置"""
+        if self.testing.get(mtype):
+            return
+        self.testing[mtype] = True
+        card = self.cards[mtype]
+        card.test_btn.set_busy(True)
+        card.status.setText("状态：正在扫描本地覆盖配置...")
+        card.status.setStyleSheet("color: #80B0E0; font-size: 11px;")
         
-        mtype = "git" if card == self.git_card else ("pip" if card == self.pip_card else "hf")
+        thread = threading.Thread(target=self._scan_overrides_thread, args=(mtype,))
+        thread.daemon = True
+        thread.start()
+    
+    def _scan_overrides_thread(self, mtype: str):
+        """覆盖扫描线程（目录与配置文件按 mtime 缓存，再次扫描是增量的）"""
+        result = overrides.OverrideScanner().scan(overrides.scan_roots())
+        found = overrides.find_overrides(result.configs, overrides.applied_mirrors((mtype,)),
+                                         ecosystems.current_env('PIP_INDEX_URL'))
+        summary = f"扫描 {result.dirs} 个目录（{result.reused} 个未变化），用时 {result.elapsed_ms / 1000:.1f}s"
+        self.overrides_done_signal.emit(mtype, [o for o in found if o.key == mtype], summary)
+    
+    def _on_overrides_done(self, mtype: str, found, summary: str):
+        """扫描完成：列出覆盖，有可自动修复的询问是否全部修复"""
+        card = self.cards[mtype]
+        card.test_btn.set_busy(False)
         self.testing[mtype] = False
+        card.status.setToolTip("\n".join([summary] + overrides.format_overrides(found)))
+        if not found:
+            card.status.setText("状态：未发现本地覆盖配置")
+            card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
+            return
+        effective = sum(o.effective for o in found)
+        card.status.setText(f"状态：{effective} 处本地配置覆盖了全局镜像，"
+                            f"{len(found) - effective} 处不一致（悬停查看）")
+        card.status.setStyleSheet("color: #E74C3C; font-size: 11px;")
+        fixable = [o for o in found if o.fixable]
+        if not fixable:
+            return
+        answer = QMessageBox.question(
+            self, "本地覆盖配置",
+            "\n".join(overrides.format_overrides(found)[:20])
+            + f"\n\n删除其中 {len(fixable)} 处可自动修复的配置？（依赖文件需手动修改）")
+        if answer == QMessageBox.StandardButton.Yes:
+            thread = threading.Thread(target=self._fix_overrides_thread, args=(mtype, fixable))
+            thread.daemon = True
+            thread.start()
+    
+    def _fix_overrides_thread(self, mtype: str, fixable):
+        failures = overrides.fix_all(fixable)
+        self.overrides_fixed_signal.emit(mtype, len(fixable) - len(failures), failures)
+    
+    def _on_overrides_fixed(self, mtype: str, fixed: int, failures):
+        card = self.cards[mtype]
+        if failures:
+            card.status.setText(f"状态：已修复 {fixed} 处，{len(failures)} 处失败（悬停查看）")
+            card.status.setStyleSheet("color: #E74C3C; font-size: 11px;")
+            card.status.setToolTip("\n".join(f"{o.path}: {error}" for o, error in failures))
+        else:
+            card.status.setText(f"状态：已修复 {fixed} 处本地覆盖配置")
+            card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
     
     # ========== 应用配置 ==========
     
     def _apply_config(self):
         """应用配置"""
-        git = self.git_card.combo.currentText()
-        pip = self.pip_card.combo.currentText()
-        hf = self.hf_card.combo.currentText()
+        selection = {mtype: card.current_name() for mtype, card in self.cards.items()}
+        options = {mtype: card.options() for mtype, card in self.cards.items()}
         
         self.apply_btn.set_busy(True)
         self.status_label.setText("正在应用...")
         
         thread = threading.Thread(
             target=self._apply_thread,
-            args=(git, pip, hf)
+            args=(selection, options)
         )
         thread.daemon = True
         thread.start()
     
-    def _apply_thread(self, git: str, pip: str, hf: str):
-        """应用配置线程"""
+    def _apply_thread(self, selection: Dict[str, str], options: Dict[str, Dict[str, bool]]):
+        """应用配置线程 - 各生态互不依赖的步骤并发执行"""
         try:
-            self.status_update_signal.emit("正在清理旧配置...")
-            
-            self._clear_git_config()
-            self._clear_pip_config()
-            self._clear_hf_config()
-            
-            self.status_update_signal.emit("正在配置 Git...")
+            urls = {mtype: self._get_mirror_url(mtype, name) for mtype, name in selection.items()}
+            results, notes = self._run_apply(urls, options)
+            print(format_timings(results))
             
-            # Git
-            git_url = self._get_mirror_url("git", git)
-            if git_url:
-                self._set_git_config(git_url)
+            failed = [r for r in results if not r.ok and not r.skipped]
+            if failed:
+                self.apply_failed_signal.emit("；".join(f"{r.name}: {r.error}" for r in failed))
+                return
             
-            self.status_update_signal.emit("正在配置 Pip...")
-            
-            # Pip
-            pip_url = self._get_mirror_url("pip", pip)
-            if pip_url:
-                self._set_pip_config(pip_url)
-            
-            self.status_update_signal.emit("正在配置 HuggingFace...")
-            
-            # HuggingFace
-            hf_url = self._get_mirror_url("hf", hf)
-            if hf_url:
-                self._set_hf_config(hf_url)
-            
-            # 检测系统级配置
-            system_warnings = []
-            if self._detect_system_pip_config():
-                system_warnings.append("Pip")
-            if self._detect_system_hf_config():
-                system_warnings.append("HuggingFace")
-            
-            # 如果有系统级配置但无管理员权限，记录警告
-            if system_warnings and not self._is_admin():
-                # 环境变量优先级最高，可以覆盖系统级配置
-                # 只在状态中提示，不阻止操作
-                warning_msg = f"检测到系统级配置 ({', '.join(system_warnings)})，环境变量将优先生效"
-                print(warning_msg)
+            # 有系统级配置但无管理员权限时只提示，不阻止操作（环境变量优先级最高）
+            for warning in agent.system_warnings(self.ecosystems):
+                print(warning)
             
             # 完成
-            self.apply_done_signal.emit(git, pip, hf)
+            self.apply_done_signal.emit(selection, results, notes)
         except Exception as e:
             self.apply_failed_signal.emit(str(e))
     
-    def _get_mirror_url(self, mtype: str, name: str) -> Optional[str]:
-        """获取镜像 URL"""
-        for opt in self.mirrors.get(mtype, []):
-            if opt["name"] == name:
-                return opt.get("url", "")
-        return ""
-    
-    def _is_admin(self) -> bool:
-        """检测是否有管理员权限"""
-        try:
-            return ctypes.windll.shell32.IsUserAnAdmin()
-        except Exception:
-            return False
-    
-    def _detect_system_pip_config(self) -> bool:
-        """检测是否有系统级 Pip 配置"""
-        system_config = os.path.join(os.environ.get('PROGRAMDATA', ''), 'pip', 'pip.ini')
-        return os.path.exists(system_config)
-    
-    def _detect_system_hf_config(self) -> bool:
-        """检测是否有系统级 HF 配置"""
-        try:
-            key = winreg.OpenKey(
-                winreg.HKEY_LOCAL_MACHINE,
-                r'SYSTEM\CurrentControlSet\Control\Session Manager\Environment',
-                0,
-                winreg.KEY_READ
-            )
+    def _run_apply(self, urls: Dict[str, Optional[str]], options: Dict[str, Dict[str, bool]]):
+        """执行应用计划，返回 (步骤结果, 常驻代理给出的状态行说明)
+
+        连接了常驻代理时交给代理，否则在本进程执行（说明为空）。代理出错时不改在本进程重试
+        （超时的请求可能仍在代理中执行），本次报告失败。
+        """
+        client = self.agent_client
+        if client is not None:
+            self.status_update_signal.emit("正在由常驻代理应用...")
             try:
-                winreg.QueryValueEx(key, 'HF_ENDPOINT')
-                winreg.CloseKey(key)
-                return True
-            except FileNotFoundError:
-                winreg.CloseKey(key)
-                return False
-        except Exception:
-            return False
-    
-    def _set_git_config(self, url: str):
-        """设置 Git 镜像"""
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
-        subprocess.run(
-            ['git', 'config', '--global', f'url."{url}".insteadOf', 'https://github.com'],
-            capture_output=True,
-            timeout=10,
-            startupinfo=startupinfo,
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
-        subprocess.run(
-            ['git', 'config', '--global', f'url."{url}".insteadOf', 'https://github.com/'],
-            capture_output=True,
-            timeout=10,
-            startupinfo=startupinfo,
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
-    
-    def _clear_git_config(self):
-        """清理 Git 配置"""
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
-        result = subprocess.run(
-            ['git', 'config', '--global', '--list'],
-            capture_output=True,
-            text=True,
-            timeout=10,
-            startupinfo=startupinfo,
-            creationflags=subprocess.CREATE_NO_WINDOW
+                results, _, states = client.apply(urls, options)
+            except agent.AgentError as e:
+                self.agent_lost_signal.emit(str(e))
+                raise
+            return results, {key: current.get("note", "") for key, current in states.items()}
+        results = run_steps(
+            ecosystems.build_plan(urls, options),
+            on_start=lambda step: self.status_update_signal.emit(f"正在{step.label or step.name}...")
         )
-        
-        if result.returncode == 0:
-            for line in result.stdout.strip().split('\n'):
-                if line.startswith('url.'):
-                    parts = line.split('=', 1)
-                    if len(parts) >= 1:
-                        key = parts[0]
-                        subprocess.run(
-                            ['git', 'config', '--global', '--unset-all', key],
-                            capture_output=True,
-                            timeout=10,
-                            startupinfo=startupinfo,
-                            creationflags=subprocess.CREATE_NO_WINDOW
-                        )
-    
-    def _set_pip_config(self, url: str):
-        """设置 Pip 镜像 - 使用环境变量 PIP_INDEX_URL"""
-        # 设置当前进程环境变量（立即生效）
-        os.environ['PIP_INDEX_URL'] = url
-        
-        # 写入用户环境变量（重启持久）
-        try:
-            key = winreg.OpenKey(
-                winreg.HKEY_CURRENT_USER,
-                'Environment',
-                0,
-                winreg.KEY_SET_VALUE
-            )
-            winreg.SetValueEx(key, 'PIP_INDEX_URL', 0, winreg.REG_SZ, url)
-            winreg.CloseKey(key)
-            
-            # 通知系统环境变量已更改
-            ctypes.windll.user32.SendMessageTimeoutW(
-                0xFFFF,  # HWND_BROADCAST
-                0x001A,  # WM_SETTINGCHANGE
-                0,
-                'Environment',
-                0,
-                5000,
-                None
-            )
-        except Exception as e:
-            print(f"写入 Pip 环境变量失败: {e}")
-    
-    def _clear_pip_config(self):
-        """清理 Pip 配置 - 清理所有可能的位置"""
-        # 清理环境变量
-        os.environ.pop('PIP_INDEX_URL', None)
-        
-        # 清理注册表中的环境变量
-        try:
-            key = winreg.OpenKey(
-                winreg.HKEY_CURRENT_USER,
-                'Environment',
-                0,
-                winreg.KEY_SET_VALUE
-            )
-            try:
-                winreg.DeleteValue(key, 'PIP_INDEX_URL')
-            except FileNotFoundError:
-                pass
-            winreg.CloseKey(key)
-        except Exception:
-            pass
-        
-        # 清理所有可能的配置文件
-        config_files = [
-            os.path.expanduser('~/.pip/pip.conf'),  # 遗留文件
-            os.path.join(os.environ.get('APPDATA', ''), 'pip', 'pip.ini'),  # 用户级
-            os.path.join(os.environ.get('LOCALAPPDATA', ''), 'pip', 'pip.ini'),
-        ]
-        
-        for config_file in config_files:
-            if os.path.exists(config_file):
-                try:
-                    os.remove(config_file)
-                except Exception as e:
-                    print(f"清理失败 {config_file}: {e}")
-    
-    def _set_hf_config(self, url: str):
-        """设置 HuggingFace 配置 - 写入系统环境变量"""
-        # 设置当前进程环境变量（立即生效）
-        os.environ['HF_ENDPOINT'] = url
-        os.environ['HF_HUB_ENDPOINT'] = url
-        
-        # 写入用户环境变量（重启持久）
-        try:
-            key = winreg.OpenKey(
-                winreg.HKEY_CURRENT_USER,
-                'Environment',
-                0,
-                winreg.KEY_SET_VALUE
-            )
-            winreg.SetValueEx(key, 'HF_ENDPOINT', 0, winreg.REG_SZ, url)
-            winreg.SetValueEx(key, 'HF_HUB_ENDPOINT', 0, winreg.REG_SZ, url)
-            winreg.CloseKey(key)
-            
-            # 通知系统环境变量已更改
-            ctypes.windll.user32.SendMessageTimeoutW(
-                0xFFFF,  # HWND_BROADCAST
-                0x001A,  # WM_SETTINGCHANGE
-                0,
-                'Environment',
-                0,
-                5000,
-                None
-            )
-        except Exception as e:
-            print(f"写入系统环境变量失败: {e}")
+        return results, {}
     
-    def _clear_hf_config(self):
-        """清理 HuggingFace 配置"""
-        os.environ.pop('HF_ENDPOINT', None)
-        os.environ.pop('HF_HUB_ENDPOINT', None)
-        
-        # 删除用户环境变量
-        try:
-            key = winreg.OpenKey(
-                winreg.HKEY_CURRENT_USER,
-                'Environment',
-                0,
-                winreg.KEY_SET_VALUE
-            )
-            try:
-                winreg.DeleteValue(key, 'HF_ENDPOINT')
-            except FileNotFoundError:
-                pass
-            try:
-                winreg.DeleteValue(key, 'HF_HUB_ENDPOINT')
-            except FileNotFoundError:
-                pass
-            winreg.CloseKey(key)
-            
-            # 通知系统环境变量已更改
-            ctypes.windll.user32.SendMessageTimeoutW(
-                0xFFFF,
-                0x001A,
-                0,
-                'Environment',
-                0,
-                5000,
-                None
-            )
-        except Exception as e:
-            print(f"删除系统环境变量失败: {e}")
+    def _get_mirror_url(self, mtype: str, name: str) -> Optional[str]:
+        """获取镜像 URL"""
+        return self.catalog.url_for(mtype, name)
     
-    def _on_apply_done(self, git: str, pip: str, hf: str):
+    def _on_apply_done(self, selection: Dict[str, str], results, notes: Dict[str, str]):
         """应用完成（信号槽 - 在主线程执行）"""
         self.apply_btn.set_busy(False)
+        if self.agent_client is not None:
+            self._agent_notes.update(notes)
         
-        self.status_label.setText("✓ 配置已应用！")
-        
-        self.git_card.status.setText(f"Git: {git}")
-        self.git_card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
-        
-        self.pip_card.status.setText(f"Pip: {pip}")
-        self.pip_card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
+        total_ms = max((r.start_ms + r.duration_ms for r in results), default=0)
+        self.status_label.setText(f"✓ 配置已应用！（{total_ms / 1000:.1f}s）")
+        self.status_label.setToolTip(format_timings(results))
         
-        self.hf_card.status.setText(f"HF: {hf}")
-        self.hf_card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
+        for eco in self.ecosystems:
+            card = self.cards[eco.key]
+            card.status.setText(self._status_text(eco, selection[eco.key]))
+            card.status.setStyleSheet("color: #50DCA0; font-size: 11px;")
         
         QTimer.singleShot(2000, lambda: self.status_label.setText(""))
     
@@ -1367,6 +1639,7 @@ class MirrorManagerApp(QWidget):
         if not self._content_visible:
             return
         
+        PROFILER.mark("first_paint")
         painter = QPainter(self)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
         
@@ -1465,19 +1738,111 @@ class MirrorManagerApp(QWidget):
 
 
 # ============ main ============
+def _parse_args(argv: List[str]) -> argparse.Namespace:
+    """解析命令行参数（未知参数留给 Qt）"""
+    parser = argparse.ArgumentParser(description="Windows 镜像管理器")
+    startup_profile.add_arguments(parser)
+    tracing.add_arguments(parser)
+    watchdog.add_arguments(parser)
+    netwatch.add_arguments(parser)
+    configwatch.add_arguments(parser)
+    agent.add_arguments(parser)
+    parser.add_argument(
+        "--catalog-url", default=None, metavar="URL",
+        help=f"远程镜像列表地址（也可用环境变量 {ENV_CATALOG_URL}）"
+    )
+    args, _ = parser.parse_known_args(argv[1:])
+    return args
+
+
+def _configure_tracing(args: argparse.Namespace):
+    """按命令行或环境变量开启追踪"""
+    path = args.trace
+    if path is None:
+        path = os.environ.get(tracing.ENV_TRACE)
+        if not path:
+            return
+        if path in ("1", "true", "yes"):
+            path = ""
+    if not path:
+        path = os.path.join(data_dir(), tracing.DEFAULT_TRACE_NAME)
+    try:
+        TRACER.configure(path)
+    except OSError as e:
+        print(f"无法打开追踪文件 {path}: {e}")
+
+
+def _configure_logging():
+    """诊断日志写入数据目录（窗口程序没有控制台）"""
+    logging.basicConfig(
+        filename=os.path.join(data_dir(), "mirror_manager.log"),
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        encoding="utf-8"
+    )
+
+
 def main():
     """主函数"""
+    PROFILER.mark("main_start")
+    args = _parse_args(sys.argv)
+    _configure_tracing(args)
+    stall_threshold_ms = watchdog.threshold_from(args, os.environ)
+    if TRACER.enabled or stall_threshold_ms is not None:
+        _configure_logging()
+    
     # 先创建 QApplication（MessageBox 需要它）
     app = QApplication(sys.argv)
+    PROFILER.mark("qapp_created")
     
     # 确定配置文件路径
-    if getattr(sys, 'frozen', False):
-        base_dir = os.path.dirname(sys.executable)
-    else:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(base_dir(), "mirrors.json")
     
-    config_path = os.path.join(base_dir, "mirrors.json")
+    # 常驻代理在运行时直接使用它的镜像目录与已检测的配置（远程目录由代理同步）
+    agent_client = agent.attach(agent.mode_from(args, os.environ))
+    catalog = None
+    if agent_client is not None:
+        try:
+            catalog = agent_client.catalog()
+        except agent.AgentError as e:
+            print(f"常驻代理不可用: {e}")
+            agent_client = None
+    PROFILER.mark("agent_attached")
+    
+    # 配置了远程镜像列表时优先使用上次的缓存，启动后再后台验证
+    catalog_url = args.catalog_url or os.environ.get(ENV_CATALOG_URL)
+    catalog_sync = CatalogSync(catalog_url, config_path) if catalog_url and catalog is None else None
+    if catalog is None and catalog_sync:
+        catalog = catalog_sync.load_cached()
+    if catalog is None and catalog_sync and not os.path.exists(config_path):
+        # 首次运行且没有本地文件：同步拉取一次
+        catalog = catalog_sync.revalidate().catalog
+    if catalog is None:
+        catalog = _load_local_catalog(config_path)
+    PROFILER.mark("config_loaded")
     
+    # 设置字体
+    default_font = QFont("Microsoft YaHei", 13)
+    app.setFont(default_font)
+    
+    window = MirrorManagerApp(catalog, stall_threshold_ms=stall_threshold_ms,
+                              catalog_sync=catalog_sync,
+                              netwatch_mode=netwatch.mode_from(args, os.environ),
+                              auto_switch=netwatch.auto_switch_from(args, os.environ),
+                              configwatch_mode=configwatch.mode_from(args, os.environ),
+                              agent_client=agent_client)
+    window.show()
+    PROFILER.mark("window_shown")
+    
+    code = app.exec()
+    # 本进程中的后台服务（如 pip 缓存代理）随窗口关闭停止，相关配置还原为可直接使用的值
+    for eco in window.ecosystems:
+        eco.suspend()
+    sys.exit(code)
+
+
+def _load_local_catalog(config_path: str) -> MirrorCatalog:
+    """读取本地 mirrors.json，失败时提示并退出"""
     # 检查配置文件
     if not os.path.exists(config_path):
         msg = QMessageBox()
@@ -1487,10 +1852,17 @@ def main():
         msg.exec()
         sys.exit(1)
     
-    # 读取配置
+    # 读取配置并编译为镜像目录（同时校验格式）
     try:
         with open(config_path, 'r', encoding='utf-8') as f:
-            mirrors = json.load(f)
+            return MirrorCatalog.from_config(json.load(f))
+    except CatalogError as e:
+        msg = QMessageBox()
+        msg.setWindowTitle("错误")
+        msg.setText(f"配置文件格式错误！\n\n{str(e)}")
+        msg.setIcon(QMessageBox.Icon.Critical)
+        msg.exec()
+        sys.exit(1)
     except Exception as e:
         msg = QMessageBox()
         msg.setWindowTitle("错误")
@@ -1498,15 +1870,6 @@ def main():
         msg.setIcon(QMessageBox.Icon.Critical)
         msg.exec()
         sys.exit(1)
-    
-    # 设置字体
-    default_font = QFont("Microsoft YaHei", 13)
-    app.setFont(default_font)
-    
-    window = MirrorManagerApp(mirrors)
-    window.show()
-    
-    sys.exit(app.exec())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""镜像目录 - 将 mirrors.json 编译为带索引的只读目录
+
+加载时校验一次，之后按名称或规范化 URL 查找都是 O(1)：
+规范化会忽略协议、主机大小写、默认端口、末尾斜杠和 ``/simple`` 后缀，
+因此 ``https://Mirrors.Aliyun.com/pypi/simple/`` 与
+``http://mirrors.aliyun.com/pypi`` 指向同一条目。
+"""
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+ORIGINAL_NAME = "原始"
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class CatalogError(ValueError):
+    """mirrors.json 内容不合法"""
+
+    def __init__(self, problems: List[str]):
+        self.problems = problems
+        super().__init__("\n".join(problems))
+
+
+class MirrorEntry(NamedTuple):
+    """一个镜像条目"""
+    mtype: str
+    name: str
+    url: str
+    # 规范化 URL（索引键）
+    key: str
+    # 条目中除 name/url 外的其余字段
+    extra: Dict
+
+    @property
+    def is_original(self) -> bool:
+        return not self.url or self.name == ORIGINAL_NAME
+
+
+def normalize_url(url: str) -> str:
+    """规范化 URL 作为索引键；空 URL 返回空字符串"""
+    url = (url or "").strip()
+    if not url:
+        return ""
+    parts = urlsplit(url if "://" in url else f"https://{url}")
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != _DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{port}"
+    path = parts.path.rstrip('/')
+    while '//' in path:
+        path = path.replace('//', '/')
+    if path.lower().endswith('/simple'):
+        path = path[:-len('/simple')]
+    return host + path
+
+
+def _validate_entry(mtype: str, index: int, opt) -> List[str]:
+    where = f"{mtype}[{index}]"
+    if not isinstance(opt, dict):
+        return [f"{where}: 应为对象"]
+    problems = []
+    name = opt.get("name")
+    if not isinstance(name, str) or not name.strip():
+        problems.append(f"{where}: 缺少 name")
+    url = opt.get("url", "")
+    if not isinstance(url, str):
+        problems.append(f"{where}: url 应为字符串")
+    elif url:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            problems.append(f"{where}: url 不是有效的 http(s) 地址: {url}")
+    return problems
+
+
+class MirrorCatalog:
+    """带索引的镜像目录"""
+
+    def __init__(self, entries: Dict[str, List[MirrorEntry]]):
+        self._entries = entries
+        self._by_name: Dict[str, Dict[str, MirrorEntry]] = {}
+        self._by_key: Dict[str, Dict[str, MirrorEntry]] = {}
+        self._positions: Dict[str, Dict[str, int]] = {}
+        self._search_keys: Dict[str, List[str]] = {}
+        for mtype, items in entries.items():
+            names = self._by_name[mtype] = {}
+            keys = self._by_key[mtype] = {}
+            self._positions[mtype] = {e.name: i for i, e in enumerate(items)}
+            for entry in items:
+                names[entry.name] = entry
+                # 同一 URL 出现多次时以第一个为准
+                keys.setdefault(entry.key, entry)
+            self._search_keys[mtype] = [
+                f"{e.name}\n{e.key}".lower() for e in items
+            ]
+
+    @classmethod
+    def from_config(cls, data) -> "MirrorCatalog":
+        """校验并编译 mirrors.json 的内容，不合法时抛出 CatalogError"""
+        if not isinstance(data, dict):
+            raise CatalogError(["顶层应为对象，键为镜像类型（git/pip/hf）"])
+        problems = []
+        entries: Dict[str, List[MirrorEntry]] = {}
+        for mtype, options in data.items():
+            if not isinstance(options, list):
+                problems.append(f"{mtype}: 应为数组")
+                continue
+            items = []
+            seen = set()
+            for i, opt in enumerate(options):
+                errors = _validate_entry(mtype, i, opt)
+                if errors:
+                    problems.extend(errors)
+                    continue
+                name = opt["name"].strip()
+                if name in seen:
+                    problems.append(f"{mtype}[{i}]: 名称重复: {name}")
+                    continue
+                seen.add(name)
+                url = opt.get("url", "")
+                extra = {k: v for k, v in opt.items() if k not in ("name", "url")}
+                items.append(MirrorEntry(mtype, name, url, normalize_url(url), extra))
+            entries[mtype] = items
+        if problems:
+            raise CatalogError(problems)
+        return cls(entries)
+
+    def to_config(self) -> Dict[str, List[Dict]]:
+        """还原为 mirrors.json 结构"""
+        return {
+            mtype: [dict(name=e.name, url=e.url, **e.extra) for e in items]
+            for mtype, items in self._entries.items()
+        }
+
+    def types(self) -> List[str]:
+        return list(self._entries)
+
+    def entries(self, mtype: str) -> List[MirrorEntry]:
+        return self._entries.get(mtype, [])
+
+    def names(self, mtype: str) -> List[str]:
+        return [e.name for e in self.entries(mtype)]
+
+    def by_name(self, mtype: str, name: str) -> Optional[MirrorEntry]:
+        return self._by_name.get(mtype, {}).get(name)
+
+    def by_url(self, mtype: str, url: str) -> Optional[MirrorEntry]:
+        return self._by_key.get(mtype, {}).get(normalize_url(url))
+
+    def position(self, mtype: str, name: str) -> int:
+        """条目在列表中的下标，找不到返回 -1"""
+        return self._positions.get(mtype, {}).get(name, -1)
+
+    def url_for(self, mtype: str, name: str) -> str:
+        """按名称取 URL，找不到返回空字符串"""
+        entry = self.by_name(mtype, name)
+        return entry.url if entry else ""
+
+    def find_name(self, mtype: str, url: str) -> str:
+        """按 URL 查名称；找不到时返回 URL 的最后一段"""
+        entry = self.by_url(mtype, url)
+        if entry:
+            return entry.name
+        url = url.rstrip('/')
+        return url.split('/')[-1] or url
+
+    def search(self, mtype: str, text: str) -> List[int]:
+        """按名称或地址子串过滤，返回条目下标"""
+        keys = self._search_keys.get(mtype, [])
+        text = text.strip().lower()
+        if not text:
+            return list(range(len(keys)))
+        return [i for i, key in enumerate(keys) if text in key]
+
+    def __contains__(self, mtype: str) -> bool:
+        return mtype in self._entries
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._entries.values())
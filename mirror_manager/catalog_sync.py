@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""远程镜像目录同步 - 条件请求（ETag / If-Modified-Since）+ 原子缓存
+
+启动时直接使用上次缓存的远程目录（没有缓存则用本地 mirrors.json），
+随后在后台用条件请求重新验证：未变化时服务器返回 304，只有一次很小的往返；
+有更新时校验格式后原子写入缓存，并通知界面刷新。
+
+``python catalog_sync.py --self-check`` 在本地 HTTP 服务上检查 200、304、
+内容未变的 200 与格式错误四种响应的处理。
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, NamedTuple, Optional
+
+from catalog import CatalogError, MirrorCatalog
+from paths import base_dir
+from rcfiles import atomic_write_text
+from tracing import span
+
+ENV_CATALOG_URL = "MIRROR_MANAGER_CATALOG_URL"
+USER_AGENT = "MirrorManager/1.0"
+
+
+class SyncResult(NamedTuple):
+    """一次同步的结果：status 为 updated / not_modified / error"""
+    status: str
+    catalog: Optional[MirrorCatalog] = None
+    message: str = ""
+
+
+def _atomic_write_json(path: str, data: Dict):
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=4))
+
+
+def _read_json(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class CatalogSync:
+    """远程目录同步器
+
+    缓存放在本地 mirrors.json 旁边：``mirrors.remote.json`` 为目录内容，
+    ``mirrors.remote.meta.json`` 记录来源地址、ETag 和 Last-Modified。
+    """
+
+    def __init__(self, source_url: str, local_path: str, timeout: float = 10):
+        self.source_url = source_url
+        self.local_path = local_path
+        self.timeout = timeout
+        base, _ = os.path.splitext(local_path)
+        self.cache_path = base + ".remote.json"
+        self.meta_path = base + ".remote.meta.json"
+
+    def _load_meta(self) -> Dict:
+        try:
+            meta = _read_json(self.meta_path)
+        except (OSError, ValueError):
+            return {}
+        # 来源地址变了，旧缓存作废
+        if not isinstance(meta, dict) or meta.get("source_url") != self.source_url:
+            return {}
+        return meta
+
+    def _cached_data(self):
+        try:
+            return _read_json(self.cache_path)
+        except (OSError, ValueError):
+            return None
+
+    def load_cached(self) -> Optional[MirrorCatalog]:
+        """读取缓存的远程目录；没有或已失效返回 None"""
+        if not self._load_meta():
+            return None
+        try:
+            return MirrorCatalog.from_config(_read_json(self.cache_path))
+        except (OSError, ValueError):
+            return None
+
+    def revalidate(self) -> SyncResult:
+        """向来源地址发条件请求，有更新时写入缓存"""
+        meta = self._load_meta()
+        headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        # 缓存文件丢失时不能依赖 304
+        if not os.path.exists(self.cache_path):
+            headers.pop("If-None-Match", None)
+            headers.pop("If-Modified-Since", None)
+
+        req = urllib.request.Request(self.source_url, headers=headers)
+        with span("catalog.fetch", "network", url=self.source_url,
+                  conditional="If-None-Match" in headers or "If-Modified-Since" in headers) as sp:
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                    body = resp.read()
+                    if resp.headers.get("Content-Encoding") == "gzip":
+                        body = gzip.decompress(body)
+                    etag = resp.headers.get("ETag")
+                    last_modified = resp.headers.get("Last-Modified")
+                    sp.set(status=resp.status, bytes=len(body))
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    sp.set(status=304, outcome="not_modified")
+                    return SyncResult("not_modified")
+                sp.set(status=e.code, outcome="error")
+                return SyncResult("error", message=f"HTTP {e.code}")
+            except (urllib.error.URLError, OSError) as e:
+                sp.set(outcome="error", error=str(e))
+                return SyncResult("error", message=str(e))
+
+        try:
+            data = json.loads(body.decode('utf-8'))
+            catalog = MirrorCatalog.from_config(data)
+        except CatalogError as e:
+            return SyncResult("error", message=f"远程目录格式错误：{e}")
+        except ValueError as e:
+            return SyncResult("error", message=f"远程目录不是有效的 JSON：{e}")
+
+        # 内容未变（服务器不支持条件请求或校验值变了）：不必重写缓存，但要记下新的校验值，
+        # 否则之后每次启动都会重新下载整个目录
+        if meta and self._cached_data() == data:
+            try:
+                self._write_meta(etag, last_modified)
+            except OSError as e:
+                return SyncResult("not_modified", message=f"缓存写入失败：{e}")
+            return SyncResult("not_modified")
+
+        try:
+            _atomic_write_json(self.cache_path, data)
+            self._write_meta(etag, last_modified)
+        except OSError as e:
+            # 缓存写不进去不影响本次使用
+            return SyncResult("updated", catalog, f"缓存写入失败：{e}")
+        return SyncResult("updated", catalog)
+
+    def _write_meta(self, etag: Optional[str], last_modified: Optional[str]):
+        _atomic_write_json(self.meta_path, {
+            "source_url": self.source_url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+        })
+
+
+# ============ 自检 ============
+class CatalogHandler(BaseHTTPRequestHandler):
+    """模拟目录服务器：返回 body 与 etag，请求带匹配的 If-None-Match 时返回 304"""
+    body = b""
+    etag = ""
+    requests: List[Optional[str]] = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        condition = self.headers.get("If-None-Match")
+        self.requests.append(condition)
+        if condition and condition == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+
+def self_check() -> List[str]:
+    """在本地 HTTP 服务上检查各种响应的处理，返回失败项（为空表示全部通过）"""
+    handler = type("Handler", (CatalogHandler,), {"requests": []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    failures = []
+
+    def expect(what: str, result: SyncResult, status: str, condition: Optional[str]):
+        sent = handler.requests[-1]
+        if result.status != status or sent != condition:
+            failures.append(f"{what}: 结果 {result.status}（{result.message}），"
+                            f"If-None-Match={sent!r}；应为 {status}，If-None-Match={condition!r}")
+
+    catalog = {"pip": [{"name": "本地", "url": "http://127.0.0.1/simple"}]}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            sync = CatalogSync(f"http://127.0.0.1:{server.server_port}/mirrors.json",
+                               os.path.join(workdir, "mirrors.json"), timeout=5)
+            handler.body, handler.etag = json.dumps(catalog).encode("utf-8"), '"v1"'
+            expect("首次下载", sync.revalidate(), "updated", None)
+            expect("未变化（304）", sync.revalidate(), "not_modified", '"v1"')
+            # 重新部署：内容相同但 ETag 变了，之后应带上新的 ETag
+            handler.etag = '"v2"'
+            expect("内容相同的 200", sync.revalidate(), "not_modified", '"v1"')
+            expect("新 ETag 的 304", sync.revalidate(), "not_modified", '"v2"')
+            handler.body, handler.etag = json.dumps({"pip": "不是数组"}).encode("utf-8"), '"v3"'
+            expect("格式错误", sync.revalidate(), "error", '"v2"')
+            if sync.load_cached() is None or sync._cached_data() != catalog:
+                failures.append("格式错误的响应覆盖了缓存")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="同步远程镜像目录")
+    parser.add_argument("url", nargs="?", help=f"目录地址（默认读取 {ENV_CATALOG_URL}）")
+    parser.add_argument("--local", help="本地 mirrors.json（缓存写在它旁边，默认程序目录下的）")
+    parser.add_argument("--self-check", action="store_true", help="在本地 HTTP 服务上检查同步流程")
+    args = parser.parse_args(argv)
+
+    if args.self_check:
+        failures = self_check()
+        for failure in failures:
+            print(f"失败 - {failure}")
+        print("自检失败" if failures else "自检通过")
+        return 1 if failures else 0
+
+    url = args.url or os.environ.get(ENV_CATALOG_URL)
+    if not url:
+        parser.error(f"需要目录地址或环境变量 {ENV_CATALOG_URL}")
+    result = CatalogSync(url, args.local or os.path.join(base_dir(), "mirrors.json")).revalidate()
+    print(result.status + (f"：{result.message}" if result.message else ""))
+    return 1 if result.status == "error" else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
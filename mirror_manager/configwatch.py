@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""配置变化监测 - 其他程序修改镜像相关配置时，只重新读取受影响的生态并刷新其卡片
+
+监测对象由各生态声明：``watch_paths()``（全局 gitconfig、pip 各级配置文件、.npmrc 等）
+与 ``watches_env()``（注册表中的用户环境变量，含直连设置用的 ``NO_PROXY``）。
+
+事件来源：Windows 用 ``FindFirstChangeNotification`` 监测配置文件所在目录、
+``RegNotifyChangeKeyValue`` 监测用户环境变量键，并低频轮询兜底（所在目录尚不存在的文件靠轮询发现）；
+其他系统或初始化失败时定时比较各文件的 (mtime, 大小)。
+被唤醒后比较各来源的时间戳确定变化的生态，短时间内的连续变化（如 ``pip config set``
+先写临时文件再替换、应用配置时先清理再写入）合并为一次回调。
+
+用户环境变量变化时按注册表的新旧差异同步当前进程的环境变量（只改变化了的变量，PATH 除外），
+各生态读取当前配置时优先读进程环境变量，不同步会一直看到启动时的旧值。
+"""
+import argparse
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from sysenv import USER_ENV_KEY, read_user_env, read_user_env_all, user_env_stamp, winreg
+
+logger = logging.getLogger("mirror_manager.configwatch")
+
+ENV_CONFIGWATCH = "MIRROR_MANAGER_CONFIGWATCH"
+# 轮询间隔（秒）；事件型监测的兜底轮询间隔
+POLL_INTERVAL = 2
+EVENT_POLL_INTERVAL = 30
+# 变化后等待这么久没有新变化才回调，最多等待 MAX_DEBOUNCE
+DEBOUNCE = 0.5
+MAX_DEBOUNCE = 3.0
+# 用户环境变量在来源表中的名称
+ENV_SOURCE = "<env>"
+# 不同步到当前进程的变量（进程中的值由系统级与用户级合并而来）
+UNSYNCED_ENV = ("PATH",)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """注册配置变化监测相关的命令行参数"""
+    group = parser.add_argument_group("配置变化")
+    group.add_argument(
+        "--configwatch", choices=["auto", "poll", "off"], default=None,
+        help=f"外部修改配置后自动刷新卡片的监测方式（默认 auto，也可用环境变量 {ENV_CONFIGWATCH}）"
+    )
+
+
+def mode_from(args: argparse.Namespace, environ) -> str:
+    return args.configwatch or environ.get(ENV_CONFIGWATCH) or "auto"
+
+
+def _file_stamp(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def watch_map(ecos: Sequence) -> Dict[str, Set[str]]:
+    """{来源: 依赖它的生态键}，来源为文件绝对路径或 ENV_SOURCE"""
+    sources: Dict[str, Set[str]] = {}
+    for eco in ecos:
+        for path in eco.watch_paths():
+            sources.setdefault(os.path.abspath(path), set()).add(eco.key)
+        if eco.watches_env() and winreg is not None:
+            sources.setdefault(ENV_SOURCE, set()).add(eco.key)
+    return sources
+
+
+class EnvMirror:
+    """注册表用户环境变量的快照；变化时把差异同步到当前进程"""
+
+    def __init__(self):
+        self._values = read_user_env_all()
+
+    def sync(self) -> List[str]:
+        """返回变化了的变量名"""
+        values = read_user_env_all()
+        changed = sorted(name for name in set(self._values) | set(values)
+                         if self._values.get(name) != values.get(name))
+        for name in changed:
+            if name.upper() in UNSYNCED_ENV:
+                continue
+            # 删除用户级变量后，系统级的同名变量重新生效
+            value = values.get(name) or read_user_env(name, machine=True)
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self._values = values
+        return changed
+
+
+# ============ 监测 ============
+class ConfigWatcher:
+    """后台线程：等待变化通知或定时轮询，比较各来源的时间戳，调用 on_change({生态键})
+
+    子类只需实现 ``_wait_event``（有事件返回 True，超时返回 False）与可选的 ``_open`` / ``_close``。
+    """
+    name = "poll"
+
+    def __init__(self, ecos: Sequence, on_change: Callable[[Set[str]], None],
+                 interval: float = POLL_INTERVAL):
+        self.ecos = list(ecos)
+        self.on_change = on_change
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._env = EnvMirror() if winreg is not None else None
+        self._env_stamp = user_env_stamp()
+        self._sources = watch_map(self.ecos)
+        self._stamps = self._snapshot(self._sources)
+
+    def _snapshot(self, sources: Dict[str, Set[str]]) -> Dict[str, object]:
+        return {source: self._env_stamp if source == ENV_SOURCE else _file_stamp(source)
+                for source in sources}
+
+    def check(self) -> Set[str]:
+        """比较各来源与上次的时间戳，返回变化涉及的生态（同时更新基线）"""
+        changed: Set[str] = set()
+        stamp = user_env_stamp()
+        if stamp != self._env_stamp:
+            self._env_stamp = stamp
+            if self._env is not None:
+                names = self._env.sync()
+                logger.info("用户环境变量变化: %s", ", ".join(names) or "（无实际差异）")
+        # 文件位置可能随环境变量变化（如 PIP_CONFIG_FILE、NPM_CONFIG_USERCONFIG），每次重新计算
+        sources = watch_map(self.ecos)
+        stamps = self._snapshot(sources)
+        for source, keys in sources.items():
+            if source in self._stamps and stamps[source] != self._stamps[source]:
+                changed |= keys
+            elif source not in self._stamps and stamps[source] is not None:
+                # 新出现的来源（环境变量改变了文件位置）
+                changed |= keys
+        self._sources, self._stamps = sources, stamps
+        return changed
+
+    def start(self):
+        self._open()
+        self._thread = threading.Thread(target=self._run, name=f"configwatch-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        self._close()
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    def _wait_event(self, timeout: float) -> bool:
+        self._stop.wait(timeout)
+        return False
+
+    def _check_logged(self) -> Set[str]:
+        try:
+            return self.check()
+        except Exception:
+            logger.exception("检查配置变化失败")
+            return set()
+
+    def _run(self):
+        logger.info("配置监测(%s)启动：%d 个来源", self.name, len(self._sources))
+        while not self._stop.is_set():
+            self._wait_event(self.interval)
+            if self._stop.is_set():
+                break
+            changed = self._check_logged()
+            if not changed:
+                continue
+            # 合并短时间内的连续变化
+            waited = 0.0
+            while waited < MAX_DEBOUNCE and not self._stop.wait(DEBOUNCE):
+                waited += DEBOUNCE
+                more = self._check_logged()
+                if not more:
+                    break
+                changed |= more
+            logger.info("配置变化：%s", ", ".join(sorted(changed)))
+            try:
+                self.on_change(changed)
+            except Exception:
+                logger.exception("处理配置变化失败")
+
+
+class PollingConfigWatcher(ConfigWatcher):
+    """定时比较 (mtime, 大小)（所有平台可用）"""
+
+
+class NotifyConfigWatcher(ConfigWatcher):
+    """Windows：目录变化通知与注册表键变化通知"""
+    name = "notify"
+    FILE_NOTIFY = 0x1 | 0x8 | 0x10  # FILE_NAME | SIZE | LAST_WRITE
+    REG_NOTIFY = 0x1 | 0x4  # NAME | LAST_SET
+    WAIT_TIMEOUT = 0x102
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("interval", EVENT_POLL_INTERVAL)
+        super().__init__(*args, **kwargs)
+        self._dirs: Dict[str, int] = {}
+        self._reg_key = None
+        self._reg_event = None
+
+    def _open(self):
+        import ctypes
+        from ctypes import wintypes
+        self._kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self._advapi32 = ctypes.WinDLL("advapi32", use_last_error=True)
+        self._kernel32.FindFirstChangeNotificationW.restype = wintypes.HANDLE
+        self._kernel32.FindFirstChangeNotificationW.argtypes = (wintypes.LPCWSTR, wintypes.BOOL, wintypes.DWORD)
+        self._kernel32.FindNextChangeNotification.argtypes = (wintypes.HANDLE,)
+        self._kernel32.FindCloseChangeNotification.argtypes = (wintypes.HANDLE,)
+        self._kernel32.CreateEventW.restype = wintypes.HANDLE
+        self._kernel32.CreateEventW.argtypes = (wintypes.LPVOID, wintypes.BOOL, wintypes.BOOL, wintypes.LPCWSTR)
+        self._kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+        self._kernel32.WaitForMultipleObjects.argtypes = (
+            wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE), wintypes.BOOL, wintypes.DWORD)
+        self._kernel32.WaitForMultipleObjects.restype = wintypes.DWORD
+        self._advapi32.RegNotifyChangeKeyValue.argtypes = (
+            wintypes.HANDLE, wintypes.BOOL, wintypes.DWORD, wintypes.HANDLE, wintypes.BOOL)
+        self._handle_type = wintypes.HANDLE
+
+        self._reg_event = self._kernel32.CreateEventW(None, False, False, None)
+        if not self._reg_event:
+            raise OSError(ctypes.get_last_error(), "CreateEventW 失败")
+        self._reg_key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, USER_ENV_KEY, 0, winreg.KEY_NOTIFY)
+        self._arm_registry()
+        self._watch_dirs()
+
+    def _arm_registry(self):
+        # 异步通知只触发一次，每次触发后重新登记
+        status = self._advapi32.RegNotifyChangeKeyValue(
+            int(self._reg_key), False, self.REG_NOTIFY, self._reg_event, True)
+        if status != 0:
+            raise OSError(status, "RegNotifyChangeKeyValue 失败")
+
+    def _watch_dirs(self):
+        """按当前来源调整监测的目录（只能监测已存在的目录）"""
+        wanted = {os.path.dirname(source) for source in self._sources if source != ENV_SOURCE}
+        wanted = {d for d in wanted if os.path.isdir(d)}
+        for directory in set(self._dirs) - wanted:
+            self._kernel32.FindCloseChangeNotification(self._dirs.pop(directory))
+        invalid = self._handle_type(-1).value
+        for directory in wanted - set(self._dirs):
+            handle = self._kernel32.FindFirstChangeNotificationW(directory, False, self.FILE_NOTIFY)
+            if handle and handle != invalid:
+                self._dirs[directory] = handle
+            else:
+                logger.warning("无法监测目录 %s，只靠轮询", directory)
+
+    def _close(self):
+        for handle in self._dirs.values():
+            self._kernel32.FindCloseChangeNotification(handle)
+        self._dirs.clear()
+        if self._reg_key is not None:
+            winreg.CloseKey(self._reg_key)
+        if self._reg_event:
+            self._kernel32.CloseHandle(self._reg_event)
+
+    def _wait_event(self, timeout: float) -> bool:
+        self._watch_dirs()
+        handles = [self._reg_event] + list(self._dirs.values())
+        array = (self._handle_type * len(handles))(*handles)
+        # 每秒检查一次停止标志
+        waited = 0.0
+        while waited < timeout and not self._stop.is_set():
+            index = self._kernel32.WaitForMultipleObjects(len(handles), array, False, 1000)
+            if index == self.WAIT_TIMEOUT:
+                waited += 1.0
+                continue
+            if index >= len(handles):
+                logger.warning("等待变化通知失败（%#x），本轮改为轮询", index)
+                self._stop.wait(max(timeout - waited, 0))
+                return False
+            if index == 0:
+                self._arm_registry()
+            else:
+                self._kernel32.FindNextChangeNotification(handles[index])
+            return True
+        return False
+
+
+def create_watcher(ecos: Sequence, on_change: Callable[[Set[str]], None],
+                   mode: str = "auto") -> Optional[ConfigWatcher]:
+    """按平台创建并启动监测；mode 为 off 时返回 None，事件型初始化失败时退回轮询"""
+    if mode == "off":
+        return None
+    candidates: List[type] = []
+    if mode == "auto" and winreg is not None:
+        candidates.append(NotifyConfigWatcher)
+    candidates.append(PollingConfigWatcher)
+    for cls in candidates:
+        watcher = cls(ecos, on_change)
+        try:
+            watcher.start()
+            return watcher
+        except (OSError, AttributeError) as e:
+            watcher._close()
+            logger.warning("配置监测 %s 不可用: %s", cls.name, e)
+    return None
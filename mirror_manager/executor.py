@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""依赖感知的并发执行器 - 互不依赖的步骤并行，记录每一步耗时
+
+步骤失败时，所有（直接或间接）依赖它的步骤被跳过，其余步骤照常执行。
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from tracing import span
+
+
+class Step(NamedTuple):
+    """一个执行步骤"""
+    name: str
+    func: Callable[[], object]
+    deps: Tuple[str, ...] = ()
+    # 状态栏显示的中文描述
+    label: str = ""
+
+
+class StepResult(NamedTuple):
+    """步骤结果：ok 为 False 且 skipped 为 True 表示因依赖失败未执行"""
+    name: str
+    ok: bool
+    start_ms: float
+    duration_ms: float
+    error: str = ""
+    skipped: bool = False
+
+
+def _check_graph(steps: Sequence[Step]):
+    names = {s.name for s in steps}
+    if len(names) != len(steps):
+        raise ValueError("步骤名称重复")
+    for step in steps:
+        missing = [d for d in step.deps if d not in names]
+        if missing:
+            raise ValueError(f"步骤 {step.name} 依赖不存在的步骤: {', '.join(missing)}")
+    # 检测环
+    state: Dict[str, int] = {}
+    by_name = {s.name: s for s in steps}
+
+    def visit(name):
+        if state.get(name) == 1:
+            raise ValueError(f"步骤依赖存在环: {name}")
+        if state.get(name) == 2:
+            return
+        state[name] = 1
+        for dep in by_name[name].deps:
+            visit(dep)
+        state[name] = 2
+
+    for step in steps:
+        visit(step.name)
+
+
+def run_steps(steps: Sequence[Step], max_workers: int = 4,
+              on_start: Optional[Callable[[Step], None]] = None) -> List[StepResult]:
+    """执行步骤图，返回按完成顺序排列的结果"""
+    _check_graph(steps)
+    by_name = {s.name: s for s in steps}
+    dependents: Dict[str, List[str]] = {s.name: [] for s in steps}
+    waiting = {s.name: len(s.deps) for s in steps}
+    for step in steps:
+        for dep in step.deps:
+            dependents[dep].append(step.name)
+
+    origin = time.perf_counter()
+    results: List[StepResult] = []
+    done = set()
+
+    def run(step: Step) -> StepResult:
+        if on_start:
+            on_start(step)
+        start = time.perf_counter()
+        with span("apply.step", "apply", step=step.name) as sp:
+            try:
+                step.func()
+                ok, error = True, ""
+            except Exception as e:
+                ok, error = False, str(e) or type(e).__name__
+                sp.set(outcome="error", error=error)
+        end = time.perf_counter()
+        return StepResult(step.name, ok, (start - origin) * 1000, (end - start) * 1000, error)
+
+    def skip(name: str, reason: str):
+        """依赖失败：连带跳过所有下游步骤"""
+        stack = [name]
+        while stack:
+            current = stack.pop()
+            if current in done:
+                continue
+            done.add(current)
+            results.append(StepResult(current, False, (time.perf_counter() - origin) * 1000,
+                                      0.0, reason, skipped=True))
+            stack.extend(dependents[current])
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="apply") as pool:
+        pending = {}
+        for step in steps:
+            if waiting[step.name] == 0:
+                pending[pool.submit(run, step)] = step.name
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pending.pop(future)
+                result = future.result()
+                results.append(result)
+                done.add(result.name)
+                for child in dependents[result.name]:
+                    if child in done:
+                        continue
+                    if not result.ok:
+                        skip(child, f"依赖步骤 {result.name} 失败")
+                        continue
+                    waiting[child] -= 1
+                    if waiting[child] == 0:
+                        pending[pool.submit(run, by_name[child])] = child
+    return results
+
+
+def format_timings(results: Sequence[StepResult]) -> str:
+    """每步耗时的多行文本（用于提示与日志）"""
+    lines = []
+    for r in sorted(results, key=lambda r: r.start_ms):
+        if r.skipped:
+            lines.append(f"{r.name}: 跳过（{r.error}）")
+        elif r.ok:
+            lines.append(f"{r.name}: {r.duration_ms:.0f}ms（+{r.start_ms:.0f}ms 开始）")
+        else:
+            lines.append(f"{r.name}: 失败 {r.duration_ms:.0f}ms - {r.error}")
+    return "\n".join(lines)
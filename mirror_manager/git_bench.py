@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Git 传输调优基准测试 - 在本地 git HTTP 服务上比较启用/不启用调优方案的克隆耗时
+
+用法：
+    python git_bench.py                       # 生成测试仓库，比较所有方案
+    python git_bench.py --repo D:\\src\\proj    # 使用已有仓库
+    python git_bench.py --delay-ms 80         # 每个请求增加 80ms，模拟跨境链路
+
+本地服务通过 ``git http-backend`` 提供智能 HTTP 协议（支持 protocol v2），
+克隆时隔离用户的全局/系统 git 配置，只用 ``-c`` 传入方案中的设置。
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from ecosystems import GIT_PROFILES
+
+
+def _git(args: List[str], cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None):
+    subprocess.run(['git'] + args, cwd=cwd, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _isolated_env() -> Dict[str, str]:
+    """不读取用户的全局与系统 git 配置（避免 insteadOf 等设置影响结果）"""
+    env = dict(os.environ)
+    env.update({
+        'GIT_CONFIG_NOSYSTEM': '1',
+        'GIT_CONFIG_GLOBAL': os.devnull,
+        'GIT_TERMINAL_PROMPT': '0',
+        'GIT_AUTHOR_NAME': 'bench', 'GIT_AUTHOR_EMAIL': 'bench@localhost',
+        'GIT_COMMITTER_NAME': 'bench', 'GIT_COMMITTER_EMAIL': 'bench@localhost',
+    })
+    return env
+
+
+def make_repo(path: str, commits: int, files: int, seed: int = 0):
+    """生成测试仓库：多次提交、可压缩的文本文件"""
+    env = _isolated_env()
+    rng = random.Random(seed)
+    words = [f"word{i}" for i in range(2000)]
+    _git(['init', '--quiet', path], env=env)
+    for n in range(commits):
+        for _ in range(files):
+            name = os.path.join(path, f"src/m{rng.randrange(files * 4)}.txt")
+            os.makedirs(os.path.dirname(name), exist_ok=True)
+            with open(name, 'w', encoding='utf-8') as f:
+                f.write(" ".join(rng.choice(words) for _ in range(4000)))
+        _git(['add', '-A'], cwd=path, env=env)
+        _git(['commit', '--quiet', '-m', f"commit {n}"], cwd=path, env=env)
+
+
+class GitHttpHandler(BaseHTTPRequestHandler):
+    """把请求转给 git http-backend（CGI），可选为每个请求增加固定延迟"""
+    project_root = ""
+    delay_s = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._backend()
+
+    def do_POST(self):
+        self._backend()
+
+    def _backend(self):
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        path, _, query = self.path.partition('?')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b""
+        env = _isolated_env()
+        env.update({
+            'GIT_PROJECT_ROOT': self.project_root,
+            'GIT_HTTP_EXPORT_ALL': '1',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'REQUEST_METHOD': self.command,
+            'CONTENT_TYPE': self.headers.get('Content-Type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'REMOTE_ADDR': self.client_address[0],
+        })
+        if self.headers.get('Git-Protocol'):
+            env['GIT_PROTOCOL'] = self.headers['Git-Protocol']
+        if self.headers.get('Content-Encoding'):
+            env['HTTP_CONTENT_ENCODING'] = self.headers['Content-Encoding']
+        result = subprocess.run(['git', 'http-backend'], input=body, env=env,
+                                capture_output=True)
+        head, _, payload = result.stdout.partition(b"\r\n\r\n")
+        status = 200
+        headers = []
+        for line in head.decode('latin-1').split("\r\n"):
+            if not line:
+                continue
+            name, _, value = line.partition(':')
+            if name.lower() == 'status':
+                status = int(value.split()[0])
+            else:
+                headers.append((name, value.strip()))
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def serve(project_root: str, delay_ms: float = 0) -> ThreadingHTTPServer:
+    """在随机端口启动本地 git HTTP 服务（后台线程）"""
+    handler = type('Handler', (GitHttpHandler,), {
+        'project_root': project_root, 'delay_s': delay_ms / 1000,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def time_clone(url: str, settings: Dict[str, str], workdir: str) -> float:
+    """克隆一次，返回耗时（秒）"""
+    dest = tempfile.mkdtemp(prefix='clone-', dir=workdir)
+    args = []
+    for key, value in settings.items():
+        args += ['-c', f"{key}={value}"]
+    start = time.perf_counter()
+    try:
+        _git(args + ['clone', '--bare', '--quiet', url, dest], env=_isolated_env())
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(dest, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比较 Git 传输调优方案的克隆耗时")
+    parser.add_argument('--repo', help="已有仓库路径（默认生成测试仓库）")
+    parser.add_argument('--commits', type=int, default=40, help="生成仓库的提交数")
+    parser.add_argument('--files', type=int, default=20, help="每次提交修改的文件数")
+    parser.add_argument('--runs', type=int, default=3, help="每种方案的克隆次数（取中位数）")
+    parser.add_argument('--delay-ms', type=float, default=0, help="每个 HTTP 请求增加的延迟")
+    parser.add_argument('--profile', action='append', choices=sorted(GIT_PROFILES),
+                        help="只比较指定方案（可重复）")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='git-bench-')
+    try:
+        source = args.repo
+        if not source:
+            source = os.path.join(workdir, 'source')
+            print(f"生成测试仓库（{args.commits} 次提交）...")
+            make_repo(source, args.commits, args.files)
+        root = os.path.join(workdir, 'served')
+        os.makedirs(root)
+        _git(['clone', '--bare', '--quiet', source, os.path.join(root, 'repo.git')],
+             env=_isolated_env())
+        server = serve(root, args.delay_ms)
+        url = f"http://127.0.0.1:{server.server_address[1]}/repo.git"
+        try:
+            variants = [('无调优', {})]
+            variants += [(name, GIT_PROFILES[name]) for name in (args.profile or GIT_PROFILES)]
+            baseline = None
+            for name, settings in variants:
+                times = [time_clone(url, settings, workdir) for _ in range(args.runs)]
+                median = statistics.median(times)
+                baseline = baseline or median
+                print(f"{name:<10} 中位 {median * 1000:7.0f}ms  "
+                      f"（{', '.join(f'{t * 1000:.0f}' for t in times)}）  "
+                      f"相对无调优 {median / baseline:.2f}x")
+        finally:
+            server.shutdown()
+    except subprocess.CalledProcessError as e:
+        print(f"git 执行失败: {e.stderr.decode(errors='replace').strip()}", file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+"""HuggingFace 大文件多镜像分段下载 - 多个镜像、多个连接并行下载同一文件的不同区间
+
+流程：
+1. 向每个端点（mirrors.json 中的 hf 镜像，含官方）发 HEAD 解析文件，取提交号、ETag 与大小，
+   与多数端点不一致的镜像不参与下载
+2. 在 HF 缓存的 blobs 目录预分配 ``<etag>.incomplete``，把文件切成区间，
+   各连接从队列取区间、按位置直接写入文件（不在内存中缓冲整个文件）
+3. 队列取空后，空闲连接从剩余时间最长的区间切走后半段（只在自己的来源更快时），
+   慢镜像手里的区间因此被重新分配给快镜像；来源连续出错则停用，区间退回队列
+4. 校验 SHA-256（LFS 文件）或 git blob SHA-1（普通文件），再放入标准的
+   ``blobs/`` + ``snapshots/<提交号>/`` 缓存布局，huggingface_hub 可直接使用
+
+用法：
+    python hf_download.py openai-community/gpt2 model.safetensors
+    python hf_download.py --repo-type dataset --connections 16 user/data train.parquet
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from paths import base_dir
+from probes import CHUNK_SIZE, USER_AGENT, format_size
+from tracing import span
+
+DEFAULT_ENDPOINT = "https://huggingface.co"
+SEGMENT_SIZE = 16 * 1024 * 1024
+# 区间剩余量小于该值时不再切分
+MIN_SPLIT = 2 * 1024 * 1024
+# 来源连续出错该次数后停用
+MAX_SOURCE_ERRORS = 3
+TIMEOUT = 30
+
+
+class DownloadError(Exception):
+    """下载失败（无可用来源、校验不通过等）"""
+
+
+# ============ 解析 ============
+class Resolved(NamedTuple):
+    """一个端点对文件的解析结果"""
+    endpoint: str
+    download_url: str
+    commit: str
+    etag: str
+    size: int
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_NO_REDIRECT = urllib.request.build_opener(_NoRedirect)
+
+
+def _request(url: str, token: Optional[str], method: str = "GET",
+             headers: Optional[Dict[str, str]] = None) -> urllib.request.Request:
+    req = urllib.request.Request(url, method=method, headers=dict(headers or {}, **{
+        "User-Agent": USER_AGENT}))
+    if token:
+        # 重定向到 CDN 时不携带令牌
+        req.add_unredirected_header("Authorization", f"Bearer {token}")
+    return req
+
+
+def endpoint_token(endpoint: str, token: Optional[str], to_mirrors: bool = False) -> Optional[str]:
+    """发给某端点的令牌：HF 令牌只发给官方端点，显式允许时才发给第三方镜像"""
+    if to_mirrors or endpoint.rstrip("/") == DEFAULT_ENDPOINT:
+        return token
+    return None
+
+
+def resolve_url(endpoint: str, repo_type: str, repo_id: str, revision: str, filename: str) -> str:
+    prefix = "" if repo_type == "model" else f"{repo_type}s/"
+    return (f"{endpoint.rstrip('/')}/{prefix}{repo_id}/resolve/"
+            f"{urllib.parse.quote(revision, safe='')}/{urllib.parse.quote(filename)}")
+
+
+def resolve(endpoint: str, repo_type: str, repo_id: str, revision: str, filename: str,
+            token: Optional[str] = None) -> Resolved:
+    """HEAD 解析文件元数据（同站点的相对跳转继续跟随，跳到 CDN 时停下）"""
+    url = resolve_url(endpoint, repo_type, repo_id, revision, filename)
+    commit = ""
+    with span("hf.resolve", "network", url=url):
+        for _ in range(5):
+            try:
+                resp = _NO_REDIRECT.open(_request(url, token, "HEAD"), timeout=TIMEOUT)
+                headers, location = resp.headers, None
+                resp.close()
+            except urllib.error.HTTPError as e:
+                if e.code not in (301, 302, 303, 307, 308):
+                    raise DownloadError(f"HTTP {e.code}")
+                headers, location = e.headers, e.headers.get("Location")
+            commit = headers.get("X-Repo-Commit") or commit
+            etag = (headers.get("X-Linked-Etag") or headers.get("ETag") or "")
+            etag = etag.replace("W/", "").strip('"')
+            size = headers.get("X-Linked-Size") or headers.get("Content-Length")
+            if location:
+                target = urllib.parse.urljoin(url, location)
+                same_site = urllib.parse.urlsplit(target).netloc == urllib.parse.urlsplit(url).netloc
+                if same_site and not etag:
+                    url = target
+                    continue
+                url = target
+            if not etag or not size:
+                raise DownloadError("响应缺少 ETag 或大小")
+            return Resolved(endpoint, url, commit, etag, int(size))
+    raise DownloadError("跳转次数过多")
+
+
+def resolve_all(endpoints: List[str], repo_type: str, repo_id: str, revision: str,
+                filename: str, token: Optional[str] = None, token_to_mirrors: bool = False
+                ) -> Tuple[List[Resolved], Dict[str, str]]:
+    """并发解析；返回与多数一致的来源，以及被排除的端点及原因"""
+    def attempt(endpoint):
+        try:
+            return resolve(endpoint, repo_type, repo_id, revision, filename,
+                           endpoint_token(endpoint, token, token_to_mirrors))
+        except Exception as e:
+            return str(e) or type(e).__name__
+
+    with ThreadPoolExecutor(max_workers=min(8, len(endpoints)), thread_name_prefix="resolve") as pool:
+        results = list(pool.map(attempt, endpoints))
+    excluded = {ep: r for ep, r in zip(endpoints, results) if isinstance(r, str)}
+    resolved = [r for r in results if isinstance(r, Resolved)]
+    if not resolved:
+        return [], excluded
+    votes = Counter((r.etag, r.size) for r in resolved)
+    # 票数相同时以列表靠前（官方优先）的端点为准
+    best = max(votes, key=lambda key: (votes[key], -[(r.etag, r.size) for r in resolved].index(key)))
+    for r in resolved:
+        if (r.etag, r.size) != best:
+            excluded[r.endpoint] = f"与其他镜像不一致（etag {r.etag[:12]}，{r.size} 字节）"
+    return [r for r in resolved if (r.etag, r.size) == best], excluded
+
+
+# ============ 按位置写入 ============
+class PositionalFile:
+    """预分配大小并按偏移写入；有 os.pwrite 时直接用，否则每个线程各持一个句柄 seek 后写"""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        with open(path, "ab") as f:
+            f.truncate(size)
+        self._fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+
+    def write_at(self, offset: int, data: bytes):
+        if hasattr(os, "pwrite"):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self._fd, view, offset)
+                view, offset = view[written:], offset + written
+            return
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            handle = open(self.path, "r+b", buffering=0)
+            self._local.handle = handle
+            with self._lock:
+                self._handles.append(handle)
+        handle.seek(offset)
+        handle.write(data)
+
+    def close(self):
+        os.close(self._fd)
+        for handle in self._handles:
+            handle.close()
+
+
+# ============ 分段下载 ============
+class Source:
+    """一个下载来源（某镜像解析出的下载地址）"""
+
+    def __init__(self, resolved: Resolved, token: Optional[str] = None):
+        self.name = urllib.parse.urlsplit(resolved.endpoint).netloc or resolved.endpoint
+        self.url = resolved.download_url
+        # 下载地址已跳到其他站点（如 CDN）时不携带令牌
+        same_site = urllib.parse.urlsplit(self.url).netloc == urllib.parse.urlsplit(resolved.endpoint).netloc
+        self.token = token if same_site else None
+        self.bytes = 0
+        self.errors = 0
+        self.alive = True
+        # 单连接吞吐量的指数加权平均（字节/秒）
+        self.rate = 0.0
+
+
+class Segment:
+    """文件区间 [start, end)，pos 为已写入位置"""
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.pos = start
+        self.source: Optional[Source] = None
+
+    @property
+    def remaining(self) -> int:
+        return max(self.end - self.pos, 0)
+
+
+class SegmentedDownloader:
+    """多来源、多连接分段下载到预分配文件"""
+
+    def __init__(self, sources: List[Source], size: int, path: str, connections: int = 8,
+                 segment_size: int = SEGMENT_SIZE):
+        self.sources = sources
+        self.size = size
+        self.path = path
+        self.connections = max(1, connections)
+        self._lock = threading.Lock()
+        self._queue = [Segment(s, min(s + segment_size, size)) for s in range(0, size, segment_size)]
+        self._active: List[Segment] = []
+        self._file: Optional[PositionalFile] = None
+
+    @property
+    def downloaded(self) -> int:
+        return sum(s.bytes for s in self.sources)
+
+    def run(self, progress=None):
+        """下载全部区间；progress(已下载字节, 总字节) 每秒回调一次"""
+        self._file = PositionalFile(self.path, self.size)
+        try:
+            workers = [threading.Thread(target=self._worker, args=(self.sources[i % len(self.sources)],),
+                                        name=f"hf-dl-{i}", daemon=True)
+                       for i in range(self.connections)]
+            for worker in workers:
+                worker.start()
+            while any(w.is_alive() for w in workers):
+                for worker in workers:
+                    worker.join(timeout=1.0)
+                    if worker.is_alive():
+                        break
+                if progress:
+                    progress(self.downloaded, self.size)
+        finally:
+            self._file.close()
+        with self._lock:
+            left = [s for s in self._queue + self._active if s.remaining]
+        if left:
+            raise DownloadError(f"所有来源均不可用，剩余 {format_size(sum(s.remaining for s in left))}")
+
+    def _pick_source(self, preferred: Source) -> Optional[Source]:
+        if preferred.alive:
+            return preferred
+        alive = [s for s in self.sources if s.alive]
+        return max(alive, key=lambda s: s.rate) if alive else None
+
+    def _next_segment(self, source: Source) -> Optional[Segment]:
+        """先取队列，队列为空时从剩余时间最长的区间切走后半段"""
+        with self._lock:
+            if self._queue:
+                segment = self._queue.pop(0)
+            else:
+                segment = self._steal(source)
+                if segment is None:
+                    return None
+            segment.source = source
+            self._active.append(segment)
+            return segment
+
+    def _steal(self, thief: Source) -> Optional[Segment]:
+        def eta(segment):
+            rate = segment.source.rate if segment.source else 0.0
+            return segment.remaining / rate if rate else float("inf")
+
+        candidates = [s for s in self._active if s.remaining >= 2 * MIN_SPLIT]
+        if not candidates:
+            return None
+        victim = max(candidates, key=eta)
+        half = victim.remaining // 2
+        # 自己下完后半段比原来源下完整段还快才值得切
+        if thief.rate and victim.source and victim.source.rate and victim.source is not thief:
+            if half / thief.rate >= eta(victim):
+                return None
+        elif victim.source is thief and thief.rate:
+            return None
+        split = victim.pos + half
+        stolen = Segment(split, victim.end)
+        victim.end = split
+        return stolen
+
+    def _worker(self, preferred: Source):
+        while True:
+            source = self._pick_source(preferred)
+            if source is None:
+                return
+            segment = self._next_segment(source)
+            if segment is None:
+                return
+            try:
+                self._fetch(segment, source)
+                with self._lock:
+                    source.errors = 0
+            except Exception as e:
+                with self._lock:
+                    source.errors += 1
+                    if source.errors >= MAX_SOURCE_ERRORS:
+                        source.alive = False
+                        print(f"停用来源 {source.name}: {e}")
+            finally:
+                with self._lock:
+                    self._active.remove(segment)
+                    segment.source = None
+                    if segment.remaining:
+                        self._queue.insert(0, segment)
+
+    def _fetch(self, segment: Segment, source: Source):
+        req = _request(source.url, source.token,
+                       headers={"Range": f"bytes={segment.pos}-{segment.end - 1}"})
+        with span("hf.segment", "network", source=source.name, start=segment.pos,
+                  length=segment.remaining) as sp:
+            with urllib.request.urlopen(req, timeout=TIMEOUT) as resp:
+                if resp.status != 206 and segment.pos != 0:
+                    raise DownloadError(f"{source.name} 不支持分段下载")
+                started = time.perf_counter()
+                received = 0
+                while True:
+                    with self._lock:
+                        want = min(CHUNK_SIZE * 4, segment.end - segment.pos)
+                    if want <= 0:
+                        break
+                    chunk = resp.read(want)
+                    if not chunk:
+                        raise DownloadError(f"{source.name} 连接提前关闭")
+                    self._file.write_at(segment.pos, chunk)
+                    received += len(chunk)
+                    with self._lock:
+                        segment.pos += len(chunk)
+                        source.bytes += len(chunk)
+                        elapsed = time.perf_counter() - started
+                        if elapsed > 0.2:
+                            rate = received / elapsed
+                            source.rate = rate if not source.rate else source.rate * 0.7 + rate * 0.3
+            sp.set(bytes=received)
+
+
+# ============ 校验与缓存布局 ============
+def verify(path: str, etag: str) -> Optional[bool]:
+    """LFS 文件的 etag 是 SHA-256，普通文件是 git blob SHA-1；无法判断时返回 None"""
+    if len(etag) == 64:
+        digest = hashlib.sha256()
+    elif len(etag) == 40:
+        digest = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode())
+    else:
+        return None
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(4 * 1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest() == etag
+
+
+def hf_cache_dir() -> str:
+    """与 huggingface_hub 相同的缓存目录约定"""
+    if os.environ.get("HF_HUB_CACHE"):
+        return os.environ["HF_HUB_CACHE"]
+    home = os.environ.get("HF_HOME") or os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "huggingface")
+    return os.path.join(home, "hub")
+
+
+def cache_paths(cache_dir: str, repo_type: str, repo_id: str, commit: str, filename: str,
+                etag: str) -> Tuple[str, str, str]:
+    """返回 (仓库目录, blob 路径, 快照路径)"""
+    repo_dir = os.path.join(cache_dir, f"{repo_type}s--{repo_id.replace('/', '--')}")
+    blob = os.path.join(repo_dir, "blobs", etag)
+    snapshot = os.path.join(repo_dir, "snapshots", commit, *filename.split("/"))
+    return repo_dir, blob, snapshot
+
+
+def link_snapshot(blob: str, snapshot: str):
+    """快照文件指向 blob（相对符号链接）；系统不允许符号链接时复制（与 huggingface_hub 一致）"""
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+    if os.path.lexists(snapshot):
+        os.remove(snapshot)
+    try:
+        os.symlink(os.path.relpath(blob, os.path.dirname(snapshot)), snapshot)
+    except OSError:
+        shutil.copyfile(blob, snapshot)
+
+
+def download(repo_id: str, filename: str, endpoints: List[str], revision: str = "main",
+             repo_type: str = "model", cache_dir: Optional[str] = None, connections: int = 8,
+             segment_size: int = SEGMENT_SIZE, token: Optional[str] = None,
+             token_to_mirrors: bool = False) -> str:
+    """下载到 HF 缓存，返回快照中的文件路径（令牌默认只发给官方端点）"""
+    resolved, excluded = resolve_all(endpoints, repo_type, repo_id, revision, filename, token,
+                                     token_to_mirrors)
+    for endpoint, reason in excluded.items():
+        print(f"跳过 {endpoint}: {reason}")
+    if not resolved:
+        raise DownloadError("没有可用的端点")
+    first = resolved[0]
+    commit = next((r.commit for r in resolved if r.commit), "")
+    if not commit:
+        raise DownloadError("无法确定提交号（响应缺少 X-Repo-Commit）")
+    repo_dir, blob, snapshot = cache_paths(cache_dir or hf_cache_dir(), repo_type, repo_id,
+                                           commit, filename, first.etag)
+    if revision != commit:
+        os.makedirs(os.path.join(repo_dir, "refs"), exist_ok=True)
+        with open(os.path.join(repo_dir, "refs", revision), "w", encoding="utf-8") as f:
+            f.write(commit)
+    if os.path.exists(blob) and os.path.getsize(blob) == first.size:
+        print("缓存中已有该文件")
+        link_snapshot(blob, snapshot)
+        return snapshot
+
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    incomplete = blob + ".incomplete"
+    sources = [Source(r, endpoint_token(r.endpoint, token, token_to_mirrors)) for r in resolved]
+    print(f"{filename}: {format_size(first.size)}，来源 {', '.join(s.name for s in sources)}，"
+          f"{connections} 个连接")
+    downloader = SegmentedDownloader(sources, first.size, incomplete, connections, segment_size)
+    started = time.perf_counter()
+
+    def progress(done, total):
+        elapsed = time.perf_counter() - started
+        print(f"\r{done / total:6.1%}  {format_size(done / elapsed if elapsed else 0)}/s  "
+              + "  ".join(f"{s.name} {format_size(s.bytes)}" for s in sources), end="", flush=True)
+
+    downloader.run(progress if first.size else None)
+    print()
+    ok = verify(incomplete, first.etag)
+    if ok is False:
+        os.remove(incomplete)
+        raise DownloadError("校验失败：文件哈希与 ETag 不符")
+    if ok is None:
+        print(f"ETag {first.etag} 不是内容哈希，只校验了大小")
+    os.replace(incomplete, blob)
+    link_snapshot(blob, snapshot)
+    elapsed = time.perf_counter() - started
+    print(f"完成：{format_size(first.size)} 用时 {elapsed:.1f}s"
+          f"（{format_size(first.size / elapsed if elapsed else 0)}/s）")
+    return snapshot
+
+
+def catalog_endpoints() -> List[str]:
+    """mirrors.json 中的 hf 端点（官方地址始终在列，内容校验不一致的镜像除外）"""
+    from catalog import MirrorCatalog
+    from integrity import DIVERGENCE
+    endpoints = [DEFAULT_ENDPOINT]
+    try:
+        with open(os.path.join(base_dir(), "mirrors.json"), "r", encoding="utf-8") as f:
+            catalog = MirrorCatalog.from_config(json.load(f))
+        for entry in catalog.entries("hf"):
+            if not entry.url or entry.url.rstrip("/") in endpoints:
+                continue
+            reason = DIVERGENCE.reason("hf", entry.url)
+            if reason:
+                print(f"跳过 {entry.name}（内容不一致：{reason}）")
+                continue
+            endpoints.append(entry.url.rstrip("/"))
+    except (OSError, ValueError) as e:
+        print(f"读取 mirrors.json 失败，只使用官方端点: {e}")
+    return endpoints
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多镜像分段下载 HuggingFace 文件到本地缓存")
+    parser.add_argument("repo_id")
+    parser.add_argument("filename")
+    parser.add_argument("--revision", default="main")
+    parser.add_argument("--repo-type", default="model", choices=["model", "dataset", "space"])
+    parser.add_argument("--endpoint", action="append",
+                        help="端点地址（可重复，默认使用 mirrors.json 中的 hf 镜像与官方地址）")
+    parser.add_argument("--connections", type=int, default=8, help="并发连接数")
+    parser.add_argument("--segment-mb", type=int, default=SEGMENT_SIZE // (1024 * 1024),
+                        help="区间大小（MB）")
+    parser.add_argument("--cache-dir", help="HF 缓存目录（默认同 huggingface_hub）")
+    parser.add_argument("--send-token-to-mirrors", action="store_true",
+                        help="把 HF_TOKEN 也发给第三方镜像（默认只发给官方端点）")
+    args = parser.parse_args(argv)
+    try:
+        path = download(args.repo_id, args.filename, args.endpoint or catalog_endpoints(),
+                        args.revision, args.repo_type, args.cache_dir, args.connections,
+                        args.segment_mb * 1024 * 1024,
+                        os.environ.get("HF_TOKEN") or os.environ.get("HUGGING_FACE_HUB_TOKEN"),
+                        args.send_token_to_mirrors)
+    except DownloadError as e:
+        print(f"下载失败: {e}", file=sys.stderr)
+        return 1
+    print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""测试历史 - 每次测试结果按网络指纹写入本地 SQLite，按镜像、按网络查询 EWMA、p95 与失败率
+
+办公室局域网、家里宽带与 VPN 下最快的镜像往往不同，排序与默认选择应基于
+"当前网络"的历史，而不是一次测试。
+
+- 网络指纹：默认网关 + 网关 MAC + 本机子网（见 ``sysenv.network_info``）的哈希，缓存一分钟
+- ``summary`` 表随每次写入增量更新 EWMA，查询为一次主键查找
+- p95 与失败率取最近若干次原始样本（索引范围扫描）
+- 原始样本保留 14 天，之后降采样为按小时汇总（次数、失败数、耗时和、最大耗时），汇总保留 180 天
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from catalog import normalize_url
+from paths import data_dir
+from probes import ProbeResult, percentile
+from sysenv import network_info
+from tracing import span
+
+DB_NAME = "history.sqlite3"
+# EWMA 平滑系数（越大越偏向最近的结果）
+EWMA_ALPHA = 0.3
+# p95 与失败率取最近的样本数
+RECENT_SAMPLES = 50
+RAW_RETENTION = 14 * 86400
+ROLLUP_RETENTION = 180 * 86400
+# 每写入该数量的样本整理一次
+COMPACT_EVERY = 500
+# 网络指纹缓存时间（秒）
+FINGERPRINT_TTL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS networks (
+    id TEXT PRIMARY KEY, label TEXT NOT NULL, last_seen INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    network TEXT NOT NULL, eco TEXT NOT NULL, url TEXT NOT NULL, ts INTEGER NOT NULL,
+    ok INTEGER NOT NULL, ms INTEGER NOT NULL, throughput REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_key ON samples (network, eco, url, ts);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    network TEXT NOT NULL, eco TEXT NOT NULL, url TEXT NOT NULL, hour INTEGER NOT NULL,
+    count INTEGER NOT NULL, failures INTEGER NOT NULL, ok_ms_sum INTEGER NOT NULL,
+    ms_max INTEGER NOT NULL,  -- 成功样本的最大耗时（该小时没有成功样本时为 0）
+    PRIMARY KEY (network, eco, url, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summary (
+    network TEXT NOT NULL, eco TEXT NOT NULL, url TEXT NOT NULL,
+    count INTEGER NOT NULL, ewma_ms REAL, ewma_fail REAL NOT NULL, last_ts INTEGER NOT NULL,
+    PRIMARY KEY (network, eco, url)
+) WITHOUT ROWID;
+"""
+
+
+class HistoryStats(NamedTuple):
+    """某镜像在某网络下的历史统计"""
+    count: int
+    # 成功测试耗时的 EWMA（从未成功为 None）
+    ewma_ms: Optional[float]
+    p95_ms: Optional[float]
+    failure_rate: float
+    last_ts: int
+
+    @property
+    def score(self) -> float:
+        """排序分数（越小越好）：EWMA 耗时按失败率加罚"""
+        if self.ewma_ms is None:
+            return float("inf")
+        return self.ewma_ms * (1 + 4 * self.failure_rate)
+
+    def describe(self) -> str:
+        if self.ewma_ms is None:
+            return f"历史 {self.count} 次均失败"
+        return (f"历史 {self.count} 次 EWMA {self.ewma_ms:.0f}ms p95 {self.p95_ms:.0f}ms"
+                f" 失败 {self.failure_rate:.0%}")
+
+
+def network_fingerprint() -> Tuple[str, str]:
+    """当前网络的 (指纹, 说明)；识别不到网关与地址时为离线网络"""
+    info = network_info()
+    label = f"网关 {info.gateway or '?'} 子网 {info.subnet or '?'}"
+    # 不含本机地址：DHCP 换了地址仍是同一网络
+    key = "|".join((info.gateway, info.gateway_mac, info.subnet))
+    return hashlib.sha1(key.encode()).hexdigest()[:16], label
+
+
+class LatencyHistory:
+    """测试历史存储（线程安全，单连接加锁）"""
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._network: Optional[Tuple[str, str]] = None
+        self._network_checked = 0.0
+        self._writes = 0
+
+    @property
+    def path(self) -> str:
+        return self._path or os.path.join(data_dir(), DB_NAME)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with span("history.open", "file", path=self.path):
+                conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._compact(conn, int(time.time()))
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- 网络 ----------
+    @property
+    def network(self) -> str:
+        """当前网络指纹（缓存 FINGERPRINT_TTL 秒）"""
+        return self._current_network()[0]
+
+    def _current_network(self) -> Tuple[str, str]:
+        if self._network is None or time.monotonic() - self._network_checked > FINGERPRINT_TTL:
+            self.refresh_network()
+        return self._network
+
+    def refresh_network(self) -> Tuple[str, str]:
+        """重新识别当前网络，返回 (指纹, 说明)"""
+        self._network = network_fingerprint()
+        self._network_checked = time.monotonic()
+        return self._network
+
+    def networks(self) -> List[Tuple[str, str, int]]:
+        """见过的网络：(指纹, 说明, 最后出现时间)，最近的在前"""
+        with self._lock:
+            return self._db().execute(
+                "SELECT id, label, last_seen FROM networks ORDER BY last_seen DESC").fetchall()
+
+    # ---------- 写入 ----------
+    def record(self, key: str, url: str, result: ProbeResult, ts: Optional[int] = None):
+        """追加一次测试结果并更新 EWMA；数据库不可用时只打印错误"""
+        network, label = self._current_network()
+        ts = int(time.time()) if ts is None else ts
+        url = normalize_url(url)
+        try:
+            with self._lock:
+                db = self._db()
+                with span("history.record", "file", eco=key, url=url):
+                    db.execute("BEGIN")
+                    try:
+                        db.execute("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (network, key, url, ts, int(result.ok), result.ms,
+                                    result.throughput))
+                        self._update_summary(db, network, key, url, result, ts)
+                        db.execute("INSERT INTO networks VALUES (?, ?, ?) ON CONFLICT(id) "
+                                   "DO UPDATE SET label = excluded.label, last_seen = excluded.last_seen",
+                                   (network, label, ts))
+                        db.execute("COMMIT")
+                    except BaseException:
+                        db.execute("ROLLBACK")
+                        raise
+                self._writes += 1
+                if self._writes % COMPACT_EVERY == 0:
+                    self._compact(db, ts)
+        except sqlite3.Error as e:
+            print(f"写入测试历史失败: {e}")
+
+    @staticmethod
+    def _update_summary(db, network: str, key: str, url: str, result: ProbeResult, ts: int):
+        row = db.execute("SELECT count, ewma_ms, ewma_fail FROM summary "
+                         "WHERE network = ? AND eco = ? AND url = ?", (network, key, url)).fetchone()
+        fail = 0.0 if result.ok else 1.0
+        if row is None:
+            count, ewma_ms, ewma_fail = 1, (result.ms if result.ok else None), fail
+        else:
+            count, ewma_ms, ewma_fail = row
+            count += 1
+            if result.ok:
+                ewma_ms = result.ms if ewma_ms is None else ewma_ms + EWMA_ALPHA * (result.ms - ewma_ms)
+            ewma_fail += EWMA_ALPHA * (fail - ewma_fail)
+        db.execute("INSERT OR REPLACE INTO summary VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (network, key, url, count, ewma_ms, ewma_fail, ts))
+
+    def _compact(self, db, now: int):
+        """原始样本降采样为按小时汇总，删除过期数据"""
+        cutoff = now - RAW_RETENTION
+        try:
+            with span("history.compact", "file"):
+                db.execute("BEGIN")
+                db.execute("""
+                    INSERT INTO rollups
+                    SELECT network, eco, url, ts / 3600 * 3600, COUNT(*), SUM(1 - ok),
+                           SUM(CASE WHEN ok THEN ms ELSE 0 END),
+                           COALESCE(MAX(CASE WHEN ok THEN ms END), 0)
+                    FROM samples WHERE ts < ? GROUP BY network, eco, url, ts / 3600
+                    ON CONFLICT (network, eco, url, hour) DO UPDATE SET
+                        count = count + excluded.count, failures = failures + excluded.failures,
+                        ok_ms_sum = ok_ms_sum + excluded.ok_ms_sum,
+                        ms_max = MAX(ms_max, excluded.ms_max)
+                """, (cutoff,))
+                db.execute("DELETE FROM samples WHERE ts < ?", (cutoff,))
+                db.execute("DELETE FROM rollups WHERE hour < ?", (now - ROLLUP_RETENTION,))
+                db.execute("DELETE FROM summary WHERE last_ts < ?", (now - ROLLUP_RETENTION,))
+                db.execute("COMMIT")
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            print(f"整理测试历史失败: {e}")
+
+    # ---------- 查询 ----------
+    def stats(self, key: str, url: str, network: Optional[str] = None) -> Optional[HistoryStats]:
+        """某镜像在某网络（默认当前网络）下的统计，没有记录返回 None"""
+        network = network or self.network
+        url = normalize_url(url)
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute("SELECT count, ewma_ms, ewma_fail, last_ts FROM summary "
+                                 "WHERE network = ? AND eco = ? AND url = ?",
+                                 (network, key, url)).fetchone()
+                if row is None:
+                    return None
+                recent = db.execute("SELECT ok, ms FROM samples WHERE network = ? AND eco = ? "
+                                    "AND url = ? ORDER BY ts DESC LIMIT ?",
+                                    (network, key, url, RECENT_SAMPLES)).fetchall()
+                if not recent:
+                    # 原始样本已降采样：用按小时汇总近似
+                    recent_rollups = db.execute(
+                        "SELECT count, failures, ms_max FROM rollups WHERE network = ? AND eco = ? "
+                        "AND url = ? ORDER BY hour DESC LIMIT ?",
+                        (network, key, url, RECENT_SAMPLES)).fetchall()
+        except sqlite3.Error as e:
+            print(f"读取测试历史失败: {e}")
+            return None
+        count, ewma_ms, _, last_ts = row
+        if recent:
+            ok_ms = [ms for ok, ms in recent if ok]
+            failure_rate = 1 - len(ok_ms) / len(recent)
+        else:
+            total = sum(c for c, _, _ in recent_rollups) or 1
+            failure_rate = sum(f for _, f, _ in recent_rollups) / total
+            # 失败样本（超时等）的耗时不计入，没有成功样本的小时跳过
+            ok_ms = [m for c, f, m in recent_rollups if f < c and m]
+        p95 = percentile(ok_ms, 95) if ok_ms else None
+        return HistoryStats(count, ewma_ms, p95, failure_rate, last_ts)
+
+    def stats_many(self, key: str, urls: Sequence[str]) -> Dict[str, HistoryStats]:
+        """一组镜像在当前网络下的统计（没有记录的不在结果中）"""
+        network = self.network
+        results = {}
+        for url in urls:
+            stats = self.stats(key, url, network)
+            if stats is not None:
+                results[url] = stats
+        return results
+
+    def best(self, key: str, urls: Sequence[str], min_samples: int = 3) -> Optional[str]:
+        """当前网络下历史最好的镜像（测试次数不足的不参与），没有返回 None"""
+        candidates = [(stats.score, url) for url, stats in self.stats_many(key, urls).items()
+                      if stats.count >= min_samples and stats.ewma_ms is not None]
+        return min(candidates)[1] if candidates else None
+
+
+HISTORY = LatencyHistory()
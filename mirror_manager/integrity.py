@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""镜像内容一致性校验 - 从所有镜像并发下载同一批文件，边下载边计算哈希，与官方公布的哈希比对
+
+截断或过期的文件比慢镜像更耽误时间（pip 重试后仍以哈希不符失败），
+内容不一致的镜像记入 ``DIVERGENCE``，排序与自动选择（备用源、缓存代理上游、多镜像下载）都会排除它们。
+
+- Pip：从 pypi.org 的 PEP 691 索引取一组小型纯 Python wheel 的 sha256，
+  检查各镜像索引中公布的哈希，并下载文件计算哈希
+- HuggingFace：从 huggingface.co 解析参考 LFS 文件的 sha256（ETag），
+  检查各镜像返回的 ETag 与大小，并下载文件计算哈希
+
+用法：
+    python integrity.py pip
+    python integrity.py hf --mirror https://hf-mirror.com
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import hf_download
+from catalog import normalize_url
+from paths import base_dir, data_dir
+from pip_proxy import SIMPLE_JSON, normalize_project
+from probes import CHUNK_SIZE, PROBE_TIMEOUT, USER_AGENT, format_size
+from rcfiles import atomic_write_text, read_json
+from tracing import span
+
+PYPI_SIMPLE = "https://pypi.org/simple"
+HF_UPSTREAM = hf_download.DEFAULT_ENDPOINT
+# 默认校验的包：体积小、发布频繁的纯 Python wheel
+DEFAULT_PACKAGES = ("six", "idna", "certifi")
+# 默认校验的 HuggingFace 文件（仓库/文件路径，体积小的 LFS 文件）
+DEFAULT_HF_FILES = ("hf-internal-testing/tiny-random-gpt2/model.safetensors",)
+DOWNLOAD_TIMEOUT = 60
+
+
+class Artifact(NamedTuple):
+    """待校验的文件：官方公布的哈希与大小"""
+    label: str
+    sha256: str
+    size: int = 0
+
+
+class Check(NamedTuple):
+    """某镜像上一个文件的校验结果
+
+    status：ok 一致；mismatch 哈希/大小/元数据不一致；missing 镜像尚未同步该文件；error 请求失败
+    """
+    artifact: str
+    status: str
+    detail: str = ""
+
+
+# 出现即判定镜像内容不一致的状态（missing / error 只说明镜像落后或不可用）
+DIVERGENT_STATUSES = ("mismatch",)
+
+
+def divergence_reason(checks: Sequence[Check]) -> Optional[str]:
+    """校验结果中的不一致原因，全部一致（或只是缺失/失败）返回 None"""
+    bad = [f"{c.artifact}: {c.detail}" for c in checks if c.status in DIVERGENT_STATUSES]
+    return "；".join(bad) if bad else None
+
+
+# ============ 不一致镜像记录 ============
+class DivergenceRegistry:
+    """内容不一致的镜像（按生态与规范化地址），持久化到数据目录，重新校验通过后移除"""
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._data: Optional[Dict[str, Dict[str, Dict]]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return self._path or os.path.join(data_dir(), "divergent.json")
+
+    def _load(self) -> Dict[str, Dict[str, Dict]]:
+        if self._data is None:
+            try:
+                self._data = read_json(self.path)
+            except ValueError as e:
+                print(f"读取镜像校验记录失败: {e}")
+                self._data = {}
+        return self._data
+
+    def reason(self, key: str, url: str) -> Optional[str]:
+        """镜像不一致的原因，未标记返回 None"""
+        with self._lock:
+            entry = self._load().get(key, {}).get(normalize_url(url))
+            return entry["reason"] if entry else None
+
+    def excluded(self, key: str, urls: Sequence[str]) -> List[str]:
+        """去掉被标记的镜像"""
+        return [url for url in urls if not self.reason(key, url)]
+
+    def record(self, key: str, results: Dict[str, List[Check]]):
+        """按校验结果标记或移除各镜像"""
+        with self._lock:
+            data = self._load()
+            flagged = data.setdefault(key, {})
+            for url, checks in results.items():
+                reason = divergence_reason(checks)
+                if reason:
+                    flagged[normalize_url(url)] = {"reason": reason, "time": int(time.time())}
+                else:
+                    flagged.pop(normalize_url(url), None)
+            if not flagged:
+                data.pop(key, None)
+            try:
+                atomic_write_text(self.path, json.dumps(data, ensure_ascii=False, indent=2) + "\n")
+            except OSError as e:
+                print(f"保存镜像校验记录失败: {e}")
+
+
+DIVERGENCE = DivergenceRegistry()
+
+
+# ============ 流式哈希 ============
+def stream_hash(url: str, headers: Optional[Dict[str, str]] = None,
+                timeout: float = DOWNLOAD_TIMEOUT) -> Tuple[Optional[str], int, str]:
+    """边下载边计算 sha256，不缓存文件内容；返回 (哈希, 字节数, 错误)
+
+    实际收到的字节数少于服务器声明的 Content-Length 时报告截断。
+    """
+    req = urllib.request.Request(url, headers=dict(headers or {}, **{"User-Agent": USER_AGENT}))
+    digest = hashlib.sha256()
+    size = 0
+    with span("integrity.hash", "network", url=url) as sp:
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                declared = int(resp.headers.get("Content-Length") or 0)
+                while True:
+                    chunk = resp.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+        except urllib.error.HTTPError as e:
+            sp.set(status=e.code, outcome="http_error")
+            return None, size, f"HTTP {e.code}"
+        except Exception as e:
+            sp.set(outcome="error", error=str(e))
+            return None, size, str(e) or type(e).__name__
+        sp.set(bytes=size)
+    if declared and size != declared:
+        return None, size, f"传输截断（{size}/{declared} 字节）"
+    return digest.hexdigest(), size, ""
+
+
+def compare(artifact: Artifact, url: str, headers: Optional[Dict[str, str]] = None) -> Check:
+    """下载并比对哈希与大小"""
+    sha, size, error = stream_hash(url, headers)
+    if error:
+        status = "mismatch" if error.startswith("传输截断") else "error"
+        return Check(artifact.label, status, error)
+    if artifact.size and size != artifact.size:
+        return Check(artifact.label, "mismatch", f"大小 {size}，应为 {artifact.size}")
+    if sha != artifact.sha256:
+        return Check(artifact.label, "mismatch", f"sha256 {sha[:12]}…，应为 {artifact.sha256[:12]}…")
+    return Check(artifact.label, "ok", format_size(size))
+
+
+def _run_checks(tasks: Sequence[Tuple[str, object]], max_workers: int) -> Dict[str, List[Check]]:
+    """并发执行 (镜像, 无参函数) 任务，按镜像汇总"""
+    results: Dict[str, List[Check]] = {url: [] for url, _ in tasks}
+    if not tasks:
+        return results
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks)),
+                            thread_name_prefix="verify") as pool:
+        for (url, _), check in zip(tasks, pool.map(lambda task: task[1](), tasks)):
+            results[url].append(check)
+    return results
+
+
+# ============ Pip ============
+_ANCHOR = re.compile(r'<a\s[^>]*href="([^"]+)"[^>]*>([^<]+)</a>', re.IGNORECASE)
+
+
+def index_files(index_url: str, project: str) -> Dict[str, Tuple[str, Optional[str]]]:
+    """读取镜像的项目索引页：文件名 -> (绝对地址, 公布的 sha256)；支持 PEP 691 JSON 与 PEP 503 HTML"""
+    page = f"{index_url.rstrip('/')}/{normalize_project(project)}/"
+    req = urllib.request.Request(page, headers={
+        "User-Agent": USER_AGENT, "Accept": f"{SIMPLE_JSON}, text/html;q=0.1"})
+    with span("integrity.index", "network", url=page):
+        with urllib.request.urlopen(req, timeout=PROBE_TIMEOUT) as resp:
+            page = resp.geturl()
+            content_type = resp.headers.get("Content-Type", "")
+            body = resp.read()
+    files = {}
+    if content_type.startswith(SIMPLE_JSON):
+        for entry in json.loads(body).get("files", []):
+            link = urllib.parse.urljoin(page, entry["url"])
+            files[entry["filename"]] = (link.split("#")[0], entry.get("hashes", {}).get("sha256"))
+        return files
+    for href, name in _ANCHOR.findall(body.decode("utf-8", "replace")):
+        link, _, fragment = html.unescape(href).partition("#")
+        sha = fragment.split("=", 1)[1] if fragment.startswith("sha256=") else None
+        files[name.strip()] = (urllib.parse.urljoin(page, link), sha)
+    return files
+
+
+def pip_artifacts(packages: Sequence[str]) -> List[Artifact]:
+    """从 pypi.org 取每个包最新的纯 Python wheel 及其 sha256"""
+    artifacts = []
+    for package in packages:
+        try:
+            files = index_files(PYPI_SIMPLE, package)
+        except Exception as e:
+            print(f"读取 pypi.org 索引失败 {package}: {e}")
+            continue
+        wheels = [(name, sha) for name, (_, sha) in files.items()
+                  if name.endswith("-none-any.whl") and sha]
+        if wheels:
+            name, sha = wheels[-1]
+            artifacts.append(Artifact(name, sha))
+    return artifacts
+
+
+def _check_pip(index_url: str, artifact: Artifact) -> Check:
+    project = artifact.label.split("-", 1)[0]
+    try:
+        files = index_files(index_url, project)
+    except Exception as e:
+        return Check(artifact.label, "error", f"索引不可用（{e}）")
+    if artifact.label not in files:
+        return Check(artifact.label, "missing", "索引中没有该文件")
+    link, published = files[artifact.label]
+    if published and published != artifact.sha256:
+        return Check(artifact.label, "mismatch", f"索引公布的 sha256 为 {published[:12]}…")
+    return compare(artifact, link)
+
+
+def verify_pip(urls: Sequence[str], packages: Sequence[str] = DEFAULT_PACKAGES,
+               max_workers: int = 8) -> Dict[str, List[Check]]:
+    """校验各 pip 镜像：索引公布的哈希与实际下载内容都要与 pypi.org 一致"""
+    artifacts = pip_artifacts(packages)
+    if not artifacts:
+        raise RuntimeError("无法从 pypi.org 获取参考文件的哈希")
+    tasks = [(url, lambda u=url, a=artifact: _check_pip(u, a)) for url in urls for artifact in artifacts]
+    return _run_checks(tasks, max_workers)
+
+
+# ============ HuggingFace ============
+def _split_hf_file(spec: str) -> Tuple[str, str]:
+    """'org/name/path/to/file' -> ('org/name', 'path/to/file')"""
+    parts = spec.split("/")
+    return "/".join(parts[:2]), "/".join(parts[2:])
+
+
+def hf_artifacts(files: Sequence[str]) -> List[Artifact]:
+    """从 huggingface.co 解析 LFS 文件的 sha256（ETag）与大小"""
+    artifacts = []
+    for spec in files:
+        repo_id, filename = _split_hf_file(spec)
+        try:
+            resolved = hf_download.resolve(HF_UPSTREAM, "model", repo_id, "main", filename)
+        except Exception as e:
+            print(f"解析 huggingface.co 文件失败 {spec}: {e}")
+            continue
+        if len(resolved.etag) != 64:
+            print(f"{spec} 不是 LFS 文件，跳过")
+            continue
+        artifacts.append(Artifact(spec, resolved.etag, resolved.size))
+    return artifacts
+
+
+def _check_hf(endpoint: str, artifact: Artifact) -> Check:
+    repo_id, filename = _split_hf_file(artifact.label)
+    try:
+        resolved = hf_download.resolve(endpoint, "model", repo_id, "main", filename)
+    except hf_download.DownloadError as e:
+        status = "missing" if "404" in str(e) else "error"
+        return Check(artifact.label, status, str(e))
+    except Exception as e:
+        return Check(artifact.label, "error", str(e) or type(e).__name__)
+    if resolved.etag != artifact.sha256 or resolved.size != artifact.size:
+        return Check(artifact.label, "mismatch",
+                     f"ETag {resolved.etag[:12]}… / {resolved.size} 字节，与官方不符")
+    return compare(artifact, resolved.download_url)
+
+
+def verify_hf(urls: Sequence[str], files: Sequence[str] = DEFAULT_HF_FILES,
+              max_workers: int = 8) -> Dict[str, List[Check]]:
+    """校验各 HuggingFace 镜像：ETag、大小与实际下载内容都要与 huggingface.co 一致"""
+    artifacts = hf_artifacts(files)
+    if not artifacts:
+        raise RuntimeError("无法从 huggingface.co 获取参考文件的哈希")
+    tasks = [(url, lambda u=url, a=artifact: _check_hf(u, a)) for url in urls for artifact in artifacts]
+    return _run_checks(tasks, max_workers)
+
+
+def format_report(results: Dict[str, List[Check]], names: Optional[Dict[str, str]] = None) -> List[str]:
+    """每个镜像一行：一致 / 不一致原因 / 缺失与失败情况"""
+    lines = []
+    for url, checks in results.items():
+        name = (names or {}).get(url, url)
+        reason = divergence_reason(checks)
+        if reason:
+            lines.append(f"{name} - 不一致：{reason}")
+            continue
+        ok = sum(c.status == "ok" for c in checks)
+        others = [f"{c.artifact}: {c.detail}" for c in checks if c.status != "ok"]
+        lines.append(f"{name} - {ok}/{len(checks)} 一致" + (f"（{'；'.join(others)}）" if others else ""))
+    return lines
+
+
+def main(argv=None):
+    import ecosystems
+    from catalog import MirrorCatalog
+    parser = argparse.ArgumentParser(description="校验各镜像提供的文件是否与官方一致")
+    parser.add_argument("type", choices=["pip", "hf"])
+    parser.add_argument("--mirror", action="append", help="镜像地址（可重复，默认 mirrors.json 中的全部镜像）")
+    args = parser.parse_args(argv)
+    with open(os.path.join(base_dir(), "mirrors.json"), "r", encoding="utf-8") as f:
+        catalog = MirrorCatalog.from_config(json.load(f))
+    names = {e.url: e.name for e in catalog.entries(args.type) if e.url}
+    try:
+        results = ecosystems.get(args.type).verify(args.mirror or list(names))
+    except RuntimeError as e:
+        print(f"校验失败: {e}", file=sys.stderr)
+        return 1
+    for line in format_report(results, names):
+        print(line)
+    return 1 if any(divergence_reason(checks) for checks in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
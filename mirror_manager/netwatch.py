@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""网络切换监测 - 网卡/地址变化时重新识别网络，并只对每个生态的少数候选镜像重新测试
+
+笔记本从办公室切到 VPN 后，已应用的镜像可能变成最差的选择。监测到网络指纹变化后：
+1. 丢弃旧网络的最近测试结果（``PROBE_STATS``、各主机延迟、解析缓存、各地址族连接结果与直连/代理比较），
+   刷新测试历史使用的网络指纹
+2. 每个已配置的生态只测试当前镜像与新网络下历史最好的几个候选（没有历史时按目录顺序补足）
+3. 明显更好的镜像以建议形式返回，由界面提示或自动应用
+
+事件来源：Linux 用 netlink（网卡、地址、路由变化），Windows 用 ``NotifyAddrChange``，
+其他系统或初始化失败时退回定时轮询；事件型监测同时低频轮询兜底。
+设置 ``MIRROR_MANAGER_NETWATCH=poll`` 并用 ``MIRROR_MANAGER_SIMULATE_NETWORK`` 指向一个文件，
+修改文件内容即可在 Linux 上模拟网络切换。
+"""
+import argparse
+import logging
+import select
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from catalog import normalize_url
+from history import HISTORY, HistoryStats, network_fingerprint
+from integrity import DIVERGENCE
+from probes import HOST_LATENCY, PROBE_STATS
+from resolver import DNS_CACHE, PATHS
+from routes import ROUTES
+
+logger = logging.getLogger("mirror_manager.netwatch")
+
+ENV_NETWATCH = "MIRROR_MANAGER_NETWATCH"
+ENV_AUTO_SWITCH = "MIRROR_MANAGER_AUTO_SWITCH"
+# 轮询间隔（秒）；事件型监测的兜底轮询间隔
+POLL_INTERVAL = 10
+EVENT_POLL_INTERVAL = 120
+# 收到事件后等待网络稳定（DHCP、路由表更新）再识别
+SETTLE_DELAY = 3
+# 每个生态重新测试的候选数（不含当前镜像）
+TOP_CANDIDATES = 2
+# 候选的分数低于当前镜像的该比例才建议切换
+SWITCH_RATIO = 0.7
+# 且至少快这么多毫秒
+SWITCH_MIN_GAIN_MS = 50
+
+Fingerprint = Tuple[str, str]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """注册网络切换监测相关的命令行参数"""
+    group = parser.add_argument_group("网络切换")
+    group.add_argument(
+        "--netwatch", choices=["auto", "poll", "off"], default=None,
+        help=f"网络切换监测方式（默认 auto，也可用环境变量 {ENV_NETWATCH}）"
+    )
+    group.add_argument(
+        "--auto-switch", action="store_true", default=None,
+        help=f"网络切换后自动应用更快的镜像（默认只提示，也可用环境变量 {ENV_AUTO_SWITCH}=1）"
+    )
+
+
+def mode_from(args: argparse.Namespace, environ) -> str:
+    return args.netwatch or environ.get(ENV_NETWATCH) or "auto"
+
+
+def auto_switch_from(args: argparse.Namespace, environ) -> bool:
+    if args.auto_switch:
+        return True
+    return environ.get(ENV_AUTO_SWITCH, "").lower() in ("1", "true", "yes")
+
+
+# ============ 监测 ============
+class NetworkWatcher:
+    """后台线程：等待网络事件或定时轮询，网络指纹变化时调用 on_change(旧指纹, 新指纹)
+
+    子类只需实现 ``_wait_event``（有事件返回 True，超时返回 False）与可选的 ``_open`` / ``_close``。
+    """
+    name = "poll"
+
+    def __init__(self, on_change: Callable[[Fingerprint, Fingerprint], None],
+                 fingerprint: Callable[[], Fingerprint] = network_fingerprint,
+                 interval: float = POLL_INTERVAL):
+        self.on_change = on_change
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._open()
+        self._thread = threading.Thread(target=self._run, name=f"netwatch-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        self._close()
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    def _wait_event(self, timeout: float) -> bool:
+        self._stop.wait(timeout)
+        return False
+
+    def _run(self):
+        current = self.fingerprint()
+        logger.info("网络监测(%s)启动：%s", self.name, current[1])
+        while not self._stop.is_set():
+            if self._wait_event(self.interval) and self._stop.wait(SETTLE_DELAY):
+                break
+            if self._stop.is_set():
+                break
+            try:
+                new = self.fingerprint()
+            except Exception as e:
+                logger.warning("识别网络失败: %s", e)
+                continue
+            if new[0] != current[0]:
+                logger.info("网络切换：%s -> %s", current[1], new[1])
+                previous, current = current, new
+                try:
+                    self.on_change(previous, new)
+                except Exception:
+                    logger.exception("处理网络切换失败")
+
+
+class PollingWatcher(NetworkWatcher):
+    """定时轮询（所有平台可用）"""
+
+
+class NetlinkWatcher(NetworkWatcher):
+    """Linux：订阅 rtnetlink 的网卡、地址与路由变化"""
+    name = "netlink"
+    # RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR
+    GROUPS = 0x1 | 0x10 | 0x40 | 0x100
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("interval", EVENT_POLL_INTERVAL)
+        super().__init__(*args, **kwargs)
+        self._sock: Optional[socket.socket] = None
+
+    def _open(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0)
+        self._sock.bind((0, self.GROUPS))
+        self._sock.setblocking(False)
+
+    def _close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def _wait_event(self, timeout: float) -> bool:
+        # 每秒检查一次停止标志
+        waited = 0.0
+        while waited < timeout and not self._stop.is_set():
+            ready, _, _ = select.select([self._sock], [], [], 1.0)
+            if ready:
+                # 一次变化通常伴随多条消息，全部读掉
+                try:
+                    while self._sock.recv(65536):
+                        pass
+                except BlockingIOError:
+                    pass
+                return True
+            waited += 1.0
+        return False
+
+
+class AddrChangeWatcher(NetworkWatcher):
+    """Windows：iphlpapi NotifyAddrChange（同步调用，阻塞到 IPv4 地址表变化）"""
+    name = "addrchange"
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("interval", EVENT_POLL_INTERVAL)
+        super().__init__(*args, **kwargs)
+        self._event = threading.Event()
+
+    def _open(self):
+        import ctypes
+        notify = ctypes.windll.iphlpapi.NotifyAddrChange
+
+        def listen():
+            while not self._stop.is_set():
+                if notify(None, None) != 0:
+                    logger.warning("NotifyAddrChange 失败，只靠轮询")
+                    return
+                self._event.set()
+
+        threading.Thread(target=listen, name="netwatch-notify", daemon=True).start()
+
+    def _wait_event(self, timeout: float) -> bool:
+        fired = self._event.wait(timeout)
+        self._event.clear()
+        return fired
+
+
+def create_watcher(on_change: Callable[[Fingerprint, Fingerprint], None],
+                   mode: str = "auto") -> Optional[NetworkWatcher]:
+    """按平台创建并启动监测；mode 为 off 时返回 None，事件型初始化失败时退回轮询"""
+    if mode == "off":
+        return None
+    candidates: List[type] = []
+    if mode == "auto":
+        if sys.platform.startswith("linux"):
+            candidates.append(NetlinkWatcher)
+        elif sys.platform == "win32":
+            candidates.append(AddrChangeWatcher)
+    candidates.append(PollingWatcher)
+    for cls in candidates:
+        watcher = cls(on_change)
+        try:
+            watcher.start()
+            return watcher
+        except (OSError, AttributeError) as e:
+            watcher._close()
+            logger.warning("网络监测 %s 不可用: %s", cls.name, e)
+    return None
+
+
+# ============ 重新评估 ============
+class Suggestion(NamedTuple):
+    """网络切换后建议换用的镜像"""
+    key: str
+    current: str
+    better: str
+    current_stats: Optional[HistoryStats]
+    better_stats: HistoryStats
+
+
+def pick_candidates(eco, current: str, top_k: int = TOP_CANDIDATES) -> List[str]:
+    """新网络下历史最好的 top_k 个候选（不含当前镜像与内容不一致的），不足时按目录顺序补足"""
+    others = [url for url in DIVERGENCE.excluded(eco.key, eco.candidates)
+              if normalize_url(url) != normalize_url(current)]
+    history = HISTORY.stats_many(eco.key, others)
+    known = sorted((stats.score, url) for url, stats in history.items() if stats.ewma_ms is not None)
+    picked = [url for _, url in known[:top_k]]
+    for url in others:
+        if len(picked) >= top_k:
+            break
+        if url not in history:
+            picked.append(url)
+    return picked
+
+
+def reevaluate(ecos: Sequence, top_k: int = TOP_CANDIDATES,
+               max_workers: int = 8) -> List[Suggestion]:
+    """对已配置的生态，只测试当前镜像与少数候选，返回明显更好的建议"""
+    plans = []
+    for eco in ecos:
+        current = eco.read_current()
+        if current and eco.candidates:
+            plans.append((eco, current, pick_candidates(eco, current, top_k)))
+    tasks = [(eco, url) for eco, current, picked in plans for url in [current] + picked]
+    if not tasks:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks)),
+                            thread_name_prefix="reprobe") as pool:
+        list(pool.map(lambda task: task[0].measure(task[1]), tasks))
+
+    suggestions = []
+    for eco, current, picked in plans:
+        current_stats = HISTORY.stats(eco.key, current)
+        current_score = current_stats.score if current_stats else float("inf")
+        best = None
+        for url in picked:
+            stats = HISTORY.stats(eco.key, url)
+            if stats and stats.ewma_ms is not None and (best is None or stats.score < best[1].score):
+                best = (url, stats)
+        if best is None:
+            continue
+        url, stats = best
+        if current_score == float("inf") or (stats.score < current_score * SWITCH_RATIO
+                                             and current_score - stats.score >= SWITCH_MIN_GAIN_MS):
+            suggestions.append(Suggestion(eco.key, current, url, current_stats, stats))
+    return suggestions
+
+
+def handle_change(ecos: Sequence, previous: Fingerprint, new: Fingerprint) -> List[Suggestion]:
+    """网络切换：丢弃旧结果、刷新指纹，再做增量评估"""
+    PROBE_STATS.clear()
+    HOST_LATENCY.clear()
+    DNS_CACHE.clear()
+    PATHS.clear()
+    ROUTES.clear()
+    HISTORY.refresh_network()
+    suggestions = reevaluate(ecos)
+    for s in suggestions:
+        logger.info("网络 %s 下建议 %s 改用 %s（%s）", new[1], s.key, s.better, s.better_stats.describe())
+    return suggestions
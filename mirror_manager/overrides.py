@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+"""本地覆盖配置扫描 - 找出仓库与虚拟环境里让全局镜像失效的配置
+
+应用配置只改 ``--global`` 的 git 配置和用户级 pip 设置，但：
+
+- 仓库自己的 ``.git/config`` 可能有 ``url.<地址>.insteadOf = https://github.com/``，
+  本地配置后读取，同样长度的匹配以它为准
+- 虚拟环境里的 ``pip.conf`` / ``pip.ini`` 的 ``no-index`` 会让 pip 不访问任何索引；
+  ``index-url`` 本身优先级低于 ``PIP_INDEX_URL`` 环境变量，只在没有该环境变量的进程中生效
+- ``requirements*.txt`` 中的 ``-i`` / ``--index-url`` 相当于命令行参数，优先于环境变量
+
+扫描器并发遍历配置的根目录（``MIRROR_MANAGER_SCAN_ROOTS``，默认用户主目录），
+遵循各级 ``.gitignore`` 与 ``.git/info/exclude`` 跳过被忽略的目录（被忽略的虚拟环境仍会识别），
+目录列表按目录 mtime、配置文件内容按文件 mtime 缓存在数据目录，再次扫描只重新读取有变化的部分。
+"""
+import argparse
+import configparser
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, NamedTuple, Optional, Pattern, Sequence, Tuple
+
+from catalog import normalize_url
+from paths import data_dir
+from rcfiles import atomic_write_text, read_json, read_text
+from sysenv import run_git
+from tracing import span
+
+ENV_SCAN_ROOTS = "MIRROR_MANAGER_SCAN_ROOTS"
+CACHE_NAME = "override_scan.json"
+CACHE_VERSION = 1
+MAX_DEPTH = 8
+SCAN_WORKERS = 8
+# 不会包含仓库或虚拟环境、且通常很大的目录
+SKIP_DIRS = frozenset({
+    "node_modules", "__pycache__", "site-packages", "AppData", "Library", "$RECYCLE.BIN",
+    ".cache", ".npm", ".cargo", ".rustup", ".gradle", ".m2", ".nuget", ".conda", ".vscode",
+})
+_REQUIREMENTS = re.compile(r"^requirements.*\.txt$", re.IGNORECASE)
+PIP_CONFIG_NAMES = ("pip.conf", "pip.ini")
+GITHUB = "https://github.com"
+# 扫描覆盖的生态
+SCANNED_KEYS = ("git", "pip")
+
+
+def scan_roots() -> List[str]:
+    """要扫描的根目录（环境变量用路径分隔符分隔多个）"""
+    value = os.environ.get(ENV_SCAN_ROOTS, "")
+    roots = [os.path.expanduser(p) for p in value.split(os.pathsep) if p.strip()]
+    return roots or [os.path.expanduser("~")]
+
+
+# ============ .gitignore ============
+class IgnorePattern(NamedTuple):
+    regex: Pattern
+    negate: bool
+    dir_only: bool
+
+
+def _translate(pattern: str) -> str:
+    """把 gitignore 模式转换为匹配相对路径（/ 分隔）的正则"""
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            chars = pattern[i + 1:end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            out.append("[" + chars.replace("\\", "\\\\") + "]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    body = "".join(out)
+    # 不含 / 的模式匹配任意层级的名称
+    return body if anchored else "(?:.*/)?" + body
+
+
+def compile_gitignore(lines: Sequence[str]) -> List[IgnorePattern]:
+    patterns = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.endswith("\\ "):
+            line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate or line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        try:
+            patterns.append(IgnorePattern(re.compile(_translate(line)), negate, dir_only))
+        except re.error:
+            continue
+    return patterns
+
+
+class IgnoreRules:
+    """从仓库根到当前目录的各级忽略规则（不可变，子目录在此基础上追加）"""
+
+    def __init__(self, layers: Tuple[Tuple[str, Tuple[IgnorePattern, ...]], ...] = ()):
+        self.layers = layers
+
+    def extend(self, base: str, patterns: Sequence[IgnorePattern]) -> "IgnoreRules":
+        if not patterns:
+            return self
+        return IgnoreRules(self.layers + ((base, tuple(patterns)),))
+
+    def ignored(self, path: str, is_dir: bool) -> bool:
+        """后出现（更深层、更靠后）的匹配规则优先，与 git 一致"""
+        result = False
+        for base, patterns in self.layers:
+            rel = os.path.relpath(path, base).replace(os.sep, "/")
+            for p in patterns:
+                if p.dir_only and not is_dir:
+                    continue
+                if p.regex.fullmatch(rel):
+                    result = not p.negate
+        return result
+
+
+# ============ 配置解析 ============
+_GIT_SECTION = re.compile(r'^\s*\[\s*([A-Za-z0-9.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(?:[#;].*)?$')
+_GIT_KEY = re.compile(r'^\s*([A-Za-z][A-Za-z0-9-]*)\s*(?:=\s*(.*))?$')
+
+
+def _git_value(raw: str) -> str:
+    """去掉行内注释与引号"""
+    out = []
+    quoted = False
+    i = 0
+    while i < len(raw):
+        c = raw[i]
+        if c == "\\" and i + 1 < len(raw):
+            out.append(raw[i + 1])
+            i += 2
+            continue
+        if c == '"':
+            quoted = not quoted
+        elif c in "#;" and not quoted:
+            break
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out).strip()
+
+
+def git_insteadof(text: str) -> List[Tuple[str, str]]:
+    """git 配置文件中的 (替换地址, insteadOf 值) 列表"""
+    entries = []
+    section = subsection = None
+    for line in text.splitlines():
+        match = _GIT_SECTION.match(line)
+        if match:
+            section, subsection = match.group(1).lower(), match.group(2)
+            continue
+        match = _GIT_KEY.match(line)
+        if match and section == "url" and subsection and match.group(1).lower() == "insteadof":
+            entries.append((subsection, _git_value(match.group(2) or "")))
+    return entries
+
+
+def pip_config(text: str) -> Dict[str, object]:
+    """pip 配置文件中的 index-url 与 no-index（global / install / download 节）"""
+    parser = configparser.RawConfigParser(strict=False)
+    try:
+        parser.read_string(text)
+    except configparser.Error:
+        return {}
+    result: Dict[str, object] = {}
+    for section in ("global", "download", "install"):
+        if not parser.has_section(section):
+            continue
+        for key, value in parser.items(section):
+            key = key.replace("_", "-")
+            if key == "index-url":
+                result["index_url"] = value.strip()
+            elif key == "no-index":
+                result["no_index"] = value.strip().lower() in ("1", "true", "yes", "on")
+    return result
+
+
+_REQ_INDEX = re.compile(r"^\s*(?:-i|--index-url)(?:\s*=\s*|\s+)(\S+)")
+_REQ_NO_INDEX = re.compile(r"^\s*--no-index\b")
+
+
+def requirements_options(text: str) -> Dict[str, object]:
+    result: Dict[str, object] = {}
+    for line in text.splitlines():
+        match = _REQ_INDEX.match(line)
+        if match:
+            result["index_url"] = match.group(1)
+        elif _REQ_NO_INDEX.match(line):
+            result["no_index"] = True
+    return result
+
+
+def _gitdir(repo: str) -> str:
+    """仓库的 git 目录（.git 为文件时按 gitdir: 指向，工作树使用公共目录）"""
+    dot_git = os.path.join(repo, ".git")
+    if os.path.isdir(dot_git):
+        return dot_git
+    text = read_text(dot_git).strip()
+    if not text.startswith("gitdir:"):
+        return dot_git
+    gitdir = os.path.normpath(os.path.join(repo, text[len("gitdir:"):].strip()))
+    common = read_text(os.path.join(gitdir, "commondir")).strip()
+    return os.path.normpath(os.path.join(gitdir, common)) if common else gitdir
+
+
+# ============ 扫描 ============
+class LocalConfig(NamedTuple):
+    """扫描到的本地配置：kind 为 git / pip.venv / pip.requirements"""
+    kind: str
+    path: str
+    data: object
+
+
+class ScanResult(NamedTuple):
+    configs: List[LocalConfig]
+    dirs: int
+    # 目录未变化、直接使用缓存列表的数量
+    reused: int
+    elapsed_ms: float
+
+
+_PARSERS = {
+    "gitignore": lambda text: text.splitlines(),
+    "git": git_insteadof,
+    "pip.venv": pip_config,
+    "pip.requirements": requirements_options,
+}
+
+
+class OverrideScanner:
+    """并发、遵循 .gitignore 的目录遍历，结果按 mtime 缓存"""
+
+    def __init__(self, cache_path: Optional[str] = None, workers: int = SCAN_WORKERS,
+                 max_depth: int = MAX_DEPTH, use_cache: bool = True):
+        self.cache_path = cache_path or os.path.join(data_dir(), CACHE_NAME)
+        self.workers = workers
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        # 本次扫描读取过的配置文件（用于清理缓存）
+        self._seen = set()
+        cache = read_json(self.cache_path) if use_cache else {}
+        if cache.get("version") != CACHE_VERSION:
+            cache = {}
+        self._dirs: Dict[str, dict] = cache.get("dirs", {})
+        self._files: Dict[str, dict] = cache.get("files", {})
+
+    def save(self):
+        try:
+            atomic_write_text(self.cache_path, json.dumps(
+                {"version": CACHE_VERSION, "dirs": self._dirs, "files": self._files},
+                ensure_ascii=False, separators=(",", ":")))
+        except OSError as e:
+            print(f"保存扫描缓存失败: {e}")
+
+    def _parsed(self, kind: str, path: str):
+        """解析配置文件（按 mtime 与大小缓存），不存在返回 None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = [st.st_mtime_ns, st.st_size]
+        with self._lock:
+            self._seen.add(path)
+            cached = self._files.get(path)
+        if cached and cached["stamp"] == stamp and cached["kind"] == kind:
+            return cached["data"]
+        data = _PARSERS[kind](read_text(path))
+        with self._lock:
+            self._files[path] = {"kind": kind, "stamp": stamp, "data": data}
+        return data
+
+    def _listing(self, path: str) -> Optional[Tuple[List[str], List[str], bool]]:
+        """(子目录, 关注的文件, 是否来自缓存)；目录不可读返回 None"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._dirs.get(path)
+        if cached and cached["mtime"] == mtime:
+            return cached["subdirs"], cached["files"], True
+        subdirs, files = [], []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.name in (".gitignore", ".git", "pyvenv.cfg") \
+                                or entry.name in PIP_CONFIG_NAMES or _REQUIREMENTS.match(entry.name):
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        with self._lock:
+            self._dirs[path] = {"mtime": mtime, "subdirs": subdirs, "files": files}
+        return subdirs, files, False
+
+    def _visit(self, path: str, depth: int, rules: IgnoreRules):
+        listing = self._listing(path)
+        if listing is None:
+            return [], [], False
+        subdirs, files, reused = listing
+        names = set(files)
+        configs: List[LocalConfig] = []
+        if "pyvenv.cfg" in names:
+            # 虚拟环境：只看它的 pip 配置，不深入 site-packages
+            for name in PIP_CONFIG_NAMES:
+                if name in names:
+                    config_path = os.path.join(path, name)
+                    configs.append(LocalConfig("pip.venv", config_path, self._parsed("pip.venv", config_path)))
+            return configs, [], reused
+        if ".git" in subdirs or ".git" in names:
+            # 仓库根：外层仓库的忽略规则不再适用
+            gitdir = _gitdir(path)
+            config_path = os.path.join(gitdir, "config")
+            data = self._parsed("git", config_path)
+            if data is not None:
+                configs.append(LocalConfig("git", config_path, data))
+            exclude = self._parsed("gitignore", os.path.join(gitdir, "info", "exclude")) or []
+            rules = IgnoreRules().extend(path, compile_gitignore(exclude))
+        if ".gitignore" in names:
+            rules = rules.extend(path, compile_gitignore(
+                self._parsed("gitignore", os.path.join(path, ".gitignore")) or []))
+        for name in files:
+            if _REQUIREMENTS.match(name):
+                req_path = os.path.join(path, name)
+                data = self._parsed("pip.requirements", req_path)
+                if data:
+                    configs.append(LocalConfig("pip.requirements", req_path, data))
+        children = []
+        if depth < self.max_depth:
+            for name in subdirs:
+                if name == ".git" or name in SKIP_DIRS:
+                    continue
+                child = os.path.join(path, name)
+                if rules.ignored(child, True):
+                    # 被忽略的目录不深入，但虚拟环境（.venv 等）通常被忽略
+                    if os.path.isfile(os.path.join(child, "pyvenv.cfg")):
+                        children.append((child, depth + 1, rules))
+                    continue
+                children.append((child, depth + 1, rules))
+        return configs, children, reused
+
+    def scan(self, roots: Sequence[str]) -> ScanResult:
+        """遍历根目录，返回找到的本地配置；完成后删除已不存在目录的缓存并保存"""
+        start = time.perf_counter()
+        roots = [os.path.abspath(r) for r in roots]
+        configs: List[LocalConfig] = []
+        visited = set()
+        reused = 0
+        self._seen = set()
+        with span("overrides.scan", "file", roots=len(roots)) as sp, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scan") as pool:
+            pending = {pool.submit(self._visit, root, 0, IgnoreRules()): root
+                       for root in roots if os.path.isdir(root)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    visited.add(pending.pop(future))
+                    found, children, cached = future.result()
+                    configs.extend(found)
+                    reused += cached
+                    for child, depth, rules in children:
+                        pending[pool.submit(self._visit, child, depth, rules)] = child
+            sp.set(dirs=len(visited), reused=reused, configs=len(configs))
+
+        def under_roots(path: str) -> bool:
+            return any(path == r or path.startswith(r.rstrip(os.sep) + os.sep) for r in roots)
+
+        with self._lock:
+            self._dirs = {p: v for p, v in self._dirs.items() if p in visited or not under_roots(p)}
+            self._files = {p: v for p, v in self._files.items()
+                           if p in self._seen or not under_roots(p)}
+        self.save()
+        configs.sort(key=lambda c: c.path)
+        return ScanResult(configs, len(visited), reused, (time.perf_counter() - start) * 1000)
+
+
+# ============ 评估与修复 ============
+class Override(NamedTuple):
+    """一处让全局镜像失效（effective）或与之不一致的本地配置"""
+    key: str
+    kind: str
+    path: str
+    setting: str
+    value: str
+    detail: str
+    effective: bool
+    fixable: bool
+
+
+def _same(a: str, b: str) -> bool:
+    return normalize_url(a) == normalize_url(b)
+
+
+def find_overrides(configs: Sequence[LocalConfig], applied: Dict[str, Optional[str]],
+                   pip_env: Optional[str] = None) -> List[Override]:
+    """对照已应用的镜像（applied: 生态键 -> 镜像地址，未配置为 None）评估本地配置
+
+    pip_env 为当前的 PIP_INDEX_URL（缓存代理模式下指向本地代理）。
+    """
+    git_mirror = applied.get("git")
+    pip_mirror = applied.get("pip")
+    overrides = []
+    for config in configs:
+        if config.kind == "git" and git_mirror:
+            for base, value in config.data:
+                if value.rstrip("/") != GITHUB or base.strip('"').rstrip("/") == git_mirror.rstrip("/"):
+                    continue
+                overrides.append(Override(
+                    "git", config.kind, config.path, f"url.{base}.insteadOf", value,
+                    f"仓库把 GitHub 改写到 {base}，全局镜像 {git_mirror} 不生效", True, True))
+        elif config.kind == "pip.venv" and pip_mirror and config.data:
+            if config.data.get("no_index"):
+                overrides.append(Override("pip", config.kind, config.path, "no-index", "true",
+                                          "虚拟环境禁用了索引，pip 不会访问镜像", True, True))
+            index = config.data.get("index_url")
+            if index and not _same(index, pip_mirror):
+                if pip_env:
+                    detail = f"虚拟环境指定 {index}，当前被 PIP_INDEX_URL 覆盖，未继承该环境变量的进程仍会使用"
+                else:
+                    detail = f"虚拟环境指定 {index}，全局镜像 {pip_mirror} 不生效"
+                overrides.append(Override("pip", config.kind, config.path, "index-url", index,
+                                          detail, not pip_env, True))
+        elif config.kind == "pip.requirements" and pip_mirror:
+            index = config.data.get("index_url")
+            if index and not _same(index, pip_mirror):
+                overrides.append(Override(
+                    "pip", config.kind, config.path, "--index-url", index,
+                    f"依赖文件指定 {index}，优先于 PIP_INDEX_URL（属于项目源码，需手动修改）",
+                    True, False))
+            if config.data.get("no_index"):
+                overrides.append(Override("pip", config.kind, config.path, "--no-index", "",
+                                          "依赖文件禁用了索引（属于项目源码，需手动修改）", True, False))
+    return overrides
+
+
+_PIP_KEY = re.compile(r"^\s*([A-Za-z_-]+)\s*[=:]")
+
+
+def _is_pip_key(line: str, setting: str) -> bool:
+    match = _PIP_KEY.match(line)
+    return bool(match) and match.group(1).replace("_", "-").lower() == setting
+
+
+def fix_override(override: Override):
+    """删除覆盖配置（依赖文件不自动修改）；失败抛出 RuntimeError 或 OSError"""
+    if not override.fixable:
+        raise RuntimeError("需手动修改")
+    with span("overrides.fix", "file", path=override.path, setting=override.setting):
+        if override.kind == "git":
+            pattern = "^" + re.escape(override.value) + "$"
+            result = run_git(['config', '--file', override.path, '--unset-all',
+                              override.setting, pattern])
+            if result.returncode not in (0, 5):
+                raise RuntimeError(result.stderr.strip() or f"git 返回 {result.returncode}")
+        elif override.kind == "pip.venv":
+            lines = read_text(override.path).splitlines(keepends=True)
+            atomic_write_text(override.path, "".join(
+                line for line in lines if not _is_pip_key(line, override.setting)))
+
+
+def fix_all(overrides: Sequence[Override]) -> List[Tuple[Override, str]]:
+    """修复所有可自动修复的覆盖，返回失败的 (覆盖, 错误)"""
+    failures = []
+    for override in overrides:
+        if not override.fixable:
+            continue
+        try:
+            fix_override(override)
+        except (OSError, RuntimeError) as e:
+            failures.append((override, str(e)))
+    return failures
+
+
+def format_overrides(overrides: Sequence[Override]) -> List[str]:
+    lines = []
+    for o in overrides:
+        mark = "覆盖" if o.effective else "不一致"
+        lines.append(f"[{mark}] {o.path}：{o.detail}")
+    return lines
+
+
+def applied_mirrors(keys: Sequence[str] = ("git", "pip")) -> Dict[str, Optional[str]]:
+    """各生态当前生效的镜像"""
+    import ecosystems
+    return {key: ecosystems.get(key).read_current() for key in keys}
+
+
+def main(argv=None):
+    from ecosystems import current_env
+    parser = argparse.ArgumentParser(description="扫描仓库与虚拟环境中让全局镜像失效的本地配置")
+    parser.add_argument("roots", nargs="*", help=f"扫描的根目录（默认 {ENV_SCAN_ROOTS} 或用户主目录）")
+    parser.add_argument("--fix", action="store_true", help="删除可自动修复的覆盖配置")
+    parser.add_argument("--no-cache", action="store_true", help="忽略上次扫描的缓存")
+    parser.add_argument("--max-depth", type=int, default=MAX_DEPTH, help="最大目录深度")
+    args = parser.parse_args(argv)
+    scanner = OverrideScanner(max_depth=args.max_depth, use_cache=not args.no_cache)
+    result = scanner.scan(args.roots or scan_roots())
+    overrides = find_overrides(result.configs, applied_mirrors(), current_env("PIP_INDEX_URL"))
+    print(f"扫描 {result.dirs} 个目录（{result.reused} 个未变化），用时 {result.elapsed_ms:.0f}ms，"
+          f"发现 {len(overrides)} 处本地配置与全局镜像不一致")
+    for line in format_overrides(overrides):
+        print(line)
+    if args.fix and overrides:
+        failures = fix_all(overrides)
+        for override, error in failures:
+            print(f"修复失败 {override.path}: {error}", file=sys.stderr)
+        fixed = sum(o.fixable for o in overrides) - len(failures)
+        print(f"已修复 {fixed} 处")
+    return 1 if any(o.effective for o in overrides) and not args.fix else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""程序目录与数据目录"""
+import os
+import sys
+
+APP_DIR_NAME = "MirrorManager"
+
+
+def base_dir() -> str:
+    """程序所在目录（打包后为 exe 所在目录），mirrors.json 放在这里"""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def data_dir() -> str:
+    """用户数据目录（追踪日志、缓存等），不存在时自动创建"""
+    if sys.platform == "win32":
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+        path = os.path.join(root, APP_DIR_NAME)
+    else:
+        root = os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state')
+        path = os.path.join(root, APP_DIR_NAME.lower())
+    os.makedirs(path, exist_ok=True)
+    return path
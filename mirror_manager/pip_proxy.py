@@ -0,0 +1,574 @@
+# -*- coding: utf-8 -*-
+"""本地 pip 缓存代理 - 在本机（或局域网）提供 PEP 503/691 simple API 与文件下载
+
+索引页从当前最快的健康镜像获取（出错时换下一个），页面中的链接改写为经过代理；
+文件按 sha256 内容寻址缓存在磁盘上：未命中时边转发给客户端边写入缓存，
+命中时用 sendfile（Windows 上用 mmap）直接从磁盘发送。``/_stats`` 返回命中率等统计。
+
+用法（独立运行，供局域网内其他机器使用）：
+    python pip_proxy.py --host 0.0.0.0 --port 7141
+    pip install -i http://<本机IP>:7141/simple/ --trusted-host <本机IP> requests
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from paths import base_dir, data_dir
+from probes import CHUNK_SIZE, USER_AGENT, fetch_many
+from tracing import span
+
+logger = logging.getLogger("mirror_manager.pip_proxy")
+
+DEFAULT_PORT = 7141
+SIMPLE_JSON = "application/vnd.pypi.simple.v1+json"
+# 索引页在内存中的缓存时间（秒）
+INDEX_TTL = 300
+# 上游出错后暂停使用的时间（秒，随连续失败次数增加）
+COOLDOWN = 30
+# 后台健康检查间隔（秒）
+HEALTH_INTERVAL = 60
+UPSTREAM_TIMEOUT = 30
+# pypi.org 的文件不在索引域名下
+PYPI_FILES = "https://files.pythonhosted.org/"
+
+
+def normalize_project(name: str) -> str:
+    """PEP 503 项目名规范化"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def files_base(index_url: str) -> str:
+    """镜像的文件根地址：国内镜像的 packages/ 与 simple/ 同级"""
+    parts = urllib.parse.urlsplit(index_url)
+    if parts.hostname == "pypi.org":
+        return PYPI_FILES
+    path = re.sub(r"/simple/?$", "", parts.path.rstrip("/"))
+    return f"{parts.scheme}://{parts.netloc}{path}/"
+
+
+# ============ 上游镜像 ============
+class Upstream:
+    """一个上游镜像及其实时健康状态"""
+
+    def __init__(self, index_url: str):
+        self.index_url = index_url.rstrip("/") + "/"
+        self.files_base = files_base(index_url)
+        # 延迟的指数加权平均（毫秒），未测过为 None
+        self.latency_ms: Optional[float] = None
+        self.failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+
+class UpstreamPool:
+    """按实时健康状态排序上游：可用的按延迟排序，暂停中的排在最后兜底"""
+
+    ALPHA = 0.3
+
+    def __init__(self, urls: List[str]):
+        self._lock = threading.Lock()
+        self.upstreams = [Upstream(u) for u in urls]
+
+    def set_urls(self, urls: List[str]):
+        """更换上游列表，保留已有镜像的健康状态"""
+        with self._lock:
+            known = {u.index_url: u for u in self.upstreams}
+            self.upstreams = [known.get(u.rstrip("/") + "/") or Upstream(u) for u in urls]
+
+    def ordered(self) -> List[Upstream]:
+        now = time.monotonic()
+        with self._lock:
+            ranked = list(enumerate(self.upstreams))
+        ranked.sort(key=lambda item: (
+            item[1].down_until > now,
+            item[1].latency_ms is None,
+            item[1].latency_ms or 0.0,
+            item[0],
+        ))
+        return [u for _, u in ranked]
+
+    def success(self, upstream: Upstream, ms: float):
+        with self._lock:
+            upstream.requests += 1
+            upstream.failures = 0
+            upstream.down_until = 0.0
+            if upstream.latency_ms is None:
+                upstream.latency_ms = ms
+            else:
+                upstream.latency_ms += self.ALPHA * (ms - upstream.latency_ms)
+
+    def failure(self, upstream: Upstream):
+        with self._lock:
+            upstream.requests += 1
+            upstream.errors += 1
+            upstream.failures += 1
+            upstream.down_until = time.monotonic() + COOLDOWN * min(upstream.failures, 10)
+
+    def refresh(self):
+        """并发测试所有上游（请求 pip 项目页）"""
+        upstreams = list(self.upstreams)
+        results = fetch_many([u.index_url + "pip/" for u in upstreams], method="HEAD",
+                             name="pip_proxy.health")
+        for upstream, result in zip(upstreams, results):
+            if result.ok:
+                self.success(upstream, result.ttfb_ms)
+            else:
+                self.failure(upstream)
+
+    def snapshot(self) -> List[Dict]:
+        now = time.monotonic()
+        return [{
+            "url": u.index_url,
+            "latency_ms": round(u.latency_ms, 1) if u.latency_ms is not None else None,
+            "healthy": u.down_until <= now,
+            "requests": u.requests,
+            "errors": u.errors,
+        } for u in self.ordered()]
+
+
+# ============ 磁盘缓存 ============
+class BlobCache:
+    """内容寻址的文件缓存：<根目录>/ab/cd/<sha256>"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        return path if os.path.isfile(path) else None
+
+    def writer(self, key: str, expected_sha256: Optional[str]) -> "CacheWriter":
+        return CacheWriter(self, key, expected_sha256)
+
+
+class CacheWriter:
+    """边下载边写入临时文件，校验 sha256 后原子放入缓存"""
+
+    def __init__(self, cache: BlobCache, key: str, expected_sha256: Optional[str]):
+        self.target = cache.path(key)
+        self.expected = expected_sha256
+        self.digest = hashlib.sha256()
+        self.size = 0
+        directory = os.path.dirname(self.target)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> bool:
+        """完整下载后调用；哈希不符时丢弃并返回 False"""
+        self.file.close()
+        if self.expected and self.digest.hexdigest() != self.expected:
+            logger.warning("哈希不符，丢弃缓存: %s", self.target)
+            self.discard()
+            return False
+        os.replace(self.tmp, self.target)
+        return True
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+
+# ============ 统计 ============
+class ProxyStats:
+    """缓存命中统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "file_hits": 0, "file_misses": 0, "hit_bytes": 0, "miss_bytes": 0,
+            "index_requests": 0, "index_hits": 0, "upstream_errors": 0,
+        }
+
+    def add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    @property
+    def hit_rate(self) -> float:
+        """文件请求的命中率"""
+        with self._lock:
+            total = self.counters["file_hits"] + self.counters["file_misses"]
+            return self.counters["file_hits"] / total if total else 0.0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            data = dict(self.counters)
+        total_bytes = data["hit_bytes"] + data["miss_bytes"]
+        data["hit_rate"] = round(self.hit_rate, 4)
+        data["byte_hit_rate"] = round(data["hit_bytes"] / total_bytes, 4) if total_bytes else 0.0
+        return data
+
+
+# ============ 链接改写 ============
+_HREF = re.compile(r'href="([^"]+)"')
+
+
+def rewrite_link(link: str, page_url: str, upstream: Upstream,
+                 sha256: Optional[str] = None) -> str:
+    """把上游页面中的链接改写为代理地址（其他站点的链接保持不变）"""
+    absolute = urllib.parse.urljoin(page_url, link)
+    url, _, fragment = absolute.partition("#")
+    if url.startswith(upstream.index_url):
+        return "/simple/" + url[len(upstream.index_url):] + (f"#{fragment}" if fragment else "")
+    path = urllib.parse.urlsplit(url).path
+    if "/packages/" not in path:
+        return absolute
+    rest = path.split("/packages/", 1)[1]
+    if not sha256 and fragment.startswith("sha256="):
+        sha256 = fragment[len("sha256="):]
+    return f"/files/{sha256 or '-'}/{rest}" + (f"#{fragment}" if fragment else "")
+
+
+def rewrite_index(body: bytes, content_type: str, page_url: str, upstream: Upstream) -> bytes:
+    """改写索引页（HTML 或 PEP 691 JSON）中的文件链接"""
+    if "json" in content_type:
+        data = json.loads(body)
+        for item in data.get("files", []):
+            item["url"] = rewrite_link(item["url"], page_url, upstream,
+                                       item.get("hashes", {}).get("sha256"))
+        return json.dumps(data).encode("utf-8")
+    text = body.decode("utf-8", "replace")
+    text = _HREF.sub(lambda m: f'href="{rewrite_link(m.group(1), page_url, upstream)}"', text)
+    return text.encode("utf-8")
+
+
+# ============ HTTP 服务 ============
+class ProxyHandler(BaseHTTPRequestHandler):
+    """代理请求处理（pip 使用长连接，所有响应都带长度或关闭连接）"""
+    protocol_version = "HTTP/1.1"
+    server_version = "MirrorManagerPipProxy/1.0"
+
+    @property
+    def proxy(self) -> "PipProxy":
+        return self.server.proxy
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    def do_GET(self):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if path == "/_stats":
+            self._send_bytes(200, "application/json", json.dumps(self.proxy.stats_snapshot(),
+                                                                 ensure_ascii=False).encode())
+        elif path == "/simple":
+            self.send_response(301)
+            self.send_header("Location", "/simple/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif path.startswith("/simple/"):
+            self._index(path[len("/simple/"):])
+        elif path.startswith("/files/"):
+            self._file(path[len("/files/"):])
+        else:
+            self._send_bytes(404, "text/plain", b"not found")
+
+    def _send_bytes(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # ---------- 索引页 ----------
+    def _index(self, rest: str):
+        parts = [p for p in rest.split("/") if p]
+        project = normalize_project(parts[0]) + "/" if parts else ""
+        accept = self.headers.get("Accept", "text/html")
+        kind = "json" if SIMPLE_JSON in accept else "html"
+        self.proxy.stats.add(index_requests=1)
+        cached = self.proxy.index_cache_get((project, kind))
+        if cached:
+            self.proxy.stats.add(index_hits=1)
+            self._send_bytes(200, *cached)
+            return
+        for upstream in self.proxy.pool.ordered():
+            page_url = upstream.index_url + project
+            start = time.perf_counter()
+            try:
+                with span("pip_proxy.index", "network", url=page_url):
+                    req = urllib.request.Request(page_url, headers={
+                        "User-Agent": USER_AGENT, "Accept": accept})
+                    with urllib.request.urlopen(req, timeout=UPSTREAM_TIMEOUT) as resp:
+                        content_type = resp.headers.get("Content-Type", "text/html")
+                        body = resp.read()
+                        page_url = resp.geturl()
+            except urllib.error.HTTPError as e:
+                if e.code == 404:
+                    # 项目不存在不算镜像故障
+                    self.proxy.pool.success(upstream, (time.perf_counter() - start) * 1000)
+                    self._send_bytes(404, "text/plain", b"project not found")
+                    return
+                self._upstream_failed(upstream, e)
+                continue
+            except Exception as e:
+                self._upstream_failed(upstream, e)
+                continue
+            self.proxy.pool.success(upstream, (time.perf_counter() - start) * 1000)
+            body = rewrite_index(body, content_type, page_url, upstream)
+            self.proxy.index_cache_put((project, kind), content_type, body)
+            self._send_bytes(200, content_type, body)
+            return
+        self._send_bytes(502, "text/plain", b"all upstream mirrors failed")
+
+    def _upstream_failed(self, upstream: Upstream, error: Exception):
+        logger.warning("上游出错 %s: %s", upstream.index_url, error)
+        self.proxy.pool.failure(upstream)
+        self.proxy.stats.add(upstream_errors=1)
+
+    # ---------- 文件 ----------
+    def _file(self, rest: str):
+        sha256, _, path = rest.partition("/")
+        if not path or not (sha256 == "-" or re.fullmatch(r"[0-9a-f]{64}", sha256)):
+            self._send_bytes(404, "text/plain", b"not found")
+            return
+        # 带 sha256 的文件按内容寻址；元数据文件与无哈希的链接按路径寻址
+        if sha256 != "-" and not path.endswith(".metadata"):
+            key, expected = sha256, sha256
+        else:
+            key, expected = hashlib.sha256(path.encode("utf-8")).hexdigest(), None
+        cached = self.proxy.cache.lookup(key)
+        if cached:
+            self._send_cached(cached)
+            return
+        self._stream_from_upstream(path, key, expected)
+
+    def _send_cached(self, path: str):
+        """命中：零拷贝从磁盘发送"""
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        with span("pip_proxy.hit", "file", path=path, bytes=size):
+            with open(path, "rb") as f:
+                if size == 0:
+                    pass
+                elif hasattr(os, "sendfile"):
+                    self.connection.sendfile(f)
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        self.wfile.write(mapped)
+        self.proxy.stats.add(file_hits=1, hit_bytes=size)
+
+    def _stream_from_upstream(self, path: str, key: str, expected: Optional[str]):
+        """未命中：依次尝试上游，边转发边写入缓存"""
+        candidates = [(u, u.files_base) for u in self.proxy.pool.ordered()]
+        candidates.append((None, PYPI_FILES))
+        for upstream, base in candidates:
+            url = base + "packages/" + urllib.parse.quote(path)
+            start = time.perf_counter()
+            try:
+                req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+                resp = urllib.request.urlopen(req, timeout=UPSTREAM_TIMEOUT)
+            except urllib.error.HTTPError as e:
+                if e.code != 404 and upstream:
+                    self._upstream_failed(upstream, e)
+                continue
+            except Exception as e:
+                if upstream:
+                    self._upstream_failed(upstream, e)
+                continue
+            if upstream:
+                self.proxy.pool.success(upstream, (time.perf_counter() - start) * 1000)
+            with resp, span("pip_proxy.miss", "network", url=url) as sp:
+                size = self._relay(resp, key, expected)
+                sp.set(bytes=size)
+            return
+        self._send_bytes(502, "text/plain", b"file not available from any mirror")
+
+    def _relay(self, resp, key: str, expected: Optional[str]) -> int:
+        self.send_response(200)
+        self.send_header("Content-Type", resp.headers.get("Content-Type", "application/octet-stream"))
+        length = resp.headers.get("Content-Length")
+        if length:
+            self.send_header("Content-Length", length)
+        else:
+            self.close_connection = True
+        self.end_headers()
+        writer = self.proxy.cache.writer(key, expected)
+        client_alive = True
+        try:
+            while True:
+                chunk = resp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                if client_alive:
+                    try:
+                        self.wfile.write(chunk)
+                    except OSError:
+                        # 客户端断开后继续下载完，供下次命中
+                        client_alive = False
+                        self.close_connection = True
+        except Exception as e:
+            logger.warning("下载中断 %s: %s", resp.geturl(), e)
+            writer.discard()
+            self.close_connection = True
+            return writer.size
+        if length and writer.size != int(length):
+            writer.discard()
+            self.close_connection = True
+        else:
+            writer.commit()
+        self.proxy.stats.add(file_misses=1, miss_bytes=writer.size)
+        return writer.size
+
+
+class _ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class PipProxy:
+    """缓存代理服务（后台线程运行）"""
+
+    def __init__(self, upstreams: List[str], cache_dir: Optional[str] = None,
+                 host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        self.pool = UpstreamPool(upstreams)
+        self.cache = BlobCache(cache_dir or os.path.join(data_dir(), "pip-cache"))
+        self.stats = ProxyStats()
+        self.host = host
+        self.port = port
+        self._index_cache: Dict[Tuple[str, str], Tuple[float, str, bytes]] = {}
+        self._index_lock = threading.Lock()
+        self._server: Optional[_ProxyServer] = None
+        self._stop = threading.Event()
+
+    @property
+    def url(self) -> str:
+        """pip 使用的索引地址"""
+        host = "127.0.0.1" if self.host in ("", "0.0.0.0") else self.host
+        return f"http://{host}:{self.port}/simple/"
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    def start(self):
+        self._server = _ProxyServer((self.host, self.port), ProxyHandler)
+        self._server.proxy = self
+        self.port = self._server.server_address[1]
+        self._stop.clear()
+        threading.Thread(target=self._server.serve_forever, name="pip-proxy", daemon=True).start()
+        threading.Thread(target=self._health_loop, name="pip-proxy-health", daemon=True).start()
+        logger.info("pip 缓存代理已启动: %s", self.url)
+
+    def stop(self):
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _health_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.pool.refresh()
+            except Exception as e:
+                logger.warning("上游健康检查失败: %s", e)
+            self._stop.wait(HEALTH_INTERVAL)
+
+    def index_cache_get(self, key: Tuple[str, str]) -> Optional[Tuple[str, bytes]]:
+        with self._index_lock:
+            entry = self._index_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1], entry[2]
+        return None
+
+    def index_cache_put(self, key: Tuple[str, str], content_type: str, body: bytes):
+        with self._index_lock:
+            self._index_cache[key] = (time.monotonic() + INDEX_TTL, content_type, body)
+
+    def stats_snapshot(self) -> Dict:
+        data = self.stats.snapshot()
+        data["upstreams"] = self.pool.snapshot()
+        return data
+
+
+# ============ 进程内单例（界面程序使用） ============
+_RUNNING: Optional[PipProxy] = None
+_RUNNING_LOCK = threading.Lock()
+
+
+def ensure_running(upstreams: List[str], port: int = DEFAULT_PORT) -> PipProxy:
+    """启动（或更新上游列表）进程内的代理"""
+    global _RUNNING
+    with _RUNNING_LOCK:
+        if _RUNNING is None:
+            proxy = PipProxy(upstreams, port=port)
+            proxy.start()
+            _RUNNING = proxy
+        else:
+            _RUNNING.pool.set_urls(upstreams)
+        return _RUNNING
+
+
+def running() -> Optional[PipProxy]:
+    return _RUNNING
+
+
+def stop_running():
+    global _RUNNING
+    with _RUNNING_LOCK:
+        if _RUNNING is not None:
+            _RUNNING.stop()
+            _RUNNING = None
+
+
+def main(argv=None):
+    from catalog import MirrorCatalog
+
+    parser = argparse.ArgumentParser(description="本地 pip 缓存代理")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（局域网共享用 0.0.0.0）")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--cache-dir", help="缓存目录（默认数据目录下的 pip-cache）")
+    parser.add_argument("--upstream", action="append",
+                        help="上游索引地址（可重复，默认使用 mirrors.json 中的 pip 镜像）")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    upstreams = args.upstream
+    if not upstreams:
+        with open(os.path.join(base_dir(), "mirrors.json"), "r", encoding="utf-8") as f:
+            catalog = MirrorCatalog.from_config(json.load(f))
+        upstreams = [e.url for e in catalog.entries("pip") if e.url]
+    proxy = PipProxy(upstreams, args.cache_dir, args.host, args.port)
+    proxy.start()
+    print(f"pip 缓存代理: {proxy.url}（统计: http://{args.host}:{proxy.port}/_stats）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        proxy.stop()
+
+
+if __name__ == "__main__":
+    main()
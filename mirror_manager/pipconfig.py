@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Pip 生效配置 - 按 pip 的真实优先级合并配置文件与环境变量，并给出每个值的来源
+
+文件按以下顺序加载，后加载的覆盖先加载的：
+1. 全局：Windows ``%PROGRAMDATA%\\pip\\pip.ini``；其他系统 ``$XDG_CONFIG_DIRS/pip/pip.conf`` 与 ``/etc/pip.conf``
+2. 用户：旧位置（Windows ``~\\pip\\pip.ini``，其他 ``~/.pip/pip.conf``），再新位置
+   （Windows ``%APPDATA%\\pip\\pip.ini``，其他 ``$XDG_CONFIG_HOME/pip/pip.conf``）；
+   ``PIP_CONFIG_FILE`` 指向存在的文件时不加载
+3. 站点：``sys.prefix`` 下的配置（取 PATH 上的 python 所在环境）
+4. ``PIP_CONFIG_FILE`` 指向的文件；其值为 ``os.devnull`` 时不加载任何文件
+
+合并后再按节决定：``[global]`` < ``[install]`` < 环境变量 ``PIP_*``（即全局文件中的 ``[install]``
+也会覆盖用户文件中的 ``[global]``）。环境变量取当前进程，其次注册表中的用户环境变量（新开的终端看到的值）。
+
+每个文件的解析结果按路径与 (mtime, 大小) 缓存，注册表按键的最后写入时间缓存，
+文件未变化时重复查询只有 stat 开销。
+"""
+import argparse
+import configparser
+import os
+import shutil
+import sys
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sysenv import read_user_env, user_env_stamp
+from tracing import span
+
+WINDOWS = sys.platform == "win32"
+CONFIG_BASENAME = "pip.ini" if WINDOWS else "pip.conf"
+# 关心的配置项（也是注册表中查找的 PIP_* 变量）
+KEYS = ("index-url", "extra-index-url", "trusted-host", "find-links", "no-index", "timeout", "retries")
+ENV_PREFIX = "PIP_"
+
+
+class Setting(NamedTuple):
+    """一个生效的配置值及其来源"""
+    value: str
+    source: str      # 配置文件路径，或 "环境变量 PIP_XXX"
+    section: str     # global / install / :env:
+
+    def describe(self) -> str:
+        if self.section == ":env:":
+            return self.source
+        return f"{self.source} [{self.section}]"
+
+
+def _normalize(name: str) -> str:
+    return name.lower().replace("_", "-")
+
+
+def env_name(key: str) -> str:
+    """配置项对应的环境变量名（index-url -> PIP_INDEX_URL）"""
+    return ENV_PREFIX + key.upper().replace("-", "_")
+
+
+# ============ 文件位置 ============
+def global_files() -> List[str]:
+    if WINDOWS:
+        return [os.path.join(os.environ.get("PROGRAMDATA", r"C:\ProgramData"), "pip", CONFIG_BASENAME)]
+    if sys.platform == "darwin":
+        dirs = ["/Library/Application Support/pip"]
+    else:
+        xdg = os.environ.get("XDG_CONFIG_DIRS") or "/etc/xdg"
+        dirs = [os.path.join(d, "pip") for d in xdg.split(os.pathsep) if d]
+    return [os.path.join(d, CONFIG_BASENAME) for d in dirs] + [os.path.join("/etc", CONFIG_BASENAME)]
+
+
+def user_files() -> List[str]:
+    home = os.path.expanduser("~")
+    legacy = os.path.join(home, "pip" if WINDOWS else ".pip", CONFIG_BASENAME)
+    if WINDOWS:
+        new = os.path.join(os.environ.get("APPDATA", home), "pip")
+    elif sys.platform == "darwin":
+        new = os.path.join(home, "Library", "Application Support", "pip")
+        if not os.path.isdir(new):
+            new = os.path.join(home, ".config", "pip")
+    else:
+        new = os.path.join(os.environ.get("XDG_CONFIG_HOME") or os.path.join(home, ".config"), "pip")
+    return [legacy, os.path.join(new, CONFIG_BASENAME)]
+
+
+def site_prefix() -> Optional[str]:
+    """PATH 上 python 的 sys.prefix（由可执行文件位置推断，不启动解释器）"""
+    exe = shutil.which("python") or shutil.which("python3")
+    if not exe:
+        return None
+    directory = os.path.dirname(exe)
+    # 虚拟环境与 Unix 安装：<prefix>/Scripts|bin/python；Windows 安装：<prefix>/python.exe
+    if os.path.basename(directory).lower() in ("scripts", "bin"):
+        return os.path.dirname(directory)
+    return directory
+
+
+def site_files() -> List[str]:
+    prefix = site_prefix()
+    return [os.path.join(prefix, CONFIG_BASENAME)] if prefix else []
+
+
+# ============ 解析 ============
+Stamp = Tuple[int, int]
+
+
+def _stamp(path: str) -> Optional[Stamp]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def parse_file(path: str) -> Tuple[Dict[str, str], str]:
+    """解析配置文件为 {"节.键": 值}，失败时返回 ({}, 错误信息)"""
+    parser = configparser.RawConfigParser(strict=False)
+    with span("pipconfig.parse", "config", path=path):
+        try:
+            with open(path, "r", encoding="utf-8-sig") as f:
+                parser.read_file(f, source=path)
+        except (OSError, UnicodeDecodeError, configparser.Error) as e:
+            return {}, str(e).splitlines()[0]
+    values = {}
+    for section in parser.sections():
+        for name, value in parser.items(section):
+            values[f"{section}.{_normalize(name)}"] = value.strip()
+    return values, ""
+
+
+class PipConfigResolver:
+    """按 pip 的优先级解析生效配置；文件与注册表读取结果带缓存，可多线程使用"""
+
+    def __init__(self):
+        self._files: Dict[str, Tuple[Stamp, Dict[str, str], str]] = {}
+        self._registry: Optional[Tuple[Optional[int], Dict[str, str]]] = None
+        self._lock = threading.Lock()
+        self.parses = 0
+
+    def _load(self, path: str) -> Tuple[Dict[str, str], str]:
+        stamp = _stamp(path)
+        if stamp is None:
+            with self._lock:
+                self._files.pop(path, None)
+            return {}, ""
+        with self._lock:
+            cached = self._files.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1], cached[2]
+        values, error = parse_file(path)
+        with self._lock:
+            self._files[path] = (stamp, values, error)
+            self.parses += 1
+        return values, error
+
+    def _registry_env(self) -> Dict[str, str]:
+        """注册表中的 PIP_* 用户环境变量（键未改动时不重复读取）"""
+        stamp = user_env_stamp()
+        if stamp is None:
+            return {}
+        with self._lock:
+            cached = self._registry
+        if cached and cached[0] == stamp:
+            return cached[1]
+        values = {}
+        for key in KEYS + ("config-file",):
+            value = read_user_env(env_name(key))
+            if value:
+                values[env_name(key)] = value
+        with self._lock:
+            self._registry = (stamp, values)
+        return values
+
+    def environ(self) -> Dict[str, str]:
+        """生效的 PIP_* 环境变量：当前进程优先，其次注册表"""
+        values = dict(self._registry_env())
+        values.update((k, v) for k, v in os.environ.items() if k.startswith(ENV_PREFIX) and v)
+        return values
+
+    def config_files(self, environ: Optional[Dict[str, str]] = None) -> List[Tuple[str, str]]:
+        """按加载顺序返回 [(类别, 路径)]"""
+        environ = self.environ() if environ is None else environ
+        config_file = environ.get(env_name("config-file"))
+        if config_file == os.devnull:
+            return []
+        files = [("global", path) for path in global_files()]
+        if not (config_file and os.path.exists(config_file)):
+            files += [("user", path) for path in user_files()]
+        files += [("site", path) for path in site_files()]
+        if config_file:
+            files.append(("env", config_file))
+        return files
+
+    def errors(self) -> Dict[str, str]:
+        """最近一次解析失败的文件及原因"""
+        with self._lock:
+            return {path: error for path, (_, _, error) in self._files.items() if error}
+
+    def resolve(self, command: str = "install") -> Dict[str, Setting]:
+        """pip <command> 实际生效的配置 {键: Setting}"""
+        environ = self.environ()
+        merged: Dict[str, Setting] = {}
+        for _, path in self.config_files(environ):
+            values, _ = self._load(path)
+            for name, value in values.items():
+                merged[name] = Setting(value, path, name.partition(".")[0])
+
+        effective: Dict[str, Setting] = {}
+        for section in ("global", command):
+            for name, setting in merged.items():
+                if setting.section == section:
+                    effective[name.partition(".")[2]] = setting
+        for name, value in environ.items():
+            key = _normalize(name[len(ENV_PREFIX):])
+            if key != "config-file":
+                effective[key] = Setting(value, f"环境变量 {name}", ":env:")
+        return effective
+
+    def index_url(self, command: str = "install") -> Optional[Setting]:
+        """生效的主索引；设置了 no-index 时返回 None"""
+        settings = self.resolve(command)
+        no_index = settings.get("no-index")
+        if no_index and no_index.value.lower() in ("1", "true", "yes", "on"):
+            return None
+        return settings.get("index-url")
+
+    def extra_index_urls(self, command: str = "install") -> List[str]:
+        setting = self.resolve(command).get("extra-index-url")
+        return setting.value.split() if setting else []
+
+
+PIP_CONFIG = PipConfigResolver()
+
+
+def main(argv=None):
+    """命令行：列出 pip 生效的配置及来源"""
+    parser = argparse.ArgumentParser(description="按 pip 的优先级显示生效的配置及来源")
+    parser.add_argument("--command", default="install", help="pip 子命令（决定读取的节，默认 install）")
+    parser.add_argument("--files", action="store_true", help="同时列出按顺序检查的配置文件")
+    args = parser.parse_args(argv)
+
+    if args.files:
+        for kind, path in PIP_CONFIG.config_files():
+            state = "存在" if os.path.exists(path) else "不存在"
+            print(f"{kind:6} {path}（{state}）")
+        print()
+    settings = PIP_CONFIG.resolve(args.command)
+    if not settings:
+        print("未配置（使用 PyPI 默认值）")
+    for key, setting in sorted(settings.items()):
+        print(f"{key} = {' '.join(setting.value.split())}")
+        print(f"    来自 {setting.describe()}")
+    for path, error in PIP_CONFIG.errors().items():
+        print(f"无法解析 {path}: {error}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
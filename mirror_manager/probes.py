@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""镜像测试引擎 - 带计时的 HTTP 请求、并发批量请求与最近测试结果统计"""
+import functools
+import http.client
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from resolver import DNS_CACHE, ConnectRace
+from tracing import span
+
+USER_AGENT = "MirrorManager/1.0"
+PROBE_TIMEOUT = 10
+CHUNK_SIZE = 64 * 1024
+
+
+class ProbeResult(NamedTuple):
+    """一次测试结果（卡片显示用）"""
+    ok: bool
+    ms: int
+    # 失败原因或补充信息
+    detail: str = ""
+    # 测得的下载吞吐量（字节/秒），未测量为 0
+    throughput: float = 0.0
+
+
+class FetchResult(NamedTuple):
+    """一次带计时的 HTTP 请求"""
+    url: str
+    ok: bool
+    status: int
+    # 收到响应头的耗时
+    ttfb_ms: float
+    # 读完响应体的耗时
+    total_ms: float
+    # 实际传输的字节数（未解压）
+    size: int
+    error: str = ""
+    headers: Optional[Dict[str, str]] = None
+    # keep_body 时保留的响应体（未解压）
+    body: bytes = b""
+
+    @property
+    def throughput(self) -> float:
+        """响应体吞吐量（字节/秒）"""
+        body_s = (self.total_ms - self.ttfb_ms) / 1000
+        return self.size / body_s if body_s > 0 else 0.0
+
+
+# ============ 自适应超时与对冲请求 ============
+# 超时取该主机 p95 首字节耗时的倍数，限制在 [MIN_TIMEOUT, 调用方给的上限] 内
+TIMEOUT_FACTOR = 5
+MIN_TIMEOUT = 2.0
+# 自适应需要的最少样本数（不足时使用调用方给的超时）
+MIN_LATENCY_SAMPLES = 5
+# 没有样本时的对冲延迟；有样本时取 p95，至少 MIN_HEDGE_MS
+DEFAULT_HEDGE_MS = 1000
+MIN_HEDGE_MS = 50
+
+
+class HostLatency:
+    """各主机最近的首字节耗时，用于推导超时与对冲延迟"""
+
+    def __init__(self, size: int = 50):
+        self.size = size
+        self._samples: Dict[str, Deque[float]] = {}
+        # 来自测试历史的 p95（本次运行还没有足够样本时使用）
+        self._primed: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, host: str, ms: float):
+        with self._lock:
+            self._samples.setdefault(host, deque(maxlen=self.size)).append(ms)
+
+    def prime(self, host: str, p95_ms: float):
+        """用历史统计预置 p95（已有样本时不覆盖）"""
+        with self._lock:
+            self._primed[host] = p95_ms
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._primed.clear()
+
+    def p95(self, host: str) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(host, ()))
+            primed = self._primed.get(host)
+        if len(samples) >= MIN_LATENCY_SAMPLES:
+            return percentile(samples, 95)
+        return primed
+
+    def timeout(self, host: str, ceiling: float) -> float:
+        """自适应超时（秒）"""
+        p95 = self.p95(host)
+        if p95 is None:
+            return ceiling
+        return min(max(p95 * TIMEOUT_FACTOR / 1000, MIN_TIMEOUT), ceiling)
+
+    def hedge_delay(self, host: str, timeout: float) -> float:
+        """发出第二个请求前的等待（秒），不超过超时的一半"""
+        p95 = self.p95(host)
+        ms = DEFAULT_HEDGE_MS if p95 is None else max(p95, MIN_HEDGE_MS)
+        return min(ms / 1000, timeout / 2)
+
+
+class HedgeStats:
+    """对冲请求统计：发出了多少次第二个请求、其中多少次先返回"""
+
+    def __init__(self):
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self._lock = threading.Lock()
+
+    def record(self, fired: bool, won: bool):
+        with self._lock:
+            self.requests += 1
+            self.fired += fired
+            self.won += won
+
+    def summary(self) -> str:
+        with self._lock:
+            if not self.requests:
+                return "尚无请求"
+            return (f"{self.requests} 次请求中对冲 {self.fired} 次"
+                    f"（{self.fired / self.requests:.0%}），对冲请求先返回 {self.won} 次")
+
+
+HOST_LATENCY = HostLatency()
+HEDGE_STATS = HedgeStats()
+
+
+class _Attempt:
+    """一次请求尝试：可限定地址族，记录连接以便取消"""
+
+    def __init__(self, family: int, label: str):
+        self.family = family
+        self.label = label
+        self.sock: Optional[socket.socket] = None
+        self.race: Optional[ConnectRace] = None
+        self.cancelled = False
+        self.responded = False
+        self.done = False
+        self.result: Optional[FetchResult] = None
+
+    def create_connection(self, address, timeout=None, source_address=None):
+        """经解析缓存竞速连接（限定地址族时只在该族的地址间竞速）"""
+        if self.cancelled:
+            raise ConnectionAbortedError("已取消")
+        host, port = address
+        self.race = ConnectRace(host, port, self.family, source_address)
+        self.sock = self.race.run(timeout if isinstance(timeout, (int, float)) else None)
+        return self.sock
+
+    def cancel(self):
+        self.cancelled = True
+        if self.race is not None:
+            self.race.cancel()
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _AttemptHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, attempt: _Attempt, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = attempt.create_connection
+
+
+class _AttemptHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, attempt: _Attempt, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = attempt.create_connection
+
+
+class _AttemptHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, attempt: _Attempt):
+        super().__init__()
+        self.attempt = attempt
+
+    def http_open(self, req):
+        return self.do_open(functools.partial(_AttemptHTTPConnection, attempt=self.attempt), req)
+
+
+class _AttemptHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, attempt: _Attempt):
+        super().__init__()
+        self.attempt = attempt
+
+    def https_open(self, req):
+        return self.do_open(functools.partial(_AttemptHTTPSConnection, attempt=self.attempt), req,
+                            context=self._context)
+
+
+def _proxy_handler(proxy: Optional[str]) -> List[urllib.request.BaseHandler]:
+    """proxy 为 None 时沿用系统代理设置（不额外添加处理器），空字符串为直连，否则为指定代理"""
+    if proxy is None:
+        return []
+    return [urllib.request.ProxyHandler({"http": proxy, "https": proxy} if proxy else {})]
+
+
+def _families(url: str, proxy: Optional[str] = None) -> List[int]:
+    """对冲请求依次使用的地址族：主机同时有 IPv4/IPv6 时两个请求各走一个，否则同族换新连接"""
+    parts = urllib.parse.urlsplit(url)
+    if proxy is None:
+        # 系统代理不用于 NO_PROXY / 例外列表中的主机（与 routes.system_proxy 一致）
+        proxied = (bool(urllib.request.getproxies().get(parts.scheme))
+                   and not urllib.request.proxy_bypass(parts.hostname or ""))
+    else:
+        proxied = bool(proxy)
+    if proxied:
+        # 走代理时连接的是代理，不区分地址族
+        return [0, 0]
+    try:
+        addresses = DNS_CACHE.resolve(parts.hostname or "").addresses
+    except OSError:
+        return [0, 0]
+    families = list(dict.fromkeys(family for family, _ in addresses))
+    return families[:2] if len(families) > 1 else [0, 0]
+
+
+def _run_attempt(attempt: _Attempt, req: urllib.request.Request, timeout: float, method: str,
+                 max_bytes: Optional[int], keep_body: bool, proxy: Optional[str],
+                 race: threading.Condition, state: dict):
+    """在线程中执行一次尝试；第一个收到响应（含 HTTP 错误）的尝试胜出，其余放弃"""
+    opener = urllib.request.build_opener(_AttemptHTTPHandler(attempt), _AttemptHTTPSHandler(attempt),
+                                         *_proxy_handler(proxy))
+    start = time.perf_counter()
+    resp = None
+    try:
+        resp = opener.open(req, timeout=timeout)
+        ttfb = (time.perf_counter() - start) * 1000
+    except urllib.error.HTTPError as e:
+        elapsed = (time.perf_counter() - start) * 1000
+        attempt.result = FetchResult(req.full_url, False, e.code, elapsed, elapsed, 0, f"HTTP {e.code}",
+                                     headers=dict(e.headers.items()) if e.headers else None)
+        e.close()
+    except Exception as e:
+        elapsed = (time.perf_counter() - start) * 1000
+        attempt.result = FetchResult(req.full_url, False, 0, elapsed, elapsed, 0,
+                                     "超时" if isinstance(e, socket.timeout) else (str(e) or type(e).__name__))
+        with race:
+            attempt.done = True
+            race.notify_all()
+        return
+
+    with race:
+        attempt.responded = True
+        if state.get("winner") is None:
+            state["winner"] = attempt
+        race.notify_all()
+        won = state["winner"] is attempt
+    try:
+        if resp is None or not won:
+            return
+        size = 0
+        chunks = []
+        if method != "HEAD":
+            while (max_bytes is None or size < max_bytes) and not attempt.cancelled:
+                want = CHUNK_SIZE if max_bytes is None else min(CHUNK_SIZE, max_bytes - size)
+                chunk = resp.read(want)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if keep_body:
+                    chunks.append(chunk)
+        total = (time.perf_counter() - start) * 1000
+        attempt.result = FetchResult(req.full_url, True, resp.status, ttfb, total, size,
+                                     headers=dict(resp.headers.items()), body=b"".join(chunks))
+    except Exception as e:
+        elapsed = (time.perf_counter() - start) * 1000
+        attempt.result = FetchResult(req.full_url, False, 0, elapsed, elapsed, 0, str(e) or type(e).__name__)
+    finally:
+        if resp is not None:
+            resp.close()
+        with race:
+            attempt.done = True
+            race.notify_all()
+
+
+def timed_fetch(url: str, method: str = "GET", headers: Optional[Dict[str, str]] = None,
+                timeout: float = PROBE_TIMEOUT, max_bytes: Optional[int] = None,
+                name: str = "http.fetch", keep_body: bool = False, hedge: bool = True,
+                proxy: Optional[str] = None) -> FetchResult:
+    """发起请求并分别记录首字节与读完的耗时；max_bytes 限制读取量，keep_body 保留响应体
+
+    timeout 为上限，实际超时按该主机最近的首字节耗时自适应缩短。hedge 时若第一个请求在
+    p95 延迟内没有响应（或很快失败），再发一个请求（优先走另一个地址族），取先响应的一个，
+    另一个放弃；返回的耗时是胜出请求自身的耗时。proxy 默认沿用系统代理设置，
+    空字符串强制直连，其他值为指定的代理地址（两者的耗时分开统计）。
+    """
+    req_headers = {"User-Agent": USER_AGENT}
+    req_headers.update(headers or {})
+    auth = req_headers.pop("Authorization", None)
+    req = urllib.request.Request(url, method=method, headers=req_headers)
+    if auth:
+        # 重定向（如跳转到 CDN 的签名地址）时不携带认证头
+        req.add_unredirected_header("Authorization", auth)
+    host = urllib.parse.urlsplit(url).hostname or ""
+    if proxy is not None:
+        # 指定路径的耗时不混入系统默认路径的统计
+        host += " (直连)" if not proxy else " (代理)"
+    limit = HOST_LATENCY.timeout(host, timeout)
+    race = threading.Condition()
+    state: dict = {}
+    families = _families(url, proxy) if hedge else [0]
+    attempts: List[Tuple[_Attempt, threading.Thread]] = []
+
+    def launch(family: int, label: str) -> _Attempt:
+        attempt = _Attempt(family, label)
+        thread = threading.Thread(target=_run_attempt, name=f"fetch-{label}", daemon=True,
+                                  args=(attempt, req, limit, method, max_bytes, keep_body, proxy,
+                                        race, state))
+        attempts.append((attempt, thread))
+        thread.start()
+        return attempt
+
+    with span(name, "network", url=url, method=method, timeout=round(limit, 2),
+              route="system" if proxy is None else ("direct" if not proxy else "proxy")) as sp:
+        primary = launch(families[0], "primary")
+        hedged = None
+        if hedge:
+            with race:
+                race.wait_for(lambda: primary.responded or primary.done,
+                              timeout=HOST_LATENCY.hedge_delay(host, limit))
+            if not primary.responded:
+                hedged = launch(families[1], "hedge")
+        with race:
+            race.wait_for(lambda: state.get("winner") is not None or all(a.done for a, _ in attempts))
+            winner = state.get("winner")
+        for attempt, thread in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+        if winner is not None:
+            next(t for a, t in attempts if a is winner).join()
+        result = (winner or primary).result
+        if hedged is not None:
+            HEDGE_STATS.record(True, winner is hedged)
+        elif hedge:
+            HEDGE_STATS.record(False, False)
+        if result.status and result.ttfb_ms:
+            HOST_LATENCY.record(host, result.ttfb_ms)
+        sp.set(status=result.status, bytes=result.size, hedged=hedged is not None,
+               winner=winner.label if winner else None,
+               outcome="ok" if result.ok else ("http_error" if result.status else "error"))
+        if not result.ok and not result.status:
+            sp.set(error=result.error)
+        return result
+
+
+def fetch_many(urls: Sequence[str], headers: Optional[Dict[str, str]] = None,
+               max_workers: int = 8, **kwargs) -> List[FetchResult]:
+    """并发请求一批地址（模拟包管理器解析依赖时的并发），结果与输入顺序一致"""
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls)),
+                            thread_name_prefix="probe") as pool:
+        return list(pool.map(lambda u: timed_fetch(u, headers=headers, **kwargs), urls))
+
+
+def http_probe(url: str, method: str = "HEAD", timeout: float = PROBE_TIMEOUT) -> ProbeResult:
+    """HTTP 连接测试：返回首个响应的耗时"""
+    result = timed_fetch(url, method=method, timeout=timeout, name="http.probe")
+    return ProbeResult(result.ok, int(result.ttfb_ms), result.error)
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """线性插值百分位数（q 取 0-100）"""
+    ordered = sorted(values)
+    if not ordered:
+        raise ValueError("没有数据")
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class ProbeStats:
+    """最近的测试结果（每个生态、每个地址保留最近若干次），供自动调优使用"""
+
+    def __init__(self, size: int = 20):
+        self.size = size
+        self._samples: Dict[Tuple[str, str], Deque[ProbeResult]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, url: str, result: ProbeResult):
+        with self._lock:
+            self._samples.setdefault((key, url), deque(maxlen=self.size)).append(result)
+
+    def samples(self, key: str, url: str) -> List[ProbeResult]:
+        with self._lock:
+            return list(self._samples.get((key, url), ()))
+
+    def clear(self):
+        """丢弃全部结果（网络切换后旧结果不再有代表性）"""
+        with self._lock:
+            self._samples.clear()
+
+    def snapshot(self, key: str) -> Dict[str, List[ProbeResult]]:
+        """某生态下所有测试过的地址 -> 最近结果"""
+        with self._lock:
+            return {url: list(results) for (k, url), results in self._samples.items() if k == key}
+
+
+PROBE_STATS = ProbeStats()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""配置文件读写 - 原子写入、``key=value`` 文件（如 .npmrc）、YAML 顶层块（如 .condarc）、
+TOML 表（如 .cargo/config.toml）与 JSON 顶层键（如 daemon.json）的按块修改
+
+只改动目标键所在的行，保留注释、认证令牌等其他内容。
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import tomllib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tracing import span
+
+
+def atomic_write_text(path: str, text: str):
+    """写入同目录临时文件后替换，避免中途崩溃留下半个文件；已有文件的权限保持不变"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp 创建的文件为 0600，替换前沿用原文件的权限
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def read_text(path: str) -> str:
+    """读取文本文件，不存在返回空字符串"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+
+def _key_pattern(key: str):
+    return re.compile(rf'^\s*{re.escape(key)}\s*=', re.IGNORECASE)
+
+
+def read_keyvalue(path: str, key: str) -> Optional[str]:
+    """读取 ``key=value`` 文件中的值（最后一次出现为准）"""
+    pattern = _key_pattern(key)
+    value = None
+    for line in read_text(path).splitlines():
+        if pattern.match(line):
+            value = line.split('=', 1)[1].strip()
+    return value
+
+
+def update_keyvalue(path: str, updates: Dict[str, Optional[str]]) -> bool:
+    """按键修改 ``key=value`` 文件（值为 None 时删除该键），返回是否有改动
+
+    文件因此变空时删除文件。
+    """
+    original = read_text(path)
+    lines = original.splitlines()
+    for key, value in updates.items():
+        pattern = _key_pattern(key)
+        lines = [line for line in lines if not pattern.match(line)]
+        if value is not None:
+            lines.append(f"{key}={value}")
+    text = "\n".join(lines) + "\n" if lines else ""
+    if text == original:
+        return False
+    with span("file.write", "file", path=path, keys=list(updates)):
+        if text.strip():
+            atomic_write_text(path, text)
+        elif os.path.exists(path):
+            os.remove(path)
+    return True
+
+
+# YAML 顶层键（行首）；其后的缩进行与顶格列表项属于同一块
+_YAML_KEY = re.compile(r'^([A-Za-z_][\w-]*)\s*:')
+# TOML 表头 [a.b] / [a."b"]；表一直延续到下一个表头
+_TOML_TABLE = re.compile(r'^\s*\[\[?([^\[\]]+)\]\]?\s*(#.*)?$')
+# TOML 键 a / a.b / "a".'b'（点号键与内联表可在表头之外定义表）
+_TOML_KEY = re.compile(r'''^\s*((?:[\w-]+|"[^"]*"|'[^']*')(?:\s*\.\s*(?:[\w-]+|"[^"]*"|'[^']*'))*)\s*=''')
+
+
+def _yaml_block_start(line: str) -> Optional[str]:
+    match = _YAML_KEY.match(line)
+    if match:
+        return match.group(1)
+    # 缩进行与顶格列表项属于当前块，其余行（空行、注释）结束当前块
+    if line.startswith((' ', '\t', '-')):
+        return None
+    return ""
+
+
+def _toml_name(raw: str) -> str:
+    return re.sub(r'["\'\s]', '', raw)
+
+
+def _toml_block_start(line: str) -> Optional[str]:
+    match = _TOML_TABLE.match(line)
+    if match:
+        return _toml_name(match.group(1))
+    return None
+
+
+def _split_blocks(text: str, block_start) -> List[Tuple[Optional[str], List[str]]]:
+    """按块拆分文本：[(块名或 None, 行列表)]，块名为 None 的是不属于任何块的行
+
+    block_start(line) 返回块名表示新块开始，返回 "" 表示结束当前块，返回 None 表示续行。
+    """
+    blocks: List[Tuple[Optional[str], List[str]]] = [(None, [])]
+    for line in text.splitlines():
+        name = block_start(line)
+        if name is None:
+            blocks[-1][1].append(line)
+        else:
+            blocks.append((name or None, [line]))
+    return blocks
+
+
+def _update_blocks(path: str, block_start, remove: Sequence[str], append: str,
+                   drop_line=None, check=None) -> bool:
+    """删除指定块并在末尾追加新内容，返回是否有改动；文件因此变空时删除文件
+
+    drop_line(块名, 行) 为真的行也会删除；check(新内容) 在写入前校验，失败时抛出异常且不写入。
+    """
+    original = read_text(path)
+    lines = []
+    for name, block in _split_blocks(original, block_start):
+        if name not in remove:
+            lines.extend(line for line in block if not (drop_line and drop_line(name, line)))
+    while lines and not lines[-1].strip():
+        lines.pop()
+    if append:
+        if lines:
+            lines.append("")
+        lines.extend(append.rstrip('\n').splitlines())
+    text = "\n".join(lines) + "\n" if lines else ""
+    if text == original:
+        return False
+    if check:
+        check(text)
+    with span("file.write", "file", path=path, keys=list(remove)):
+        if text.strip():
+            atomic_write_text(path, text)
+        elif os.path.exists(path):
+            os.remove(path)
+    return True
+
+
+def yaml_blocks(text: str) -> Dict[str, List[str]]:
+    """拆出 YAML 顶层块：键 -> 该块的所有行（含键所在行）"""
+    return {name: block for name, block in _split_blocks(text, _yaml_block_start) if name}
+
+
+def update_yaml_blocks(path: str, remove: Sequence[str], append: str = "") -> bool:
+    """删除指定的 YAML 顶层块并在末尾追加新内容（行级处理，不重排其他内容）"""
+    return _update_blocks(path, _yaml_block_start, remove, append)
+
+
+def read_toml(path: str) -> dict:
+    """解析 TOML 文件，不存在或为空返回空字典；格式错误抛出 ValueError（避免覆盖用户文件）"""
+    return tomllib.loads(read_text(path))
+
+
+def toml_get(data: dict, *keys: str):
+    """按路径取嵌套表中的值，路径不存在时返回 None"""
+    for key in keys:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def update_toml_tables(path: str, remove: Sequence[str], append: str = "") -> bool:
+    """删除指定的 TOML 表并在末尾追加新内容（行级处理，不重排其他内容）
+
+    以点号键（``a.b.c = 1``）或内联表（``[a]`` 中的 ``b = {...}``）写在别处的同名定义也一并删除；
+    结果无法解析（如定义嵌在更外层的内联表里）时抛出 ValueError，不写入文件。
+    """
+    def drop_line(table, line):
+        match = _TOML_KEY.match(line)
+        if not match or _toml_block_start(line) is not None:
+            return False
+        key = _toml_name(match.group(1))
+        full = f"{table}.{key}" if table else key
+        return any(full == name or full.startswith(name + ".") for name in remove)
+
+    def check(text):
+        try:
+            tomllib.loads(text)
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(f"{path} 中 {'、'.join(remove)} 的定义方式无法自动修改（{e}），请手动编辑") from e
+
+    return _update_blocks(path, _toml_block_start, remove, append, drop_line, check)
+
+
+def read_json(path: str) -> dict:
+    """读取 JSON 对象文件，不存在或为空返回空字典；格式错误抛出 ValueError（避免覆盖用户文件）"""
+    text = read_text(path)
+    if not text.strip():
+        return {}
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} 顶层不是对象")
+    return data
+
+
+def update_json_keys(path: str, updates: Dict[str, object]) -> bool:
+    """按顶层键修改 JSON 对象文件（值为 None 时删除该键），返回是否有改动
+
+    其他键原样保留；文件因此变空时删除文件。
+    """
+    data = read_json(path)
+    changed = dict(data)
+    for key, value in updates.items():
+        if value is None:
+            changed.pop(key, None)
+        else:
+            changed[key] = value
+    if changed == data:
+        return False
+    with span("file.write", "file", path=path, keys=list(updates)):
+        if changed:
+            atomic_write_text(path, json.dumps(changed, ensure_ascii=False, indent=2) + "\n")
+        elif os.path.exists(path):
+            os.remove(path)
+    return True
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+"""域名解析缓存与 IPv4/IPv6 路径比较 - 测试引擎建立连接的解析层
+
+同一主机的镜像测试、对冲请求、重排序会反复解析同一个域名；部分镜像的 IPv6 不通，
+或地理 DNS 把我们解析到很远的节点。本模块：
+
+- 缓存系统解析结果（与 pip/git 使用的 ``getaddrinfo`` 一致，含 hosts 文件），按记录 TTL 过期；
+  安装了 dnspython 时从 A/AAAA 应答读取 TTL，否则使用默认 TTL
+- Happy Eyeballs（RFC 8305）竞速连接：按系统偏好交错两个地址族，每 250ms 或上一个失败时
+  再发起下一个地址，取最先建立的连接；各次连接耗时按地址族分别记录
+- 按主机报告各地址族的最佳地址与连接耗时，并提示系统优先的地址族不可达或明显更慢
+  （pip 的 urllib3 按解析顺序依次连接，不做竞速，会先等优先地址族超时）
+"""
+import argparse
+import queue
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import dns.resolver  # dnspython：可读取应答的 TTL
+except ImportError:
+    dns = None
+
+from tracing import span
+
+# 无法取得 TTL 时的缓存时间（秒）
+DEFAULT_TTL = 60
+MIN_TTL = 5
+MAX_TTL = 3600
+# 解析失败的缓存时间
+NEGATIVE_TTL = 10
+# RFC 8305 建议的连接尝试间隔
+ATTEMPT_DELAY = 0.25
+CONNECT_TIMEOUT = 5.0
+# 路径比较时每个地址族最多测试的地址数
+ADDRESSES_PER_FAMILY = 2
+# 系统优先的地址族比另一族慢该比例以上时提示
+SLOW_RATIO = 1.5
+
+FAMILY_NAMES = {socket.AF_INET: "IPv4", socket.AF_INET6: "IPv6"}
+
+# (地址族, 不含端口的 sockaddr)
+Address = Tuple[int, tuple]
+
+
+def _with_port(sockaddr: tuple, port: int) -> tuple:
+    return (sockaddr[0], port) + tuple(sockaddr[2:])
+
+
+class Resolution(NamedTuple):
+    """一次解析结果：按系统偏好排序的地址"""
+    host: str
+    addresses: Tuple[Address, ...]
+    ttl: int
+    expires: float
+    error: str = ""
+
+
+def _record_ttl(host: str) -> Optional[int]:
+    """A/AAAA 应答中最小的 TTL；没有 dnspython 或查询失败返回 None"""
+    if dns is None:
+        return None
+    ttls = []
+    for rdtype in ("A", "AAAA"):
+        try:
+            answer = dns.resolver.resolve(host, rdtype, lifetime=2.0, raise_on_no_answer=False)
+        except Exception:
+            continue
+        if answer.rrset is not None:
+            ttls.append(answer.rrset.ttl)
+    return min(ttls) if ttls else None
+
+
+class DnsCache:
+    """主机解析缓存（线程安全）；同一主机并发解析时只查询一次"""
+
+    def __init__(self):
+        self._entries: Dict[str, Resolution] = {}
+        self._pending: Dict[str, threading.Event] = {}
+        self._preferred: Dict[str, Address] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, host: str) -> Resolution:
+        while True:
+            with self._lock:
+                entry = self._entries.get(host)
+                if entry is not None and entry.expires > time.monotonic():
+                    self.hits += 1
+                    return entry
+                event = self._pending.get(host)
+                if event is None:
+                    event = self._pending[host] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()
+        try:
+            entry = self._lookup(host)
+            with self._lock:
+                self._entries[host] = entry
+            return entry
+        finally:
+            with self._lock:
+                del self._pending[host]
+            event.set()
+
+    @staticmethod
+    def _lookup(host: str) -> Resolution:
+        with span("dns.resolve", "network", host=host) as sp:
+            try:
+                infos = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+            except OSError as e:
+                sp.set(error=str(e))
+                return Resolution(host, (), NEGATIVE_TTL, time.monotonic() + NEGATIVE_TTL, str(e))
+            addresses = tuple(dict.fromkeys(
+                (family, _with_port(sockaddr, 0)) for family, _, _, _, sockaddr in infos
+                if family in FAMILY_NAMES))
+            ttl = _record_ttl(host)
+            ttl = DEFAULT_TTL if ttl is None else max(MIN_TTL, min(MAX_TTL, ttl))
+            sp.set(addresses=len(addresses), ttl=ttl)
+            return Resolution(host, addresses, ttl, time.monotonic() + ttl)
+
+    def addresses(self, host: str, family: int = 0) -> List[Address]:
+        """Happy Eyeballs 的尝试顺序：上次胜出的地址在前，其余按系统偏好交错两个地址族"""
+        entry = self.resolve(host)
+        if entry.error:
+            raise socket.gaierror(entry.error)
+        addrs = [a for a in entry.addresses if not family or a[0] == family]
+        with self._lock:
+            preferred = self._preferred.get(host)
+        if preferred in addrs:
+            addrs.remove(preferred)
+            addrs.insert(0, preferred)
+        first = addrs[0][0] if addrs else 0
+        same = [a for a in addrs if a[0] == first]
+        other = [a for a in addrs if a[0] != first]
+        ordered = []
+        for i in range(max(len(same), len(other))):
+            ordered.extend(group[i] for group in (same, other) if i < len(group))
+        return ordered
+
+    def prefer(self, host: str, address: Address):
+        """记住最近连接成功的地址，下次优先尝试"""
+        with self._lock:
+            self._preferred[host] = address
+
+    def clear(self):
+        """网络切换后解析结果与最佳地址可能都变了"""
+        with self._lock:
+            self._entries.clear()
+            self._preferred.clear()
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        return f"解析缓存命中 {self.hits}/{total}" if total else "解析缓存未使用"
+
+
+DNS_CACHE = DnsCache()
+
+
+# ============ 各地址族的连接耗时 ============
+class FamilyPath(NamedTuple):
+    """某主机某地址族的最近连接结果"""
+    family: str
+    address: str
+    connect_ms: Optional[float]
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.connect_ms is not None
+
+
+class PathTable:
+    """按 (主机, 地址族) 记录最近一次连接结果，竞速连接与路径比较都会写入"""
+
+    def __init__(self):
+        self._paths: Dict[Tuple[str, int], FamilyPath] = {}
+        self._lock = threading.Lock()
+
+    def record(self, host: str, family: int, address: str, connect_ms: Optional[float],
+               error: str = ""):
+        path = FamilyPath(FAMILY_NAMES.get(family, str(family)), address, connect_ms, error)
+        with self._lock:
+            self._paths[(host, family)] = path
+
+    def get(self, host: str) -> Dict[int, FamilyPath]:
+        with self._lock:
+            return {family: path for (h, family), path in self._paths.items() if h == host}
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+
+
+PATHS = PathTable()
+
+
+# ============ Happy Eyeballs ============
+def _error_text(e: OSError) -> str:
+    return "超时" if isinstance(e, socket.timeout) else (e.strerror or str(e) or type(e).__name__)
+
+
+def _timed_connect(sock: socket.socket, sockaddr: tuple, port: int, timeout: float,
+                   source_address=None) -> float:
+    """建立 TCP 连接，返回握手耗时（毫秒）"""
+    sock.settimeout(timeout)
+    if source_address:
+        sock.bind(source_address)
+    start = time.perf_counter()
+    sock.connect(_with_port(sockaddr, port))
+    return (time.perf_counter() - start) * 1000
+
+
+class ConnectRace:
+    """一次竞速连接；cancel() 可从其他线程中止，之后新的尝试不再发起"""
+
+    def __init__(self, host: str, port: int, family: int = 0, source_address=None):
+        self.host = host
+        self.port = port
+        self.family = family
+        self.source_address = source_address
+        self._lock = threading.Lock()
+        self._socks: List[socket.socket] = []
+        self._finished = False
+        self.cancelled = False
+
+    def _attempt(self, address: Address, timeout: float, results: queue.Queue):
+        family, sockaddr = address
+        with self._lock:
+            if self._finished or self.cancelled:
+                results.put((address, None, None, ConnectionAbortedError("已取消")))
+                return
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            self._socks.append(sock)
+        try:
+            ms = _timed_connect(sock, sockaddr, self.port, timeout, self.source_address)
+        except OSError as e:
+            sock.close()
+            with self._lock:
+                aborted = self._finished or self.cancelled
+            # 竞速已结束后被中止的尝试不代表该地址不可达
+            if not aborted:
+                PATHS.record(self.host, family, sockaddr[0], None, _error_text(e))
+            results.put((address, None, None, e))
+            return
+        PATHS.record(self.host, family, sockaddr[0], ms)
+        # 与 run() 结束竞速在同一把锁下判断：要么放进结果由 run() 处理，要么自己关闭
+        with self._lock:
+            lost = self._finished
+            if not lost:
+                results.put((address, sock, ms, None))
+        if lost:
+            sock.close()
+
+    def run(self, timeout: Optional[float] = None) -> socket.socket:
+        timeout = timeout or CONNECT_TIMEOUT
+        addrs = DNS_CACHE.addresses(self.host, self.family)
+        if not addrs:
+            raise socket.gaierror(f"{self.host} 没有可用的地址")
+        deadline = time.monotonic() + timeout
+        results: queue.Queue = queue.Queue()
+        started = pending = 0
+        failed: List[Address] = []
+        winner = None
+        error: Optional[OSError] = None
+
+        def start_next():
+            nonlocal started, pending
+            threading.Thread(target=self._attempt, name="connect-race", daemon=True,
+                             args=(addrs[started], deadline - time.monotonic(), results)).start()
+            started += 1
+            pending += 1
+
+        with span("dns.connect", "network", host=self.host, candidates=len(addrs)) as sp:
+            start_next()
+            while pending and not self.cancelled:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = min(ATTEMPT_DELAY, remaining) if started < len(addrs) else remaining
+                try:
+                    address, sock, ms, e = results.get(timeout=wait)
+                except queue.Empty:
+                    if started < len(addrs):
+                        start_next()
+                    continue
+                pending -= 1
+                if sock is not None:
+                    winner = (address, sock, ms)
+                    break
+                error = e
+                failed.append(address)
+                if started < len(addrs):
+                    start_next()
+            with self._lock:
+                self._finished = True
+                losers = [s for s in self._socks if winner is None or s is not winner[1]]
+            # 仍在连接中的尝试：中止等待，让其线程自行关闭套接字
+            for sock in losers:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            # 竞速结束前已连上但未被取走的套接字在结果队列中，由这里关闭
+            while True:
+                try:
+                    _, sock, _, _ = results.get_nowait()
+                except queue.Empty:
+                    break
+                if sock is not None and (winner is None or sock is not winner[1]):
+                    sock.close()
+            sp.set(attempts=started)
+            if winner is None and not self.cancelled:
+                # 到期仍未建立的连接记为超时
+                for family, sockaddr in addrs[:started]:
+                    if (family, sockaddr) not in failed:
+                        PATHS.record(self.host, family, sockaddr[0], None, "超时")
+            if winner is None:
+                sp.set(error=str(error) if error else "超时")
+                if self.cancelled:
+                    raise ConnectionAbortedError("已取消")
+                raise error or socket.timeout(f"连接 {self.host} 超时")
+            address, sock, ms = winner
+            # 尝试时设的是剩余的连接预算（晚到的备选地址只剩零头），交出前恢复为调用方的读写超时
+            sock.settimeout(timeout)
+            DNS_CACHE.prefer(self.host, address)
+            sp.set(family=FAMILY_NAMES.get(address[0]), address=address[1][0], connect_ms=round(ms, 1))
+            return sock
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            socks = list(self._socks)
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def connect(host: str, port: int, timeout: Optional[float] = None, family: int = 0,
+            source_address=None) -> socket.socket:
+    """竞速建立 TCP 连接（family 非 0 时只在该地址族内依次竞速）"""
+    return ConnectRace(host, port, family, source_address).run(timeout)
+
+
+# ============ 路径比较 ============
+class PathReport(NamedTuple):
+    """某主机各地址族的最佳地址"""
+    host: str
+    # 系统解析顺序中的第一个地址族（pip 先尝试的）
+    preferred: Optional[str]
+    paths: List[FamilyPath]
+
+    @property
+    def best(self) -> Optional[FamilyPath]:
+        ok = [p for p in self.paths if p.ok]
+        return min(ok, key=lambda p: p.connect_ms) if ok else None
+
+    @property
+    def warning(self) -> str:
+        """系统优先的地址族不可达或明显更慢时的提示"""
+        best = self.best
+        first = next((p for p in self.paths if p.family == self.preferred), None)
+        if best is None or first is None or first is best:
+            return ""
+        if not first.ok:
+            return f"{first.family} 不可达，pip 会先等待 {first.family} 连接超时再改用 {best.family}"
+        if first.connect_ms > best.connect_ms * SLOW_RATIO:
+            return f"系统优先的 {first.family} 比 {best.family} 慢"
+        return ""
+
+    def describe(self) -> List[str]:
+        if not self.paths:
+            return [f"{self.host}：无法解析"]
+        best = self.best
+        lines = []
+        for p in self.paths:
+            mark = "（最佳）" if p is best and len(self.paths) > 1 else ""
+            timing = f"{p.connect_ms:.0f}ms" if p.ok else f"失败：{p.error}"
+            lines.append(f"{self.host} {p.family} {p.address} {timing}{mark}")
+        if self.warning:
+            lines.append(self.warning)
+        return lines
+
+
+def compare_paths(host: str, port: int = 443, timeout: float = CONNECT_TIMEOUT,
+                  per_family: int = ADDRESSES_PER_FAMILY) -> PathReport:
+    """分别连接每个地址族的前几个地址，报告各地址族的最佳地址与连接耗时"""
+    entry = DNS_CACHE.resolve(host)
+    if not entry.addresses:
+        return PathReport(host, None, [])
+    # 按解析顺序而非上次胜出的地址：比较的是 pip 依次连接时会先尝试哪个
+    addrs = list(entry.addresses)
+    preferred = FAMILY_NAMES[addrs[0][0]]
+    chosen: List[Address] = []
+    for family in FAMILY_NAMES:
+        chosen.extend([a for a in addrs if a[0] == family][:per_family])
+
+    def attempt(address: Address) -> FamilyPath:
+        family, sockaddr = address
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            ms = _timed_connect(sock, sockaddr, port, timeout)
+            return FamilyPath(FAMILY_NAMES[family], sockaddr[0], ms)
+        except OSError as e:
+            return FamilyPath(FAMILY_NAMES[family], sockaddr[0], None, _error_text(e))
+        finally:
+            sock.close()
+
+    with span("dns.compare", "network", host=host, candidates=len(chosen)):
+        with ThreadPoolExecutor(max_workers=max(1, len(chosen)), thread_name_prefix="path") as pool:
+            results = list(zip(chosen, pool.map(attempt, chosen)))
+    paths = []
+    # 系统优先的地址族在前
+    for family in sorted(FAMILY_NAMES, key=lambda f: FAMILY_NAMES[f] != preferred):
+        tried = [p for (f, _), p in results if f == family]
+        if not tried:
+            continue
+        ok = [p for p in tried if p.ok]
+        path = min(ok, key=lambda p: p.connect_ms) if ok else tried[0]
+        PATHS.record(host, family, path.address, path.connect_ms, path.error)
+        paths.append(path)
+    return PathReport(host, preferred, paths)
+
+
+def catalog_hosts() -> List[Tuple[str, int]]:
+    """mirrors.json 中所有镜像的 (主机, 端口)，去重"""
+    import json
+    import os
+    import urllib.parse
+    from catalog import MirrorCatalog
+    from paths import base_dir
+    with open(os.path.join(base_dir(), "mirrors.json"), "r", encoding="utf-8") as f:
+        catalog = MirrorCatalog.from_config(json.load(f))
+    hosts = {}
+    for mtype in catalog.types():
+        for entry in catalog.entries(mtype):
+            parts = urllib.parse.urlsplit(entry.url or "")
+            if parts.hostname:
+                hosts[parts.hostname] = parts.port or (80 if parts.scheme == "http" else 443)
+    return list(hosts.items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比较镜像主机各地址族（IPv4 / IPv6）的连接耗时")
+    parser.add_argument("hosts", nargs="*", help="主机名（默认 mirrors.json 中的全部镜像主机）")
+    parser.add_argument("--port", type=int, default=443, help="连接端口（指定主机时）")
+    parser.add_argument("--timeout", type=float, default=CONNECT_TIMEOUT, help="单次连接超时（秒）")
+    args = parser.parse_args(argv)
+    targets = [(host, args.port) for host in args.hosts] or catalog_hosts()
+    if not targets:
+        print("没有要测试的主机", file=sys.stderr)
+        return 1
+    with ThreadPoolExecutor(max_workers=min(8, len(targets)), thread_name_prefix="compare") as pool:
+        reports = list(pool.map(lambda t: compare_paths(t[0], t[1], args.timeout), targets))
+    for report in reports:
+        for line in report.describe():
+            print(line)
+    return 0 if all(report.best for report in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""直连与代理路径比较 - 测试时分别直连与经系统代理访问镜像，直连更快的镜像可绕过代理
+
+公司网络中系统代理（``HTTP(S)_PROXY`` 环境变量或 Windows 的 Internet 设置）对所有请求生效，
+国内镜像经代理反而更慢。存在适用的代理时，每次测试都会交替直连与经代理请求镜像地址，
+比较首字节耗时的中位数。卡片上勾选"快则直连"后，应用配置时：
+
+- 读取 ``NO_PROXY`` 的工具（pip、huggingface_hub、npm、conda、cargo、go）：镜像主机加入用户环境变量 ``NO_PROXY``
+- git：写入 ``http.<镜像地址>.proxy ""``（见 ``GitEcosystem``）
+
+本工具加入 ``NO_PROXY`` 的主机按生态记录在 ``MIRROR_MANAGER_NO_PROXY``（``pip=a.com,b.com;hf=c.com``）中，
+清理某个生态时只删除它加入、且没有其他生态仍在使用的主机，用户自己的条目不受影响。
+"""
+import statistics
+import threading
+import urllib.parse
+import urllib.request
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from catalog import normalize_url
+from probes import timed_fetch
+from sysenv import read_user_env, set_user_env
+
+# 直连耗时不超过代理的该比例才认为直连更快（避免来回切换）
+DIRECT_RATIO = 0.8
+# 每条路径的请求次数（取中位数）
+ROUTE_SAMPLES = 3
+ROUTE_BYTES = 16 * 1024
+ROUTE_TIMEOUT = 10
+ENV_NO_PROXY = "NO_PROXY"
+NO_PROXY_MARKER = "MIRROR_MANAGER_NO_PROXY"
+
+
+def system_proxy(url: str) -> Optional[str]:
+    """访问 url 时实际使用的代理（环境变量或系统设置，已考虑 NO_PROXY 与例外列表），不走代理返回 None"""
+    parts = urllib.parse.urlsplit(url)
+    if not parts.hostname:
+        return None
+    proxies = urllib.request.getproxies()
+    proxy = proxies.get(parts.scheme) or proxies.get("all")
+    if not proxy or urllib.request.proxy_bypass(parts.hostname):
+        return None
+    return proxy
+
+
+def _proxy_label(proxy: str) -> str:
+    """代理地址去掉用户名密码后用于显示"""
+    parts = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+    return f"{parts.hostname}:{parts.port}" if parts.port else (parts.hostname or proxy)
+
+
+class RouteComparison(NamedTuple):
+    """同一镜像直连与经代理的首字节耗时（中位数，全部失败为 None）"""
+    url: str
+    proxy: str
+    direct_ms: Optional[float]
+    proxy_ms: Optional[float]
+    direct_error: str = ""
+    proxy_error: str = ""
+
+    @property
+    def prefer_direct(self) -> bool:
+        if self.direct_ms is None:
+            return False
+        return self.proxy_ms is None or self.direct_ms <= self.proxy_ms * DIRECT_RATIO
+
+    def describe(self) -> str:
+        direct = f"{self.direct_ms:.0f}ms" if self.direct_ms is not None else f"失败（{self.direct_error}）"
+        via = f"{self.proxy_ms:.0f}ms" if self.proxy_ms is not None else f"失败（{self.proxy_error}）"
+        verdict = "，直连更快" if self.prefer_direct else ""
+        return f"直连 {direct} / 经代理 {_proxy_label(self.proxy)} {via}{verdict}"
+
+
+def compare_routes(url: str, samples: int = ROUTE_SAMPLES) -> Optional[RouteComparison]:
+    """交替直连与经代理请求镜像地址；该地址不走代理时返回 None"""
+    proxy = system_proxy(url)
+    if proxy is None:
+        return None
+    timings: Dict[str, List[float]] = {"": [], proxy: []}
+    errors: Dict[str, str] = {}
+    for _ in range(samples):
+        for route in timings:
+            result = timed_fetch(url, max_bytes=ROUTE_BYTES, timeout=ROUTE_TIMEOUT, hedge=False,
+                                 proxy=route, name="route.direct" if not route else "route.proxy")
+            # HTTP 错误也说明路径是通的（如镜像根地址返回 404）
+            if result.status:
+                timings[route].append(result.ttfb_ms)
+            else:
+                errors[route] = result.error
+
+    def median(route: str) -> Optional[float]:
+        return statistics.median(timings[route]) if timings[route] else None
+
+    return RouteComparison(url, proxy, median(""), median(proxy),
+                           errors.get("", ""), errors.get(proxy, ""))
+
+
+class RouteTable:
+    """各镜像最近一次的路径比较结果"""
+
+    def __init__(self):
+        self._routes: Dict[str, RouteComparison] = {}
+        self._lock = threading.Lock()
+
+    def record(self, comparison: RouteComparison):
+        with self._lock:
+            self._routes[normalize_url(comparison.url)] = comparison
+
+    def get(self, url: str) -> Optional[RouteComparison]:
+        with self._lock:
+            return self._routes.get(normalize_url(url))
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+ROUTES = RouteTable()
+
+
+def measure_route(url: str) -> Optional[RouteComparison]:
+    """比较并记录；不走代理时返回 None"""
+    comparison = compare_routes(url)
+    if comparison is not None:
+        ROUTES.record(comparison)
+    return comparison
+
+
+# ============ NO_PROXY ============
+# 各生态的应用/清理步骤并发执行，NO_PROXY 的读改写需互斥
+_NO_PROXY_LOCK = threading.Lock()
+
+
+def _parse_marker(value: Optional[str]) -> Dict[str, List[str]]:
+    claims: Dict[str, List[str]] = {}
+    for part in (value or "").split(";"):
+        key, _, hosts = part.partition("=")
+        if key.strip():
+            claims[key.strip()] = [h for h in hosts.split(",") if h]
+    return claims
+
+
+def _split_no_proxy(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def claimed_hosts(key: str) -> List[str]:
+    """本工具为该生态加入 NO_PROXY 的主机"""
+    return _parse_marker(read_user_env(NO_PROXY_MARKER)).get(key, [])
+
+
+def set_direct_hosts(key: str, hosts: Sequence[str]):
+    """把该生态加入 NO_PROXY 的主机设为 hosts（空表示全部移除），NO_PROXY 与标记一次写入"""
+    with _NO_PROXY_LOCK:
+        claims = _parse_marker(read_user_env(NO_PROXY_MARKER))
+        if not hosts and key not in claims:
+            return
+        ours = {h for hs in claims.values() for h in hs}
+        machine = read_user_env(ENV_NO_PROXY, machine=True)
+        # 用户级 NO_PROXY 会遮盖系统级的，首次写入时带上系统级的条目
+        current = read_user_env(ENV_NO_PROXY) or machine
+        user_items = [item for item in _split_no_proxy(current) if item not in ours]
+        if hosts:
+            claims[key] = list(dict.fromkeys(hosts))
+        else:
+            claims.pop(key, None)
+        wanted = list(dict.fromkeys(h for hs in claims.values() for h in hs))
+        items = user_items + [h for h in wanted if h not in user_items]
+        value = ",".join(items) or None
+        if value is not None and not claims and value == machine:
+            value = None
+        marker = ";".join(f"{k}={','.join(hs)}" for k, hs in sorted(claims.items())) or None
+        set_user_env({ENV_NO_PROXY: value, NO_PROXY_MARKER: marker})
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""启动性能分析 - 记录启动各阶段的单调时间戳
+
+必须在导入 PyQt6 之前导入本模块，才能计入 PyQt6 的导入耗时。
+启用方式：命令行 ``--profile-startup [报告路径]`` 或环境变量
+``MIRROR_MANAGER_PROFILE_STARTUP``（值为 1 或报告路径）。
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from paths import base_dir
+
+ENV_REPORT = "MIRROR_MANAGER_PROFILE_STARTUP"
+ENV_TRACE = "MIRROR_MANAGER_PROFILE_TRACE"
+ENV_EXIT = "MIRROR_MANAGER_PROFILE_EXIT"
+
+DEFAULT_REPORT_NAME = "startup_profile.json"
+
+# 报告中的阶段耗时：名称 -> (起始标记, 结束标记)
+PHASE_DURATIONS = {
+    "pyinstaller_extract_ms": ("bootloader_start", "process_start"),
+    "python_boot_ms": ("process_start", "profiler_imported"),
+    "stdlib_import_ms": ("profiler_imported", "stdlib_imported"),
+    "pyqt_import_ms": ("stdlib_imported", "pyqt_imported"),
+    "qapp_create_ms": ("main_start", "qapp_created"),
+    "config_load_ms": ("qapp_created", "config_loaded"),
+    "init_ui_ms": ("init_ui_start", "ui_built"),
+    "load_current_config_ms": ("config_detect_start", "cards_populated"),
+    "time_to_first_paint_ms": ("process_start", "first_paint"),
+    "time_to_populated_ms": ("process_start", "cards_populated"),
+}
+
+
+def _filetime_to_unix(ft) -> float:
+    value = (ft.dwHighDateTime << 32) | ft.dwLowDateTime
+    return value / 1e7 - 11644473600
+
+
+def _process_creation_time(pid: Optional[int] = None) -> Optional[float]:
+    """获取进程创建时间（Unix 时间戳），失败返回 None"""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+
+            kernel32 = ctypes.windll.kernel32
+            if pid is None:
+                handle = kernel32.GetCurrentProcess()
+                close = False
+            else:
+                # PROCESS_QUERY_LIMITED_INFORMATION
+                handle = kernel32.OpenProcess(0x1000, False, pid)
+                if not handle:
+                    return None
+                close = True
+            try:
+                creation = wintypes.FILETIME()
+                exited = wintypes.FILETIME()
+                kernel = wintypes.FILETIME()
+                user = wintypes.FILETIME()
+                ok = kernel32.GetProcessTimes(
+                    handle,
+                    ctypes.byref(creation),
+                    ctypes.byref(exited),
+                    ctypes.byref(kernel),
+                    ctypes.byref(user)
+                )
+                return _filetime_to_unix(creation) if ok else None
+            finally:
+                if close:
+                    kernel32.CloseHandle(handle)
+
+        # Linux：/proc/<pid>/stat 第 22 项为开机后的时钟滴答数
+        stat_path = f"/proc/{pid or 'self'}/stat"
+        with open(stat_path, 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        start_ticks = int(fields[19])
+        with open('/proc/stat', 'r') as f:
+            btime = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return btime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except Exception:
+        return None
+
+
+def _is_onefile_bundle() -> bool:
+    """PyInstaller 单文件模式下，父进程是负责解压的引导程序"""
+    meipass = getattr(sys, '_MEIPASS', None)
+    if not getattr(sys, 'frozen', False) or not meipass:
+        return False
+    return os.path.basename(os.path.normpath(meipass)).startswith('_MEI')
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """注册启动分析相关的命令行参数"""
+    group = parser.add_argument_group("启动分析")
+    group.add_argument(
+        "--profile-startup", nargs="?", const="", default=None, metavar="PATH",
+        help="记录启动各阶段耗时并写入 JSON 报告"
+    )
+    group.add_argument(
+        "--profile-trace", default=None, metavar="PATH",
+        help="同时写出 Chrome trace 文件（chrome://tracing / Perfetto）"
+    )
+    group.add_argument(
+        "--profile-exit", action="store_true",
+        help="卡片加载完成、报告写出后自动退出"
+    )
+
+
+class StartupProfiler:
+    """启动分析器
+
+    所有时间点使用 ``time.perf_counter``（单调时钟），以本模块导入时刻为零点；
+    进程创建时间来自操作系统（墙上时钟），换算到同一时间轴上。
+    """
+
+    def __init__(self):
+        self._t0 = time.perf_counter()
+        self._wall0 = time.time()
+        self._marks: List[Tuple[str, float]] = []
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._written = False
+        self.enabled = False
+        self.report_path: Optional[str] = None
+        self.trace_path: Optional[str] = None
+        self.exit_when_done = False
+
+    def configure(self, argv: List[str], environ=os.environ):
+        """从命令行和环境变量读取配置（未知参数留给后续解析）"""
+        parser = argparse.ArgumentParser(add_help=False)
+        add_arguments(parser)
+        args, _ = parser.parse_known_args(argv[1:])
+
+        env_report = environ.get(ENV_REPORT, "")
+        report = args.profile_startup
+        if report is None and env_report:
+            report = "" if env_report in ("1", "true", "yes") else env_report
+        trace = args.profile_trace or environ.get(ENV_TRACE) or None
+
+        self.enabled = report is not None or trace is not None
+        if not self.enabled:
+            return
+        self.report_path = report or None
+        self.trace_path = trace
+        self.exit_when_done = args.profile_exit or environ.get(ENV_EXIT) == "1"
+
+        self._add_process_marks()
+        self.mark("profiler_imported", self._t0)
+
+    def _add_process_marks(self):
+        created = _process_creation_time()
+        if created is not None:
+            self._marks.append(("process_start", self._wall_to_perf(created)))
+            self._seen.add("process_start")
+        if _is_onefile_bundle():
+            parent_created = _process_creation_time(os.getppid())
+            if parent_created is not None:
+                self._marks.append(("bootloader_start", self._wall_to_perf(parent_created)))
+                self._seen.add("bootloader_start")
+
+    def _wall_to_perf(self, wall: float) -> float:
+        return self._t0 - (self._wall0 - wall)
+
+    def mark(self, name: str, at: Optional[float] = None):
+        """记录一个阶段时间点（同名只记录第一次）"""
+        if not self.enabled or name in self._seen:
+            return
+        with self._lock:
+            if name in self._seen:
+                return
+            self._seen.add(name)
+            self._marks.append((name, time.perf_counter() if at is None else at))
+
+    def has_mark(self, name: str) -> bool:
+        return name in self._seen
+
+    def _sorted_marks(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            return sorted(self._marks, key=lambda m: m[1])
+
+    def build_report(self) -> Dict:
+        """生成报告：各时间点（毫秒，相对分析器导入时刻）与阶段耗时"""
+        marks = self._sorted_marks()
+        times = dict(marks)
+        phases = []
+        prev = None
+        for name, at in marks:
+            phases.append({
+                "name": name,
+                "t_ms": round((at - self._t0) * 1000, 3),
+                "delta_ms": round((at - prev) * 1000, 3) if prev is not None else 0.0,
+            })
+            prev = at
+
+        durations = {}
+        for key, (start, end) in PHASE_DURATIONS.items():
+            if start in times and end in times:
+                durations[key] = round((times[end] - times[start]) * 1000, 3)
+
+        return {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "executable": sys.executable,
+            "frozen": bool(getattr(sys, 'frozen', False)),
+            "onefile": _is_onefile_bundle(),
+            "phases": phases,
+            "durations": durations,
+        }
+
+    def build_chrome_trace(self) -> Dict:
+        """生成 Chrome trace：相邻时间点之间为一个完整事件"""
+        marks = self._sorted_marks()
+        if not marks:
+            return {"traceEvents": []}
+        origin = marks[0][1]
+        pid = os.getpid()
+        events = [{
+            "name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+            "args": {"name": "MirrorManager startup"},
+        }]
+        for (name, at), (next_name, next_at) in zip(marks, marks[1:]):
+            events.append({
+                "name": f"{name} → {next_name}",
+                "cat": "startup",
+                "ph": "X",
+                "pid": pid,
+                "tid": 0,
+                "ts": round((at - origin) * 1e6, 1),
+                "dur": round((next_at - at) * 1e6, 1),
+            })
+        for name, at in marks:
+            events.append({
+                "name": name, "cat": "startup", "ph": "i", "s": "p",
+                "pid": pid, "tid": 0, "ts": round((at - origin) * 1e6, 1),
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def _default_report_path(self) -> str:
+        return os.path.join(base_dir(), DEFAULT_REPORT_NAME)
+
+    @staticmethod
+    def _write_json(path: str, data: Dict) -> str:
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            return path
+        except OSError:
+            # 程序目录不可写（如 Program Files）时退回临时目录
+            fallback = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+            with open(fallback, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            return fallback
+
+    def finish(self) -> Optional[str]:
+        """写出报告（只写一次），返回报告路径"""
+        if not self.enabled or self._written:
+            return None
+        self._written = True
+        path = self._write_json(self.report_path or self._default_report_path(), self.build_report())
+        if self.trace_path:
+            self._write_json(self.trace_path, self.build_chrome_trace())
+        return path
+
+
+# 全局分析器（默认关闭，mark() 仅做一次布尔判断）
+PROFILER = StartupProfiler()
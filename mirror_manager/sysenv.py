@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""系统操作封装 - git/python 子进程、用户环境变量（注册表）、环境变更广播、文件删除、网络信息
+
+所有操作都带追踪区间，方便定位“应用配置很慢”到底慢在哪一步。
+"""
+import ctypes
+import ipaddress
+import os
+import re
+import socket
+import shutil
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple, Optional
+
+try:
+    import winreg
+except ImportError:  # 非 Windows（开发/测试环境）
+    winreg = None
+
+from tracing import span
+
+USER_ENV_KEY = 'Environment'
+MACHINE_ENV_KEY = r'SYSTEM\CurrentControlSet\Control\Session Manager\Environment'
+
+HWND_BROADCAST = 0xFFFF
+WM_SETTINGCHANGE = 0x001A
+
+
+def _hidden_window_kwargs() -> dict:
+    """子进程不弹出控制台窗口"""
+    if not hasattr(subprocess, 'STARTUPINFO'):
+        return {}
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return {
+        'startupinfo': startupinfo,
+        'creationflags': subprocess.CREATE_NO_WINDOW,
+    }
+
+
+def run_git(args: List[str], timeout: float = 10, text: bool = True) -> subprocess.CompletedProcess:
+    """运行 git 命令（不弹窗口）"""
+    with span("git", "subprocess", argv=args, timeout=timeout) as sp:
+        result = subprocess.run(
+            ['git'] + args,
+            capture_output=True,
+            text=text,
+            timeout=timeout,
+            **_hidden_window_kwargs()
+        )
+        sp.set(returncode=result.returncode,
+               outcome="ok" if result.returncode == 0 else "nonzero")
+        return result
+
+
+def python_has_module(module: str, timeout: float = 10) -> bool:
+    """用户 PATH 中的 python 能否导入指定模块（本程序可能是打包的 exe，不能查自身环境）"""
+    for launcher in (['py', '-3'], ['python'], ['python3']):
+        if not shutil.which(launcher[0]):
+            continue
+        code = f"import importlib.util, sys; sys.exit(importlib.util.find_spec({module!r}) is None)"
+        with span("python", "subprocess", argv=launcher, module=module) as sp:
+            try:
+                result = subprocess.run(launcher + ['-c', code], capture_output=True,
+                                        timeout=timeout, **_hidden_window_kwargs())
+            except (OSError, subprocess.TimeoutExpired) as e:
+                sp.set(outcome="error", error=str(e))
+                continue
+            sp.set(returncode=result.returncode)
+            if result.returncode in (0, 1):
+                return result.returncode == 0
+    return False
+
+
+class EnvKey:
+    """注册表环境变量键（打开/读取/写入/删除均有追踪）"""
+
+    def __init__(self, access, machine: bool = False):
+        self.access = access
+        self.machine = machine
+        self._key = None
+
+    def __enter__(self):
+        hive = winreg.HKEY_LOCAL_MACHINE if self.machine else winreg.HKEY_CURRENT_USER
+        path = MACHINE_ENV_KEY if self.machine else USER_ENV_KEY
+        with span("winreg.open", "registry", path=path, machine=self.machine, access=self.access):
+            self._key = winreg.OpenKey(hive, path, 0, self.access)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        winreg.CloseKey(self._key)
+        return False
+
+    def get(self, name: str) -> Optional[str]:
+        """读取值，不存在返回 None"""
+        with span("winreg.query", "registry", name=name) as sp:
+            try:
+                value, _ = winreg.QueryValueEx(self._key, name)
+                return value
+            except FileNotFoundError:
+                sp.set(outcome="missing")
+                return None
+
+    def items(self) -> Dict[str, str]:
+        """所有字符串值（REG_EXPAND_SZ 已展开）"""
+        values = {}
+        with span("winreg.enum", "registry"):
+            index = 0
+            while True:
+                try:
+                    name, value, kind = winreg.EnumValue(self._key, index)
+                except OSError:
+                    break
+                index += 1
+                if kind == winreg.REG_EXPAND_SZ:
+                    value = winreg.ExpandEnvironmentStrings(value)
+                if isinstance(value, str):
+                    values[name] = value
+        return values
+
+    def stamp(self) -> int:
+        """键的最后写入时间（FILETIME）"""
+        with span("winreg.info", "registry"):
+            return winreg.QueryInfoKey(self._key)[2]
+
+    def set(self, name: str, value: str):
+        # 值可能含认证信息（如 PIP_INDEX_URL 中的 user:password@），追踪中只记长度
+        with span("winreg.set", "registry", name=name, length=len(value)):
+            winreg.SetValueEx(self._key, name, 0, winreg.REG_SZ, value)
+
+    def delete(self, name: str) -> bool:
+        """删除值，不存在时返回 False"""
+        with span("winreg.delete", "registry", name=name) as sp:
+            try:
+                winreg.DeleteValue(self._key, name)
+                return True
+            except FileNotFoundError:
+                sp.set(outcome="missing")
+                return False
+
+
+def user_env_stamp() -> Optional[int]:
+    """用户环境变量键的最后写入时间（用于缓存失效），不可用返回 None"""
+    if winreg is None:
+        return None
+    try:
+        with EnvKey(winreg.KEY_READ) as key:
+            return key.stamp()
+    except OSError:
+        return None
+
+
+def read_user_env(name: str, machine: bool = False) -> Optional[str]:
+    """从注册表读取用户（或系统）环境变量，失败返回 None"""
+    if winreg is None:
+        return None
+    try:
+        with EnvKey(winreg.KEY_READ, machine=machine) as key:
+            return key.get(name)
+    except OSError:
+        return None
+
+
+def read_user_env_all() -> Dict[str, str]:
+    """注册表中的全部用户环境变量，不可用返回空字典"""
+    if winreg is None:
+        return {}
+    try:
+        with EnvKey(winreg.KEY_READ) as key:
+            return key.items()
+    except OSError:
+        return {}
+
+
+def set_user_env(values: Dict[str, Optional[str]]):
+    """写入（值为 None 时删除）当前进程与用户级环境变量
+
+    同一个键打开一次写完所有值；调用方负责随后调用 ``broadcast_env_change``。
+    非 Windows 上没有用户级环境变量，只修改当前进程。
+    """
+    for name, value in values.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    if winreg is None:
+        return
+    with EnvKey(winreg.KEY_SET_VALUE) as key:
+        for name, value in values.items():
+            if value is None:
+                key.delete(name)
+            else:
+                key.set(name, value)
+
+
+def is_admin() -> bool:
+    """检测是否有管理员权限"""
+    try:
+        return bool(ctypes.windll.shell32.IsUserAnAdmin())
+    except Exception:
+        return False
+
+
+def broadcast_env_change():
+    """通知系统环境变量已更改（新开的终端立即生效）；非 Windows 上什么也不做"""
+    if winreg is None:
+        return
+    with span("broadcast.WM_SETTINGCHANGE", "broadcast") as sp:
+        result = ctypes.windll.user32.SendMessageTimeoutW(
+            HWND_BROADCAST,
+            WM_SETTINGCHANGE,
+            0,
+            'Environment',
+            0,
+            5000,
+            None
+        )
+        sp.set(result=result)
+
+
+def remove_file(path: str) -> bool:
+    """删除文件，不存在返回 False"""
+    if not os.path.exists(path):
+        return False
+    with span("file.remove", "file", path=path):
+        os.remove(path)
+    return True
+
+
+# ============ 网络信息 ============
+class NetworkInfo(NamedTuple):
+    """当前所在网络：默认网关、网关 MAC、本机出口地址与所在子网（未知的字段为空）"""
+    gateway: str
+    gateway_mac: str
+    address: str
+    subnet: str
+
+
+_MAC = re.compile(r'([0-9a-f]{2}[:-]){5}[0-9a-f]{2}', re.IGNORECASE)
+
+
+def _command_output(argv: List[str], timeout: float = 5) -> str:
+    try:
+        result = subprocess.run(argv, capture_output=True, text=True, timeout=timeout,
+                                errors='replace', **_hidden_window_kwargs())
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return result.stdout
+
+
+def local_address() -> str:
+    """本机访问外网时使用的地址（UDP connect 只选路由，不发包）"""
+    for family, target in ((socket.AF_INET, '192.0.2.1'), (socket.AF_INET6, '2001:db8::1')):
+        try:
+            with socket.socket(family, socket.SOCK_DGRAM) as sock:
+                sock.connect((target, 9))
+                return sock.getsockname()[0]
+        except OSError:
+            continue
+    return ""
+
+
+def default_gateway() -> str:
+    """IPv4 默认网关：Linux 读 /proc/net/route，Windows 解析 route print，其他系统用 route get"""
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/net/route', 'r') as f:
+                rows = [line.split() for line in f.readlines()[1:]]
+        except OSError:
+            return ""
+        defaults = sorted((int(row[6]), row[2]) for row in rows
+                          if len(row) > 6 and row[1] == '00000000' and int(row[3], 16) & 2)
+        if defaults:
+            return socket.inet_ntoa(bytes.fromhex(defaults[0][1])[::-1])
+        return ""
+    if sys.platform == 'win32':
+        routes = []
+        for line in _command_output(['route', 'print', '-4', '0.0.0.0']).splitlines():
+            fields = line.split()
+            if len(fields) == 5 and fields[0] == fields[1] == '0.0.0.0' and fields[4].isdigit():
+                routes.append((int(fields[4]), fields[2]))
+        return min(routes)[1] if routes else ""
+    match = re.search(r'gateway:\s*(\S+)', _command_output(['route', '-n', 'get', 'default']))
+    return match.group(1) if match else ""
+
+
+def gateway_mac(gateway: str) -> str:
+    """网关的 MAC 地址（区分网关地址相同的不同网络），查不到返回空字符串"""
+    if not gateway:
+        return ""
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/net/arp', 'r') as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields and fields[0] == gateway and fields[3] != '00:00:00:00:00:00':
+                        return fields[3].lower()
+        except OSError:
+            pass
+        return ""
+    argv = ['arp', '-a', gateway] if sys.platform == 'win32' else ['arp', '-n', gateway]
+    match = _MAC.search(_command_output(argv))
+    return match.group(0).lower().replace('-', ':') if match else ""
+
+
+# 模拟网络：该环境变量指向的文件内容作为"网关"，修改文件即模拟切换网络（测试网络切换用）
+ENV_SIMULATE_NETWORK = 'MIRROR_MANAGER_SIMULATE_NETWORK'
+
+
+def network_info() -> NetworkInfo:
+    """识别当前网络；子网按出口地址取 /24（IPv6 取 /64），不读取各平台的掩码配置"""
+    simulated = os.environ.get(ENV_SIMULATE_NETWORK)
+    if simulated:
+        try:
+            with open(simulated, 'r', encoding='utf-8') as f:
+                return NetworkInfo(f.read().strip(), "", "", "simulated")
+        except OSError:
+            return NetworkInfo("", "", "", "simulated")
+    with span("network.info", "network") as sp:
+        address = local_address()
+        subnet = ""
+        if address:
+            prefix = 64 if ':' in address else 24
+            subnet = str(ipaddress.ip_network(f"{address.split('%')[0]}/{prefix}", strict=False))
+        gateway = default_gateway()
+        info = NetworkInfo(gateway, gateway_mac(gateway), address, subnet)
+        sp.set(gateway=info.gateway, subnet=info.subnet)
+        return info
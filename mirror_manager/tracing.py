@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""结构化追踪 - 为子进程、注册表、广播、文件和网络操作记录耗时区间
+
+每个区间写成一行 JSON（JSON Lines），文件按大小轮转；
+关闭时 ``span()`` 直接返回共享的空对象，几乎没有开销。
+
+转换为 Chrome trace::
+
+    python tracing.py trace.jsonl [trace.jsonl.1 ...] -o trace.json
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+ENV_TRACE = "MIRROR_MANAGER_TRACE"
+DEFAULT_TRACE_NAME = "trace.jsonl"
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """注册追踪相关的命令行参数"""
+    group = parser.add_argument_group("追踪")
+    group.add_argument(
+        "--trace", nargs="?", const="", default=None, metavar="PATH",
+        help="将子进程/注册表/网络操作的耗时写入 JSON Lines 文件"
+    )
+
+
+class _RotatingWriter:
+    """按大小轮转的追加写入器（trace.jsonl -> trace.jsonl.1 -> ...）"""
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, line: str):
+        with self._lock:
+            if self._file.tell() + len(line) > self.max_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class _NullSpan:
+    """追踪关闭时使用的空区间"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """一次操作的耗时区间"""
+
+    __slots__ = ("_tracer", "name", "cat", "args", "fields", "_start", "_wall")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: Dict):
+        self._tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.fields: Dict = {}
+
+    def __enter__(self):
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is None:
+            outcome = self.fields.pop("outcome", "ok")
+        else:
+            outcome = "error"
+            self.fields.setdefault("error", f"{exc_type.__name__}: {exc}")
+        self._tracer._emit({
+            "name": self.name,
+            "cat": self.cat,
+            "start": round(self._wall, 6),
+            "end": round(self._wall + (end - self._start), 6),
+            "dur_ms": round((end - self._start) * 1000, 3),
+            "outcome": outcome,
+            "args": self.args,
+            **self.fields,
+        })
+        return False
+
+    def set(self, **fields):
+        """补充结果字段（如 returncode、status）；outcome 可覆盖默认的 ok"""
+        self.fields.update(fields)
+
+
+class Tracer:
+    """追踪器"""
+
+    def __init__(self):
+        self.enabled = False
+        self._writer: Optional[_RotatingWriter] = None
+        self._pid = os.getpid()
+
+    def configure(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                  backups: int = DEFAULT_BACKUPS):
+        """开启追踪并写入指定文件"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.close()
+        self._writer = _RotatingWriter(path, max_bytes, backups)
+        self.enabled = True
+
+    def close(self):
+        self.enabled = False
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    def span(self, name: str, cat: str = "app", **args):
+        """返回区间上下文管理器；关闭时返回空对象"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, cat, args)
+
+    def event(self, name: str, cat: str = "app", **args):
+        """记录瞬时事件"""
+        if not self.enabled:
+            return
+        now = round(time.time(), 6)
+        self._emit({"name": name, "cat": cat, "start": now, "end": now,
+                    "dur_ms": 0.0, "outcome": "event", "args": args})
+
+    def _emit(self, record: Dict):
+        writer = self._writer
+        if writer is None:
+            return
+        thread = threading.current_thread()
+        record["pid"] = self._pid
+        record["tid"] = thread.ident
+        record["thread"] = thread.name
+        try:
+            writer.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except (OSError, ValueError):
+            pass
+
+
+# 全局追踪器（默认关闭）
+TRACER = Tracer()
+
+
+def span(name: str, cat: str = "app", **args):
+    return TRACER.span(name, cat, **args)
+
+
+def event(name: str, cat: str = "app", **args):
+    TRACER.event(name, cat, **args)
+
+
+def read_records(paths: Iterable[str]) -> List[Dict]:
+    """读取 JSON Lines 文件（忽略损坏的行），按开始时间排序"""
+    records = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    records.sort(key=lambda r: r.get("start", 0))
+    return records
+
+
+def to_chrome_trace(records: List[Dict]) -> Dict:
+    """转换为 Chrome trace（chrome://tracing / Perfetto 可直接打开）"""
+    events = []
+    threads = {}
+    for rec in records:
+        pid = rec.get("pid", 0)
+        tid = rec.get("tid", 0)
+        threads[(pid, tid)] = rec.get("thread", str(tid))
+        args = dict(rec.get("args") or {})
+        for key, value in rec.items():
+            if key not in ("name", "cat", "start", "end", "dur_ms", "args", "pid", "tid", "thread"):
+                args[key] = value
+        event = {
+            "name": rec.get("name", "?"),
+            "cat": rec.get("cat", "app"),
+            "pid": pid,
+            "tid": tid,
+            "ts": round(rec.get("start", 0) * 1e6, 1),
+            "args": args,
+        }
+        if rec.get("outcome") == "event":
+            event.update(ph="i", s="t")
+        else:
+            event.update(ph="X", dur=round(rec.get("dur_ms", 0) * 1000, 1))
+        events.append(event)
+    for (pid, tid), name in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": name}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="将追踪日志转换为 Chrome trace")
+    parser.add_argument("inputs", nargs="+", help="trace.jsonl 文件（可含轮转文件）")
+    parser.add_argument("-o", "--output", default="trace.json", help="输出路径")
+    args = parser.parse_args(argv)
+    trace = to_chrome_trace(read_records(args.inputs))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(trace, f, ensure_ascii=False)
+    print(f"已写入 {len(trace['traceEvents'])} 个事件: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
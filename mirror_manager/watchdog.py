@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""UI 线程卡顿监测 - 事件循环延迟直方图与卡顿堆栈捕获
+
+高频定时器测量自身触发的延迟；辅助线程发现主线程心跳超时后，
+在卡顿期间抓取主线程的 Python 堆栈，卡顿结束时连同时长一起记录。
+"""
+import argparse
+import bisect
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional, Tuple
+
+from PyQt6.QtCore import QObject, QTimer, Qt, QRectF, pyqtSignal
+from PyQt6.QtGui import QPainter, QColor, QFont, QPen
+from PyQt6.QtWidgets import QWidget
+
+from tracing import event as trace_event
+
+ENV_WATCHDOG = "MIRROR_MANAGER_WATCHDOG"
+DEFAULT_THRESHOLD_MS = 50
+DEFAULT_INTERVAL_MS = 10
+
+logger = logging.getLogger("mirror_manager.watchdog")
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """注册卡顿监测相关的命令行参数"""
+    group = parser.add_argument_group("卡顿监测")
+    group.add_argument(
+        "--watchdog", nargs="?", type=float, const=DEFAULT_THRESHOLD_MS, default=None,
+        metavar="MS", help=f"监测 UI 线程卡顿，超过阈值（默认 {DEFAULT_THRESHOLD_MS}ms）记录堆栈"
+    )
+
+
+def threshold_from(args: argparse.Namespace, environ) -> Optional[float]:
+    """命令行优先，其次环境变量（值为阈值毫秒数或 1）；未开启返回 None"""
+    if args.watchdog is not None:
+        return args.watchdog
+    value = environ.get(ENV_WATCHDOG)
+    if not value:
+        return None
+    try:
+        ms = float(value)
+    except ValueError:
+        return None
+    return DEFAULT_THRESHOLD_MS if ms == 1 else ms
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图（毫秒）"""
+
+    BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, ms: float):
+        with self._lock:
+            self.counts[bisect.bisect_right(self.BOUNDS, ms)] += 1
+            self.total += 1
+            if ms > self.max_ms:
+                self.max_ms = ms
+
+    def labels(self) -> List[str]:
+        return [f"<{bound}" for bound in self.BOUNDS] + [f"≥{self.BOUNDS[-1]}"]
+
+    def percentile(self, p: float) -> float:
+        """按桶上界估算百分位（毫秒）"""
+        with self._lock:
+            if not self.total:
+                return 0.0
+            target = self.total * p / 100
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    return float(self.BOUNDS[i]) if i < len(self.BOUNDS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> List[int]:
+        with self._lock:
+            return list(self.counts)
+
+
+class EventLoopMonitor(QObject):
+    """事件循环延迟监测器"""
+
+    # 卡顿时长（毫秒）, 主线程堆栈
+    stall_detected = pyqtSignal(float, str)
+
+    def __init__(self, threshold_ms: float = DEFAULT_THRESHOLD_MS,
+                 interval_ms: int = DEFAULT_INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        self.threshold_ms = threshold_ms
+        self.interval_ms = interval_ms
+        self.histogram = LatencyHistogram()
+        self.stall_count = 0
+
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self._timer.timeout.connect(self._on_tick)
+
+        self._main_ident = threading.main_thread().ident
+        self._heartbeat = 0.0
+        self._expected = 0.0
+        # (所属心跳, 堆栈)：只用于该心跳之后的那次卡顿
+        self._captured: Optional[Tuple[float, str]] = None
+        self._stack_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._helper: Optional[threading.Thread] = None
+
+    def start(self):
+        now = time.perf_counter()
+        self._heartbeat = now
+        self._expected = now + self.interval_ms / 1000
+        self._timer.start(self.interval_ms)
+        self._stop.clear()
+        self._helper = threading.Thread(target=self._watch, name="ui-watchdog", daemon=True)
+        self._helper.start()
+
+    def stop(self):
+        self._timer.stop()
+        self._stop.set()
+
+    def _on_tick(self):
+        """定时器回调（主线程）：实际触发时间与预期之差即事件循环延迟"""
+        now = time.perf_counter()
+        lag_ms = max(0.0, (now - self._expected) * 1000)
+        self._expected = now + self.interval_ms / 1000
+        previous = self._heartbeat
+        self._heartbeat = now
+        self.histogram.add(lag_ms)
+
+        # 每次心跳都取走堆栈：未报告的短暂停顿留下的堆栈不能留给之后的卡顿
+        with self._stack_lock:
+            captured = self._captured
+            self._captured = None
+        if lag_ms >= self.threshold_ms:
+            stack = captured[1] if captured and captured[0] == previous else None
+            self._report_stall(lag_ms, stack or "（卡顿期间未捕获到堆栈）")
+
+    def _watch(self):
+        """辅助线程：主线程心跳超时即抓取其堆栈（每次卡顿只抓一次）"""
+        poll = max(self.threshold_ms / 4000, 0.005)
+        while not self._stop.wait(poll):
+            heartbeat = self._heartbeat
+            silent_ms = (time.perf_counter() - heartbeat) * 1000
+            if silent_ms < self.threshold_ms:
+                continue
+            with self._stack_lock:
+                if self._captured is not None and self._captured[0] == heartbeat:
+                    continue
+                frame = sys._current_frames().get(self._main_ident)
+                if frame is not None:
+                    self._captured = (heartbeat, "".join(traceback.format_stack(frame)))
+
+    def _report_stall(self, lag_ms: float, stack: str):
+        self.stall_count += 1
+        logger.warning("UI 线程卡顿 %.1fms（阈值 %.0fms），主线程堆栈：\n%s",
+                       lag_ms, self.threshold_ms, stack)
+        trace_event("ui.stall", "ui", dur_ms=round(lag_ms, 3), stack=stack)
+        self.stall_detected.emit(lag_ms, stack)
+
+
+class LatencyOverlay(QWidget):
+    """调试浮层：事件循环延迟直方图（F12 切换）"""
+
+    def __init__(self, monitor: EventLoopMonitor, parent=None):
+        super().__init__(parent)
+        self.monitor = monitor
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.setFixedSize(300, 170)
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.timeout.connect(self.update)
+        self.hide()
+
+    def toggle(self):
+        if self.isVisible():
+            self._refresh_timer.stop()
+            self.hide()
+        else:
+            self.raise_()
+            self.show()
+            self._refresh_timer.start(500)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        rect = QRectF(self.rect())
+        painter.setBrush(QColor(10, 15, 25, 220))
+        painter.setPen(QPen(QColor(255, 255, 255, 60), 1))
+        painter.drawRoundedRect(rect.adjusted(0.5, 0.5, -0.5, -0.5), 10, 10)
+
+        hist = self.monitor.histogram
+        counts = hist.snapshot()
+        labels = hist.labels()
+
+        painter.setPen(QColor(255, 255, 255, 220))
+        painter.setFont(QFont("Microsoft YaHei", 9))
+        painter.drawText(
+            QRectF(10, 6, rect.width() - 20, 18), Qt.AlignmentFlag.AlignLeft,
+            f"事件循环延迟  p50 {hist.percentile(50):.0f}ms  p99 {hist.percentile(99):.0f}ms  "
+            f"max {hist.max_ms:.0f}ms  卡顿 {self.monitor.stall_count}"
+        )
+
+        # 对数刻度的柱状图，避免正常样本把卡顿样本压扁
+        top, bottom = 30.0, rect.height() - 24
+        left, width = 10.0, rect.width() - 20
+        bar_w = width / len(counts)
+        peak = max(counts) or 1
+        scale_max = math.log1p(peak)
+        for i, count in enumerate(counts):
+            h = (bottom - top) * math.log1p(count) / scale_max if count else 0
+            x = left + i * bar_w
+            over = hist.BOUNDS[i - 1] >= self.monitor.threshold_ms if i > 0 else False
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor(231, 76, 60, 200) if over else QColor(80, 220, 160, 200))
+            painter.drawRect(QRectF(x + 2, bottom - h, bar_w - 4, h))
+
+            painter.setPen(QColor(255, 255, 255, 150))
+            painter.setFont(QFont("Microsoft YaHei", 7))
+            painter.drawText(QRectF(x, bottom + 2, bar_w, 12), Qt.AlignmentFlag.AlignCenter, labels[i])
+            if count:
+                painter.drawText(QRectF(x, bottom - h - 12, bar_w, 12),
+                                 Qt.AlignmentFlag.AlignCenter, str(count))